@@ -24,17 +24,55 @@
 """FreeBSD jail sysctl bindings."""
 import typing
 import ctypes
+import errno
+import os
+import time
+import threading
 import itertools
 import ipaddress
 
-import freebsd_sysctl
-import freebsd_sysctl.types
-
-from jail.libc import dll
+import jail.libc
 import jail.types
 
+if typing.TYPE_CHECKING:
+    import freebsd_sysctl
+
 NULL_BYTES = b"\x00"
-JAIL_MAX_AF_IPS = freebsd_sysctl.Sysctl("security.jail.jail_max_af_ips").value
+ERRMSG_KEY = b"errmsg" + NULL_BYTES
+ERRMSG_SIZE = 256
+IOVEC_ALIGNMENT = 8
+
+JAIL_CREATE = 0x01
+JAIL_UPDATE = 0x02
+JAIL_ATTACH = 0x04
+JAIL_DYING = 0x08
+
+WAIT_MIN_INTERVAL = 0.001
+WAIT_MAX_INTERVAL = 0.1
+
+import jail.params  # noqa: E402
+import jail.codecs  # noqa: E402
+import jail.metrics  # noqa: E402
+
+
+def get_jail_max_af_ips() -> int:
+    """Return security.jail.jail_max_af_ips from the parameter metadata."""
+    try:
+        return globals()["JAIL_MAX_AF_IPS"]
+    except KeyError:
+        pass
+    value = jail.params.get_table().jail_max_af_ips
+    globals()["JAIL_MAX_AF_IPS"] = value
+    return value
+
+
+def __getattr__(name: str) -> typing.Any:
+    # libc and sysctl values are resolved on first use, not on import
+    if name == "dll":
+        return jail.libc.dll
+    elif name == "JAIL_MAX_AF_IPS":
+        return get_jail_max_af_ips()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Iovec(ctypes.Structure):
@@ -45,23 +83,70 @@ class Iovec(ctypes.Structure):
 
 
 class IovecKey:
+    """
+    An immutable jail parameter name.
+
+    Keys are interned with IovecKey.intern, so each name is encoded and
+    hashed once per process and shared by every Jiov that uses it.
+    """
+
+    __slots__ = ("_value", "_name", "_hash", "_native", "_buffer", "_iovec")
+
+    _value: bytes
+    _name: str
+    _hash: int
+    _native: typing.Optional[bytes]
+    _buffer: typing.Optional[ctypes.Array]
+    _iovec: typing.Optional[Iovec]
 
     def __init__(self, value: typing.Union[str, bytes]) -> None:
         if isinstance(value, bytes) is True:
-            self.value = value
+            self._value = value
+            self._name = value.decode()
         elif isinstance(value, str) is True:
-            self.value = value.encode()
+            self._value = value.encode()
+            self._name = value
         else:
             raise KeyError(
                 f"bytes or string expected, but got: {type(value).__name__}"
             )
+        self._hash = hash(self._value)
+        self._native = None
+        self._buffer = None
+        self._iovec = None
+
+    @classmethod
+    def intern(
+        cls,
+        key: typing.Union['IovecKey', str, bytes]
+    ) -> 'IovecKey':
+        """Return the shared IovecKey of a parameter name."""
+        if isinstance(key, IovecKey) is True:
+            return typing.cast(IovecKey, key)
+        try:
+            return _interned_keys[key]
+        except KeyError:
+            pass
+        except TypeError:
+            raise KeyError(
+                f"bytes or string expected, but got: {type(key).__name__}"
+            )
+        iovec_key = cls(key)
+        # dict.setdefault is atomic, concurrent threads agree on one key
+        iovec_key = _interned_keys.setdefault(iovec_key._value, iovec_key)
+        _interned_keys.setdefault(iovec_key._name, iovec_key)
+        return iovec_key
+
+    @property
+    def value(self) -> bytes:
+        return self._value
 
     def __repr__(self) -> str:
         return self.__str__();
         #return f"<{self.__class__.__name__}: \"{str(self)}\">"
 
     def __str__(self) -> str:
-        return self.value.decode()
+        return self._name
 
     def __bytes__(self) -> bytes:
         return self.value
@@ -70,20 +155,29 @@ class IovecKey:
         return len(self.value)
 
     def __hash__(self) -> int:
-        return hash(self.value)
+        return self._hash
 
     def __eq__(self, other: 'IovecKey') -> bool:
-        return self.__hash__() == other.__hash__()
+        return (self is other) or (self._hash == other.__hash__())
 
     @property
-    def iovec(self) -> ctypes.c_void_p:
-        return (Iovec(
-            ctypes.cast(
-                ctypes.c_char_p(bytes(self) + NULL_BYTES),
-                ctypes.c_void_p
-            ),
-            len(self) + len(NULL_BYTES)
-        ))
+    def native(self) -> bytes:
+        """Return the NUL-terminated key as passed to the kernel."""
+        if self._native is None:
+            self._native = self._value + NULL_BYTES
+        return self._native
+
+    @property
+    def iovec(self) -> Iovec:
+        """Return an Iovec of the key backed by memory the key owns."""
+        if self._iovec is None:
+            native = self.native
+            self._buffer = ctypes.create_string_buffer(native, len(native))
+            self._iovec = Iovec(ctypes.addressof(self._buffer), len(native))
+        return self._iovec
+
+
+_interned_keys: typing.Dict[typing.Union[str, bytes], IovecKey] = {}
 
 
 RawIovecValue = typing.Optional[typing.Union[
@@ -102,36 +196,71 @@ IovecValueOutput = typing.Union[
 
 
 class IovecValue:
+    """
+    A jail parameter value.
+
+    The native encoding, the buffer holding it and its Iovec are built once
+    and cached until a new value is set.
+    """
+
+    __slots__ = (
+        "_value",
+        "_output_size",
+        "_encoded",
+        "_native",
+        "_legacy",
+        "_buffer",
+        "_iovec",
+        "_addresses",
+        "codec"
+    )
 
     _value: RawIovecValue
+    _output_size: typing.Optional[int]
+    _encoded: bool
+    _native: typing.Optional[bytes]
+    _legacy: typing.Optional[bytes]
+    _buffer: typing.Optional[ctypes.Array]
+    _iovec: typing.Optional[Iovec]
+    _addresses: typing.Optional[ctypes.Array]
+    codec: typing.Optional['jail.codecs.Codec']
 
     def __init__(
         self,
-        value: IovevValueInput
+        value: IovevValueInput,
+        codec: typing.Optional['jail.codecs.Codec']=None
     ) -> None:
+        self.codec = codec
         self.value = value
 
+    @classmethod
+    def output(cls, size: int) -> 'IovecValue':
+        """Create a zeroed buffer of size bytes for jail_get (2) to fill."""
+        value = cls(None)
+        value._output_size = size
+        return value
+
+    @property
+    def is_output(self) -> bool:
+        return (self._output_size is not None) is True
+
     @property
     def value(self) -> RawIovecValue:
         value = self._value
         if isinstance(value, list):
             if len(value) == 0:
                 return None
-            elif len(value) > JAIL_MAX_AF_IPS:
-                raise ValueError("Too many IPs (max {JAIL_MAX_AF_IPS}")
-            elif isinstance(value[0], ipaddress.IPv4Address):
-                list_type = jail.types.in_addr
-                value_type = int
-            elif isinstance(value[0], ipaddress.IPv6Address):
-                list_type = jail.types.in6_addr
-                value_type = jail.types.in6_addr_U_from_ip
-            else:
-                raise TypeError("Expected IP Address")
-            output_type = list_type * len(value)
-            return output_type(*[list_type(value_type(x)) for x in value])
+            elif self._addresses is None:
+                self._addresses = jail.types.address_array(
+                    self.buffer,
+                    ipaddress.ip_address(value[0]).version
+                )
+            return self._addresses
         elif isinstance(value, int) or (value is None):
             return value
-        return value + (NULL_BYTES * (value[-1:] == NULL_BYTES))
+        elif self._legacy is None:
+            self._legacy = value + (NULL_BYTES * (value[-1:] == NULL_BYTES))
+        return self._legacy
 
     @property
     def raw_value(self) -> RawIovecValue:
@@ -139,8 +268,20 @@ class IovecValue:
 
     @value.setter
     def value(self, value: RawIovecValue) -> None:
-        if isinstance(value, list):
-            self._value = value
+        self._output_size = None
+        self._encoded = False
+        self._native = None
+        self._legacy = None
+        self._buffer = None
+        self._iovec = None
+        self._addresses = None
+        if isinstance(value, (list, tuple)) is True:
+            self._value = list(value)
+        elif isinstance(
+            value,
+            (ipaddress.IPv4Address, ipaddress.IPv6Address)
+        ) is True:
+            self._value = [value]
         else:
             self._value = self.__convert_value(value)
 
@@ -162,6 +303,8 @@ class IovecValue:
         #return f"<{self.__class__.__name__}: \"{str(self)}\">"
 
     def __len__(self) -> int:
+        if self._output_size is not None:
+            return self._output_size
         value = self.value
         if value is None:
             return 0
@@ -181,52 +324,87 @@ class IovecValue:
         raise ValueError("cannot convert value to int")
 
     @property
-    def iovec(self) -> typing.Union[ctypes.POINTER, int]:
-
-        if self.value is None:
-            return Iovec(ctypes.c_void_p(), 0)
-
-        elif isinstance(self.value, bytes) is True:
-            return Iovec(
-                ctypes.cast(
-                    ctypes.c_char_p(self.value + NULL_BYTES),
-                    ctypes.c_void_p
-                ),
-                self.__len__() + len(NULL_BYTES)
-            )
-
-        elif isinstance(self.value, int) is True:
-            if not jail.types.MIN_INT <= self.value <= jail.types.MAX_INT:
+    def native(self) -> typing.Optional[bytes]:
+        """Return the value as passed to the kernel or None for NULL."""
+        if self._encoded is False:
+            self._native = self.__encode()
+            self._encoded = True
+        return self._native
+
+    def __encode(self) -> typing.Optional[bytes]:
+        if self._output_size is not None:
+            return bytes(self._output_size)
+        value = self._value
+        if self.codec is not None:
+            return self.codec.encode(value)
+        elif value is None:
+            return None
+        elif isinstance(value, list) is True:
+            return self.__pack_addresses(value)
+        elif isinstance(value, int) is True:
+            if not jail.types.MIN_INT <= value <= jail.types.MAX_INT:
                 raise OverflowError("Integer parameter out of range")
-            return Iovec(
-                ctypes.cast(
-                    ctypes.POINTER(ctypes.c_int)(ctypes.c_int(self.value)),
-                    ctypes.c_void_p
-                ),
-                self.__len__()
-            )
+            return bytes(ctypes.c_int(value))
+        return self.value + NULL_BYTES
 
-        elif isinstance(self._value, list) is True:
-            if len(self._value) == 0:
-                return Iovec(ctypes.c_void_p(), 0)
-            output_type = type(self.value[0])
-            return Iovec(
-                ctypes.cast(
-                    ctypes.POINTER(output_type)(self.value),
-                    ctypes.c_void_p
-                ),
-                ctypes.sizeof(output_type * len(self._value))
-            )
+    @staticmethod
+    def __pack_addresses(
+        value: typing.List[
+            typing.Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+        ]
+    ) -> typing.Optional[bytes]:
+        if len(value) == 0:
+            return None
+        elif len(value) > get_jail_max_af_ips():
+            raise ValueError(f"Too many IPs (max {get_jail_max_af_ips()})")
+        address_type = type(value[0])
+        if address_type not in (ipaddress.IPv4Address, ipaddress.IPv6Address):
+            raise TypeError("Expected IP Address")
+        for address in value:
+            if type(address) is not address_type:
+                raise TypeError("Expected IP Address")
+        return jail.types.pack_addresses(value)
 
-        else:
-            # XXX: IP Addrs, JailSys Enums (new, inherit, disabled)
-            raise NotImplementedError
+    @property
+    def buffer(self) -> typing.Optional[ctypes.Array]:
+        """Return a writable buffer holding the native value."""
+        if self._buffer is None:
+            native = self.native
+            if native is None:
+                return None
+            self._buffer = ctypes.create_string_buffer(native, len(native))
+        return self._buffer
+
+    @property
+    def iovec(self) -> Iovec:
+        """Return an Iovec of the value backed by memory the value owns."""
+        if self._iovec is None:
+            buffer = self.buffer
+            if buffer is None:
+                self._iovec = Iovec(None, 0)
+            else:
+                self._iovec = Iovec(
+                    ctypes.addressof(buffer),
+                    ctypes.sizeof(buffer)
+                )
+        return self._iovec
+
+
+def to_iovec_value(
+    key: IovecKey,
+    value: typing.Optional[typing.Union[IovevValueInput, IovecValue]]
+) -> IovecValue:
+    """Wrap a raw value with the codec of its jail parameter."""
+    if isinstance(value, IovecValue) is True:
+        return value
+    return IovecValue(value, codec=jail.codecs.find_codec(str(key)))
 
 
 class ByteDict(dict):
     """A dict with bytes as keys."""
 
-    cached_sysctls: typing.Dict[str, freebsd_sysctl.Sysctl] = {}
+    cached_sysctls: typing.Dict[str, 'freebsd_sysctl.Sysctl'] = {}
+    _lock = threading.Lock()
 
     def __init__(
         self,
@@ -245,6 +423,7 @@ class ByteDict(dict):
         if isinstance(value, IovecValue) is False:
             raise TypeError("IovecValue expected")
 
+        import freebsd_sysctl.types
         sysctl = self.__get_sysctl(key)
 
         if sysctl.ctl_type == freebsd_sysctl.types.STRING:
@@ -257,11 +436,13 @@ class ByteDict(dict):
 
         super().__setitem__(self.__getkey(key), value)
 
-    def __get_sysctl(self, key: str) -> freebsd_sysctl.Sysctl:
+    def __get_sysctl(self, key: str) -> 'freebsd_sysctl.Sysctl':
+        import freebsd_sysctl
         _key = self.__getkey(key).decode("UTF-8")
-        if _key not in self.cached_sysctls.keys():
-            self.cached_sysctls[_key] = freebsd_sysctl.Sysctl(_key)
-        return self.cached_sysctls[_key]
+        with self._lock:
+            if _key not in self.cached_sysctls.keys():
+                self.cached_sysctls[_key] = freebsd_sysctl.Sysctl(_key)
+            return self.cached_sysctls[_key]
 
     def __getitem__(
         self,
@@ -280,6 +461,8 @@ class ByteDict(dict):
 class JiovData(dict):
     """Jiov data storage and wrapper."""
 
+    __slots__ = ()
+
     def __init__(
         self,
         data: typing.Dict[
@@ -289,45 +472,58 @@ class JiovData(dict):
     ) -> None:
         super().__init__()
         for key, value in data.items():
-            self[key] = data[key]
+            self[key] = value
 
     def __setitem__(
         self,
         key: typing.Union[IovecKey, bytes, str],
         value: typing.Optional[typing.Union[bytes, int, IovecValue]]
     ) -> None:
-        super().__setitem__(IovecKey(key), IovecValue(value))
+        _key = IovecKey.intern(key)
+        super().__setitem__(_key, to_iovec_value(_key, value))
 
     def __getitem__(
         self,
         key: typing.Union[IovecKey, bytes, str]
     ) -> IovecValue:
-        return super().__getitem__(
-            (key if isinstance(key, IovecKey) else IovecKey(key))
-        )
+        return super().__getitem__(IovecKey.intern(key))
+
+    def __delitem__(self, key: typing.Union[IovecKey, bytes, str]) -> None:
+        super().__delitem__(IovecKey.intern(key))
+
+    def update(  # type: ignore
+        self,
+        data: typing.Dict[
+            typing.Union[IovecKey, bytes, str],
+            IovecValue
+        ]
+    ) -> None:
+        for key, value in data.items():
+            self[key] = value
 
     def keys(self) -> typing.KeysView[IovecKey]:
-        return typing.cast(
-            typing.KeysView[IovecKey],
-            (self.__getkey(x) for x in super().keys())
-        )
+        return super().keys()
 
     def items(self) -> typing.ItemsView[IovecKey, IovecValue]:
-        return typing.cast(
-            typing.ItemsView[IovecKey, IovecValue],
-            ((x, self[x]) for x in self.keys())
-        )
-
-    def __getkey(self, key: typing.Union[IovecKey, bytes, str]) -> bytes:
-        if isinstance(key, IovecKey) is True:
-            return key
-        return IovecKey(super().__getkey(key))
+        return super().items()
 
 
 class Jiov(JiovData):
+    """
+    Jail parameters marshalled for jail_set (2) and jail_get (2).
+
+    All keys and values are compiled into one contiguous ctypes buffer that
+    is referenced by an Iovec array. Both are kept alive by the Jiov and are
+    reused across syscalls until a parameter is changed through the Jiov.
+    """
 
     errmsg: ctypes.c_char*256
-    
+    _buffer: typing.Optional[ctypes.Array]
+    _iovecs: typing.Optional[ctypes.Array]
+    _pristine: typing.Optional[ctypes.Array]
+    _pointer: typing.Optional[typing.Any]
+    _indices: typing.Dict[IovecKey, int]
+
     def __init__(
         self,
         params: typing.Dict[
@@ -335,44 +531,370 @@ class Jiov(JiovData):
             IovecValue
         ]
     ) -> None:
-        self.errmsg = ctypes.create_string_buffer(256)
+        self.errmsg = ctypes.create_string_buffer(ERRMSG_SIZE)
+        self.invalidate()
         super().__init__(params)
 
     def __len__(self) -> int:
         return (dict.__len__(self) * 2) + 2
 
+    def __setitem__(
+        self,
+        key: typing.Union[IovecKey, bytes, str],
+        value: typing.Optional[typing.Union[bytes, int, IovecValue]]
+    ) -> None:
+        self.invalidate()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: typing.Union[IovecKey, bytes, str]) -> None:
+        self.invalidate()
+        super().__delitem__(key)
+
+    def pop(self, *args: typing.Any) -> IovecValue:  # type: ignore
+        self.invalidate()
+        return super().pop(*args)
+
+    def popitem(self) -> typing.Tuple[IovecKey, IovecValue]:
+        self.invalidate()
+        return super().popitem()
+
+    def clear(self) -> None:
+        self.invalidate()
+        super().clear()
+
+    def invalidate(self) -> None:
+        """
+        Drop the compiled buffer.
+
+        Changes made through the Jiov invalidate automatically. Call this
+        after modifying an IovecValue of this Jiov in place.
+        """
+        self._buffer = None
+        self._iovecs = None
+        self._pristine = None
+        self._pointer = None
+        self._indices = {}
+
+    def compile(self) -> ctypes.Array:
+        """
+        Return the Iovec array of the compiled parameter buffer.
+
+        The buffer is built on first use and reused afterwards. Iovec lengths
+        the kernel rewrote during a previous jail_get (2) are restored and
+        the errmsg is cleared on every call.
+        """
+        if self._iovecs is not None:
+            ctypes.memmove(
+                self._iovecs,
+                self._pristine,
+                ctypes.sizeof(self._iovecs)
+            )
+            self.errmsg[0] = NULL_BYTES
+            return self._iovecs
+
+        metrics = jail.metrics.current
+        if metrics is not None:
+            start = time.perf_counter()
+
+        chunks: typing.List[typing.Optional[bytes]] = []
+        indices: typing.Dict[IovecKey, int] = {}
+        for key, value in self.items():
+            indices[key] = len(chunks) + 1
+            if value.codec is None:
+                chunks.append(key.native)
+            else:
+                chunks.append(value.codec.encode_key(
+                    key.native,
+                    value.raw_value
+                ))
+            chunks.append(value.native)
+        chunks.append(ERRMSG_KEY)
+
+        offsets: typing.List[int] = []
+        data: typing.List[bytes] = []
+        size = 0
+        for chunk in chunks:
+            offsets.append(size)
+            if chunk is None:
+                continue
+            padding = NULL_BYTES * (-len(chunk) % IOVEC_ALIGNMENT)
+            data.append(chunk + padding)
+            size += len(chunk) + len(padding)
+
+        buffer = (ctypes.c_char * max(size, 1)).from_buffer_copy(
+            b"".join(data).ljust(max(size, 1), NULL_BYTES)
+        )
+        base = ctypes.addressof(buffer)
+
+        iovecs = (Iovec * (len(chunks) + 1))()
+        for i, chunk in enumerate(chunks):
+            if chunk is None:
+                continue
+            iovecs[i].iov_base = base + offsets[i]
+            iovecs[i].iov_size = len(chunk)
+        iovecs[-1].iov_base = ctypes.addressof(self.errmsg)
+        iovecs[-1].iov_size = len(self.errmsg)
+        self.errmsg[0] = NULL_BYTES
+
+        self._buffer = buffer
+        self._iovecs = iovecs
+        self._pristine = (Iovec * len(iovecs)).from_buffer_copy(iovecs)
+        self._pointer = ctypes.pointer(iovecs)
+        self._indices = indices
+        if metrics is not None:
+            metrics.record(
+                "marshal",
+                time.perf_counter() - start,
+                size=size
+            )
+        return iovecs
+
+    def read(self, key: typing.Union[IovecKey, bytes, str]) -> bytes:
+        """Return the value of a parameter as written by jail_get (2)."""
+        if self._iovecs is None:
+            raise ValueError("Jiov was not compiled")
+        iovec = self._iovecs[self._indices[IovecKey.intern(key)]]
+        if iovec.iov_base is None:
+            return b""
+        return ctypes.string_at(iovec.iov_base, iovec.iov_size)
+
     @property
     def pointer(self):
-        return ctypes.POINTER(Iovec*len(self))(self.struct)
+        self.compile()
+        return self._pointer
 
     @property
-    def struct(self) -> typing.Iterator[Iovec]:
-        items = []
-        for key, value in self.items():
-            items.append(key.iovec)
-            items.append(value.iovec)
-
-        items.append(
-            Iovec(
-                ctypes.cast(
-                    ctypes.c_char_p(b"errmsg\x00"),
-                    ctypes.c_void_p
-                ),
-                len(b"errmsg\x00")
-            )
-        )
-        
-        items.append(
-            Iovec(
-                ctypes.cast(
-                    ctypes.POINTER(ctypes.c_char_p)(self.errmsg),
-                    ctypes.c_void_p
-                ),
-                len(self.errmsg)
+    def struct(self) -> ctypes.Array:
+        return self.compile()
+
+
+class JiovTemplate(Jiov):
+    """
+    Jiov with variable slots that are patched into the compiled buffer.
+
+    Shared parameters are marshalled once. Assigning a slot only rewrites
+    the value Iovec of that slot, so the cost of preparing the next jail
+    does not depend on the number of shared parameters.
+
+    >>> template = jail.JiovTemplate(
+    ...     dict(persist=None, path="/rescue"),
+    ...     slots=("name", "jid")
+    ... )
+    >>> template["name"] = "www"
+    >>> template["jid"] = 23
+    >>> jail.dll.jail_set(template.pointer, len(template), 1)
+    23
+    """
+
+    _slot_keys: typing.FrozenSet[IovecKey]
+    _slot_buffers: typing.Dict[int, ctypes.Array]
+    _slot_capacity: typing.Dict[int, int]
+    _unset: typing.Set[IovecKey]
+
+    def __init__(
+        self,
+        params: typing.Dict[
+            typing.Union[str, bytes],
+            IovecValue
+        ],
+        slots: typing.Iterable[typing.Union[IovecKey, bytes, str]]
+    ) -> None:
+        slot_keys = [IovecKey.intern(x) for x in slots]
+        self._slot_keys = frozenset(slot_keys)
+        self._unset = set()
+        super().__init__(params)
+        for key in slot_keys:
+            if dict.__contains__(self, key) is False:
+                dict.__setitem__(self, key, IovecValue(None))
+                self._unset.add(key)
+
+    @property
+    def slots(self) -> typing.FrozenSet[IovecKey]:
+        return self._slot_keys
+
+    def __setitem__(
+        self,
+        key: typing.Union[IovecKey, bytes, str],
+        value: typing.Optional[typing.Union[bytes, int, IovecValue]]
+    ) -> None:
+        _key = IovecKey.intern(key)
+        if _key not in self._slot_keys:
+            super().__setitem__(_key, value)
+            return
+        _value = to_iovec_value(_key, value)
+        dict.__setitem__(self, _key, _value)
+        self._unset.discard(_key)
+        if self._iovecs is not None:
+            self.__patch(self._indices[_key], _key, _value)
+
+    def __delitem__(self, key: typing.Union[IovecKey, bytes, str]) -> None:
+        _key = IovecKey.intern(key)
+        if _key in self._slot_keys:
+            raise KeyError(f"cannot delete template slot: {_key}")
+        super().__delitem__(_key)
+
+    def fill(
+        self,
+        values: typing.Dict[
+            typing.Union[IovecKey, bytes, str],
+            IovecValue
+        ]
+    ) -> 'JiovTemplate':
+        """Assign several slots at once."""
+        for key, value in values.items():
+            self[key] = value
+        return self
+
+    def invalidate(self) -> None:
+        super().invalidate()
+        self._slot_buffers = {}
+        self._slot_capacity = {}
+
+    def compile(self) -> ctypes.Array:
+        if len(self._unset) > 0:
+            names = ", ".join(sorted(str(x) for x in self._unset))
+            raise ValueError(f"template slots not set: {names}")
+        if self._iovecs is not None:
+            return super().compile()
+        iovecs = super().compile()
+        for key in self._slot_keys:
+            index = self._indices[key]
+            self._slot_capacity[index] = iovecs[index].iov_size
+        return iovecs
+
+    def __patch(self, index: int, key: IovecKey, value: IovecValue) -> None:
+        if (value.codec is not None) and (value.codec.renames is True):
+            key_native = value.codec.encode_key(key.native, value.raw_value)
+            key_buffer = ctypes.create_string_buffer(
+                key_native,
+                len(key_native)
             )
+            key_iovec = self._pristine[index - 1]
+            key_iovec.iov_base = ctypes.addressof(key_buffer)
+            key_iovec.iov_size = len(key_native)
+            self._slot_buffers[index - 1] = key_buffer
+            self._iovecs[index - 1] = key_iovec
+        native = value.native
+        iovec = self._pristine[index]
+        if native is None:
+            iovec.iov_base = None
+            iovec.iov_size = 0
+            self._slot_capacity[index] = 0
+        elif len(native) <= self._slot_capacity[index]:
+            # fits into the memory already owned by this slot
+            ctypes.memmove(iovec.iov_base, native, len(native))
+            iovec.iov_size = len(native)
+        else:
+            buffer = ctypes.create_string_buffer(native, len(native))
+            self._slot_buffers[index] = buffer
+            self._slot_capacity[index] = len(native)
+            iovec.iov_base = ctypes.addressof(buffer)
+            iovec.iov_size = len(native)
+        self._iovecs[index] = iovec
+
+
+IPAddress = typing.Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+class JailRecord(typing.Dict[str, jail.params.JailParamValue]):
+    """
+    Decoded parameters of a jail.
+
+    The jid is always included and also available as an int attribute.
+    """
+
+    jid: int
+
+    def __init__(
+        self,
+        jid: int,
+        params: typing.Optional[
+            typing.Mapping[str, jail.params.JailParamValue]
+        ]=None
+    ) -> None:
+        super().__init__(jid=jid)
+        if params is not None:
+            self.update((x, y) for x, y in params.items() if x != "jid")
+        self.jid = jid
+
+    def get_int(self, name: str, default: int=0) -> int:
+        """Return an integer parameter or default when it is missing."""
+        value = self.get(name, default)
+        if isinstance(value, int):
+            return value
+        raise TypeError(f"{name} is not an integer")
+
+    def get_str(self, name: str, default: str="") -> str:
+        """Return a string parameter or default when it is missing."""
+        value = self.get(name, default)
+        if isinstance(value, str):
+            return value
+        raise TypeError(f"{name} is not a string")
+
+    def get_addresses(
+        self,
+        names: typing.Iterable[str]=("ip4.addr", "ip6.addr")
+    ) -> typing.List[IPAddress]:
+        """Return the addresses of the ip4.addr and ip6.addr parameters."""
+        addresses: typing.List[IPAddress] = []
+        for name in names:
+            value = self.get(name)
+            if isinstance(value, list):
+                addresses.extend(value)
+        return addresses
+
+
+class JailInfo(JiovTemplate):
+    """
+    Query many parameters of a jail with a single jail_get (2).
+
+    Output buffers are sized from the jail parameter metadata once and
+    reused by every query. The jail is looked up by jid, name or lastjid.
+
+    >>> info = jail.JailInfo(("path", "host.hostname", "ip4.addr"))
+    >>> info.get(23)
+    {'jid': 23, 'path': '/rescue', 'host.hostname': '', 'ip4.addr': []}
+    """
+
+    key: str
+    flags: int
+    codecs: typing.List['jail.codecs.Codec']
+
+    def __init__(
+        self,
+        params: typing.Iterable[str],
+        key: str="jid",
+        dying: bool=False
+    ) -> None:
+        if key not in ("jid", "name", "lastjid"):
+            raise KeyError("jid, name or lastjid lookup expected")
+        names = [x for x in params if x != key]
+        if (key != "jid") and ("jid" not in names):
+            names.insert(0, "jid")
+        self.key = key
+        self.flags = JAIL_DYING if (dying is True) else 0
+        self.codecs = [jail.codecs.get_codec(x) for x in names]
+        super().__init__(
+            {x.name: IovecValue.output(x.size) for x in self.codecs},
+            slots=(key,)
         )
 
-        return (Iovec * len(items))(*items)
+    def get(
+        self,
+        value: typing.Union[int, str, bytes]
+    ) -> typing.Optional[JailRecord]:
+        """Return the jail record or None if no jail was found."""
+        self[self.key] = value
+        jid = jail.dll.jail_get(self.pointer, len(self), self.flags)
+        if jid < 0:
+            error = ctypes.get_errno()
+            if error in (0, errno.ENOENT):
+                return None
+            raise_errno(error, self.errmsg.value)
+        record = JailRecord(int(jid))
+        for codec in self.codecs:
+            record[codec.name] = codec.decode(self.read(codec.name))
+        return record
 
 
 def get_jid_by_name(name: typing.Union[str, bytes]) -> int:
@@ -383,9 +905,125 @@ def get_jid_by_name(name: typing.Union[str, bytes]) -> int:
     return int(jail.dll.jail_get(jiov.pointer, len(jiov), 0))
 
 def is_jid_dying(jid: int) -> bool:
-    jiov = jail.Jiov(dict(jid=jid,dying=0))
-    JAIL_DYING = 0x08
-    if jail.dll.jail_get(jiov.pointer, len(jiov), JAIL_DYING) < 0:
+    record = JailInfo(("dying",), dying=True).get(jid)
+    if record is None:
         return False  # jid does not exist
-    return (int(jiov[IovecKey("dying")]) > 0) is True
+    return record["dying"] is True
+
+
+def iterate_jails(
+    params: typing.Iterable[str]=("name", "path"),
+    dying: bool=False
+) -> typing.Iterator[JailRecord]:
+    """
+    Iterate over all jails with one jail_get (2) per jail.
+
+    The jails are walked with the lastjid cursor. The requested parameters
+    are read into one preallocated JailInfo buffer that is reused for every
+    jail and yielded as decoded records that always include the jid.
+    """
+    info = JailInfo(params, key="lastjid", dying=dying)
+    record = info.get(0)
+    while record is not None:
+        yield record
+        record = info.get(record.jid)
+
+
+def get_jids(dying: bool=True) -> typing.Set[int]:
+    """Return the jids of all jails with a single enumeration pass."""
+    return set(x.jid for x in iterate_jails((), dying=dying))
+
+
+def wait_removed(
+    jids: typing.Iterable[int],
+    timeout: typing.Optional[float]=None,
+    interval: float=WAIT_MIN_INTERVAL,
+    max_interval: float=WAIT_MAX_INTERVAL
+) -> typing.Iterator[int]:
+    """
+    Yield each jid as soon as its jail has fully gone away.
+
+    All pending jails are checked with one enumeration per tick. The pause
+    between ticks doubles up to max_interval while no jail disappears and
+    is reset whenever one does. TimeoutError is raised when jails are still
+    dying after timeout seconds.
+    """
+    pending = set(jids)
+    deadline = None if (timeout is None) else (time.monotonic() + timeout)
+    delay = interval
+    while len(pending) > 0:
+        removed = pending - get_jids(dying=True)
+        for jid in sorted(removed):
+            pending.discard(jid)
+            yield jid
+        if len(pending) == 0:
+            return
+        delay = interval if (len(removed) > 0) else min(
+            delay * 2,
+            max_interval
+        )
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                names = ", ".join(str(x) for x in sorted(pending))
+                raise TimeoutError(f"jails not removed: {names}")
+            delay = min(delay, remaining)
+        time.sleep(delay)
+
+
+JailParams = typing.Dict[
+    typing.Union[str, bytes],
+    typing.Optional[typing.Union[IovevValueInput, IovecValue]]
+]
+
+
+def raise_errno(
+    error: typing.Optional[int]=None,
+    errmsg: bytes=b""
+) -> typing.NoReturn:
+    """Raise the OSError of a failed syscall with the kernel errmsg."""
+    if error is None:
+        error = ctypes.get_errno()
+    message = errmsg.decode(errors="replace")
+    raise OSError(error, message if message else os.strerror(error))
+
+
+def set_jail(params: JailParams, flags: int) -> int:
+    """Call jail_set (2) with a private Jiov and return the jid."""
+    jiov = Jiov(params)
+    jid = int(jail.dll.jail_set(jiov.pointer, len(jiov), flags))
+    if jid < 0:
+        raise_errno(errmsg=jiov.errmsg.value)
+    return jid
+
+
+def create_jail(params: JailParams) -> int:
+    """Create a jail and return its jid."""
+    return set_jail(params, JAIL_CREATE)
+
+
+def update_jail(params: JailParams) -> int:
+    """Update the jail identified by the jid or name parameter."""
+    return set_jail(params, JAIL_UPDATE)
+
+
+def get_jail(
+    value: typing.Union[int, str, bytes],
+    params: typing.Iterable[str]=("name", "path"),
+    key: str="jid",
+    dying: bool=False
+) -> typing.Optional[JailRecord]:
+    """Return the record of one jail or None if it does not exist."""
+    return JailInfo(params, key=key, dying=dying).get(value)
+
+
+def remove_jail(jid: int) -> None:
+    """Remove a jail and kill all of its processes."""
+    if int(jail.dll.jail_remove(jid)) < 0:
+        raise_errno()
+
 
+def attach_jail(jid: int) -> None:
+    """Attach the current process to a jail."""
+    if int(jail.dll.jail_attach(jid)) < 0:
+        raise_errno()
@@ -0,0 +1,253 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+asyncio interface to the jail syscalls.
+
+The syscalls block, so every call runs on a bounded thread pool that is
+shared by all coroutines. Each call marshals its parameters into a private
+Jiov and captures errno and errmsg in the worker thread that made the
+syscall, so concurrent failures never mix up their errors.
+
+Cancelling a call or exceeding its timeout cancels it when it is still
+queued. A syscall that is already running cannot be interrupted and its
+result is discarded.
+"""
+import typing
+import asyncio
+import concurrent.futures
+import functools
+import weakref
+
+import jail
+
+DEFAULT_MAX_WORKERS = 16
+
+_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_schedulers: typing.MutableMapping[
+    asyncio.AbstractEventLoop,
+    'RemovalScheduler'
+] = weakref.WeakKeyDictionary()
+
+T = typing.TypeVar("T")
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the thread pool the syscalls run on."""
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=DEFAULT_MAX_WORKERS,
+            thread_name_prefix="jail"
+        )
+    return _executor
+
+
+def set_executor(
+    executor: typing.Optional[concurrent.futures.ThreadPoolExecutor]
+) -> None:
+    """Replace the thread pool, for example to change its size."""
+    global _executor
+    _executor = executor
+
+
+async def run(
+    func: typing.Callable[..., T],
+    *args: typing.Any,
+    timeout: typing.Optional[float]=None,
+    **kwargs: typing.Any
+) -> T:
+    """Run a blocking function on the jail thread pool."""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        get_executor(),
+        functools.partial(func, *args, **kwargs)
+    )
+    return await asyncio.wait_for(future, timeout)
+
+
+async def create(
+    params: 'jail.JailParams',
+    timeout: typing.Optional[float]=None
+) -> int:
+    """Create a jail and return its jid."""
+    return await run(jail.create_jail, params, timeout=timeout)
+
+
+async def update(
+    params: 'jail.JailParams',
+    timeout: typing.Optional[float]=None
+) -> int:
+    """Update the jail identified by the jid or name parameter."""
+    return await run(jail.update_jail, params, timeout=timeout)
+
+
+async def get(
+    value: typing.Union[int, str, bytes],
+    params: typing.Iterable[str]=("name", "path"),
+    key: str="jid",
+    dying: bool=False,
+    timeout: typing.Optional[float]=None
+) -> typing.Optional['jail.JailRecord']:
+    """Return the record of one jail or None if it does not exist."""
+    return await run(
+        jail.get_jail,
+        value,
+        tuple(params),
+        key=key,
+        dying=dying,
+        timeout=timeout
+    )
+
+
+async def is_dying(
+    jid: int,
+    timeout: typing.Optional[float]=None
+) -> bool:
+    """Return True while a removed jail is still dying."""
+    return await run(jail.is_jid_dying, jid, timeout=timeout)
+
+
+async def remove(
+    jid: int,
+    timeout: typing.Optional[float]=None
+) -> None:
+    """Remove a jail and kill all of its processes."""
+    await run(jail.remove_jail, jid, timeout=timeout)
+
+
+async def attach(
+    jid: int,
+    timeout: typing.Optional[float]=None
+) -> None:
+    """
+    Attach the current process to a jail.
+
+    This changes the root of the whole process including the event loop,
+    not only of the worker thread.
+    """
+    await run(jail.attach_jail, jid, timeout=timeout)
+
+
+class RemovalScheduler:
+    """
+    Watch the dying jails of all coroutines of an event loop.
+
+    One task enumerates the jails once per tick for every pending jid and
+    resolves the futures of the jails that have gone away. The pause
+    between ticks backs off while nothing changes, like jail.wait_removed.
+    The task ends when no jid is watched anymore.
+    """
+
+    interval: float
+    max_interval: float
+    _waiters: typing.Dict[int, typing.List[asyncio.Future]]
+    _task: typing.Optional[asyncio.Future]
+
+    def __init__(
+        self,
+        interval: float=jail.WAIT_MIN_INTERVAL,
+        max_interval: float=jail.WAIT_MAX_INTERVAL
+    ) -> None:
+        self.interval = interval
+        self.max_interval = max_interval
+        self._waiters = {}
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def watch(self, jid: int) -> asyncio.Future:
+        """Return a future that resolves to jid once the jail is gone."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(jid, []).append(future)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.__run())
+        return future
+
+    async def __run(self) -> None:
+        delay = self.interval
+        try:
+            while len(self.__prune()) > 0:
+                existing = await run(jail.get_jids, True)
+                removed = [x for x in self._waiters if x not in existing]
+                for jid in removed:
+                    for future in self._waiters.pop(jid):
+                        if future.done() is False:
+                            future.set_result(jid)
+                delay = self.interval if (len(removed) > 0) else min(
+                    delay * 2,
+                    self.max_interval
+                )
+                if len(self._waiters) > 0:
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            for futures in self._waiters.values():
+                for future in futures:
+                    if future.done() is False:
+                        future.set_exception(e)
+            self._waiters.clear()
+        finally:
+            self._task = None
+
+    def __prune(self) -> typing.Dict[int, typing.List[asyncio.Future]]:
+        # forget jids whose waiters were cancelled or timed out
+        for jid in list(self._waiters):
+            futures = [x for x in self._waiters[jid] if x.done() is False]
+            if len(futures) == 0:
+                del self._waiters[jid]
+            else:
+                self._waiters[jid] = futures
+        return self._waiters
+
+
+def get_removal_scheduler() -> RemovalScheduler:
+    """Return the RemovalScheduler of the running event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        return _schedulers[loop]
+    except KeyError:
+        scheduler = RemovalScheduler()
+        _schedulers[loop] = scheduler
+        return scheduler
+
+
+async def wait_removed(
+    jids: typing.Iterable[int],
+    timeout: typing.Optional[float]=None
+) -> typing.AsyncIterator[int]:
+    """
+    Yield each jid as soon as its jail has fully gone away.
+
+    Concurrent waits share the RemovalScheduler of the event loop, so a
+    mass teardown costs one enumeration per tick regardless of the number
+    of waiting coroutines. asyncio.TimeoutError is raised after timeout.
+    """
+    scheduler = get_removal_scheduler()
+    futures = [scheduler.watch(x) for x in set(jids)]
+    try:
+        for future in asyncio.as_completed(futures, timeout=timeout):
+            yield await future
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,152 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Create, update and remove many jails in parallel.
+
+Every jail of a batch is marshalled into its own Jiov on a worker thread,
+so errno and errmsg are captured per jail. The results are returned in the
+order of the input, one BatchResult per jail.
+"""
+import typing
+import concurrent.futures
+import errno
+
+import jail
+
+DEFAULT_MAX_WORKERS = 16
+
+T = typing.TypeVar("T")
+
+
+class BatchResult:
+    """Outcome of a single jail of a batch."""
+
+    item: typing.Any
+    jid: typing.Optional[int]
+    errno: int
+    errmsg: str
+    error: typing.Optional[BaseException]
+
+    def __init__(
+        self,
+        item: typing.Any,
+        jid: typing.Optional[int]=None,
+        error: typing.Optional[BaseException]=None
+    ) -> None:
+        self.item = item
+        self.jid = jid
+        self.error = error
+        if error is None:
+            self.errno = 0
+            self.errmsg = ""
+        elif isinstance(error, OSError):
+            self.errno = int(error.errno or 0)
+            self.errmsg = str(error.strerror)
+        elif isinstance(error, concurrent.futures.CancelledError) is True:
+            self.errno = errno.ECANCELED
+            self.errmsg = "cancelled after an earlier failure"
+        else:
+            # the parameters could not be marshalled
+            self.errno = errno.EINVAL
+            self.errmsg = str(error)
+
+    def __repr__(self) -> str:
+        if self.ok is True:
+            return f"<{self.__class__.__name__}: jid={self.jid}>"
+        return f"<{self.__class__.__name__}: [{self.errno}] {self.errmsg}>"
+
+    @property
+    def ok(self) -> bool:
+        return (self.error is None) is True
+
+
+def run_batch(
+    func: typing.Callable[[T], typing.Optional[int]],
+    items: typing.Iterable[T],
+    max_workers: int=DEFAULT_MAX_WORKERS,
+    fail_fast: bool=False,
+    executor: typing.Optional[concurrent.futures.Executor]=None
+) -> typing.List[BatchResult]:
+    """
+    Call func for every item on a thread pool and collect the results.
+
+    With fail_fast the items that did not start yet are cancelled after
+    the first failure, otherwise every item is attempted.
+    """
+    items = list(items)
+    if len(items) == 0:
+        return []
+    pool = executor
+    if pool is None:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(items)),
+            thread_name_prefix="jail-batch"
+        )
+    try:
+        futures = [pool.submit(func, x) for x in items]
+        if fail_fast is True:
+            for future in concurrent.futures.as_completed(futures):
+                if future.exception() is not None:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                results.append(BatchResult(item, jid=future.result()))
+            except Exception as e:
+                results.append(BatchResult(item, error=e))
+        return results
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def create_jails(
+    params: typing.Iterable['jail.JailParams'],
+    **kwargs: typing.Any
+) -> typing.List[BatchResult]:
+    """Create many jails and return their results in order."""
+    return run_batch(jail.create_jail, params, **kwargs)
+
+
+def update_jails(
+    params: typing.Iterable['jail.JailParams'],
+    **kwargs: typing.Any
+) -> typing.List[BatchResult]:
+    """Update many jails identified by their jid or name parameters."""
+    return run_batch(jail.update_jail, params, **kwargs)
+
+
+def remove_jails(
+    jids: typing.Iterable[int],
+    **kwargs: typing.Any
+) -> typing.List[BatchResult]:
+    """Remove many jails; the results carry the jid on success."""
+    return run_batch(_remove_jail, jids, **kwargs)
+
+
+def _remove_jail(jid: int) -> int:
+    jail.remove_jail(jid)
+    return jid
@@ -0,0 +1,302 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Per-parameter encoders and decoders of jail values.
+
+A codec is resolved once per parameter name from the jail parameter
+metadata and cached, so encoding a value is a table lookup and a call.
+"""
+import typing
+import struct
+import threading
+import ipaddress
+
+import jail
+import jail.params
+
+JAIL_SYS_DISABLE = 0
+JAIL_SYS_NEW = 1
+JAIL_SYS_INHERIT = 2
+
+JAILSYS_VALUES = {
+    "disable": JAIL_SYS_DISABLE,
+    "new": JAIL_SYS_NEW,
+    "inherit": JAIL_SYS_INHERIT
+}
+JAILSYS_NAMES = {value: name for name, value in JAILSYS_VALUES.items()}
+
+CodecInput = typing.Any
+
+
+class Codec:
+    """Encode and decode the values of one jail parameter."""
+
+    param: 'jail.params.JailParam'
+    renames: bool = False
+
+    def __init__(self, param: 'jail.params.JailParam') -> None:
+        self.param = param
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.name}>"
+
+    @property
+    def name(self) -> str:
+        return self.param.name
+
+    @property
+    def size(self) -> int:
+        """Return the size of a jail_get (2) output buffer."""
+        return self.param.size
+
+    def encode_key(self, key: bytes, value: CodecInput) -> bytes:
+        """Return the NUL-terminated parameter name sent for value."""
+        return key
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> 'jail.params.JailParamValue':
+        raise NotImplementedError
+
+
+class IntegerCodec(Codec):
+
+    def __init__(self, param: 'jail.params.JailParam') -> None:
+        super().__init__(param)
+        self.struct = struct.Struct(
+            jail.params.INTEGER_FORMATS[param.ctl_type]
+        )
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        if value is None:
+            return None
+        try:
+            return self.struct.pack(int(value))
+        except struct.error:
+            raise OverflowError("Integer parameter out of range")
+
+    def decode(self, data: bytes) -> int:
+        return int(self.struct.unpack_from(data)[0])
+
+
+class StringCodec(Codec):
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        if value is None:
+            return None
+        elif isinstance(value, str) is True:
+            value = value.encode()
+        elif isinstance(value, bytes) is False:
+            raise TypeError(f"String expected for {self.name}")
+        if value[-1:] != jail.NULL_BYTES:
+            value += jail.NULL_BYTES
+        if len(value) > self.size:
+            raise ValueError("byte sequence too long")
+        return value
+
+    def decode(self, data: bytes) -> str:
+        return data.split(jail.NULL_BYTES, 1)[0].decode()
+
+
+class BoolCodec(Codec):
+    """Booleans are sent as name or noname without a value."""
+
+    renames = True
+
+    @property
+    def size(self) -> int:
+        return 4
+
+    def encode_key(self, key: bytes, value: CodecInput) -> bytes:
+        if (value is None) or (bool(value) is True):
+            return key
+        return b"no" + key
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        return None
+
+    def decode(self, data: bytes) -> bool:
+        return (struct.unpack_from("i", data)[0] != 0) is True
+
+
+class NoBoolCodec(BoolCodec):
+    """The negated noname form of a boolean parameter."""
+
+    @property
+    def name(self) -> str:
+        return "no" + self.param.name
+
+    def encode_key(self, key: bytes, value: CodecInput) -> bytes:
+        if (value is None) or (bool(value) is True):
+            return key
+        return key[2:]
+
+
+class JailsysCodec(IntegerCodec):
+    """Jailsys values are one of disable, new or inherit."""
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        if isinstance(value, bytes) is True:
+            value = value.decode()
+        if isinstance(value, str) is True:
+            try:
+                value = JAILSYS_VALUES[value]
+            except KeyError:
+                raise ValueError(
+                    f"{self.name} expects one of disable, new or inherit"
+                )
+        return super().encode(value)
+
+    def decode(self, data: bytes) -> str:  # type: ignore
+        value = super().decode(data)
+        return JAILSYS_NAMES.get(value, str(value))
+
+
+class AddressCodec(Codec):
+    """Lists of IPv4 or IPv6 addresses in network byte order."""
+
+    address_type: type
+    address_size: int
+
+    def __init__(self, param: 'jail.params.JailParam') -> None:
+        super().__init__(param)
+        address_type = param.address_type
+        if address_type is None:
+            raise TypeError(f"{param.name} is no address list")
+        self.address_type = address_type
+        self.address_size = 4 if (
+            address_type is ipaddress.IPv4Address
+        ) else 16
+
+    def encode(self, value: CodecInput) -> typing.Optional[bytes]:
+        if value is None:
+            return None
+        if isinstance(value, (list, tuple)) is False:
+            value = [value]
+        if len(value) == 0:
+            return None
+        elif len(value) > jail.get_jail_max_af_ips():
+            raise ValueError(
+                f"Too many IPs (max {jail.get_jail_max_af_ips()})"
+            )
+        address_type = self.address_type
+        addresses = []
+        for address in value:
+            if isinstance(address, address_type) is False:
+                if isinstance(address, str) is False:
+                    raise TypeError("Expected IP Address")
+                address = address_type(address)
+            addresses.append(address.packed)
+        return b"".join(addresses)
+
+    def decode(self, data: bytes) -> typing.List[typing.Any]:
+        step = self.address_size
+        return [
+            self.address_type(data[i:i + step])
+            for i in range(0, len(data) - len(data) % step, step)
+        ]
+
+
+TYPE_CODECS: typing.Dict[str, typing.Type[Codec]] = {
+    "int": IntegerCodec,
+    "uint": IntegerCodec,
+    "long": IntegerCodec,
+    "ulong": IntegerCodec,
+    "s64": IntegerCodec,
+    "u64": IntegerCodec,
+    "string": StringCodec,
+    "bool": BoolCodec,
+    "jailsys": JailsysCodec,
+    "in_addr": AddressCodec,
+    "in6_addr": AddressCodec
+}
+NAMED_CODECS: typing.Dict[str, typing.Type[Codec]] = {}
+
+_codecs: typing.Dict[str, typing.Optional[Codec]] = {}
+_lock = threading.Lock()
+
+
+def register_codec(
+    key: str,
+    codec: typing.Type[Codec],
+    by_type: bool=False
+) -> None:
+    """Register a codec for a parameter name or a parameter type."""
+    if by_type is True:
+        TYPE_CODECS[key] = codec
+    else:
+        NAMED_CODECS[key] = codec
+    _codecs.clear()
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Return the codec of a jail parameter.
+
+    Raises KeyError for parameters unknown to the kernel.
+    """
+    codec = find_codec(name)
+    if codec is None:
+        raise KeyError(f"Unknown jail parameter: {name}")
+    return codec
+
+
+def find_codec(name: str) -> typing.Optional[Codec]:
+    """Return the cached codec of a jail parameter or None if unknown."""
+    try:
+        return _codecs[name]
+    except KeyError:
+        pass
+    with _lock:
+        try:
+            return _codecs[name]
+        except KeyError:
+            pass
+        try:
+            codec: typing.Optional[Codec] = create_codec(name)
+        except KeyError:
+            codec = None
+        _codecs[name] = codec
+        return codec
+
+
+def create_codec(name: str) -> Codec:
+    try:
+        param = jail.params.get_param(name)
+    except KeyError:
+        if name.startswith("no") is False:
+            raise
+        param = jail.params.get_param(name[2:])
+        if param.is_bool is False:
+            raise
+        return NoBoolCodec(param)
+    try:
+        codec = NAMED_CODECS[name]
+    except KeyError:
+        try:
+            codec = TYPE_CODECS[param.type_name]
+        except (KeyError, TypeError):
+            raise KeyError(f"No codec for jail parameter: {name}")
+    return codec(param)
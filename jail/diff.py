@@ -0,0 +1,193 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Update jails by sending only the parameters that changed.
+
+The current values of a jail are taken from a Snapshots cache or read with
+a single jail_get (2). Desired values are normalized with the codecs of
+their parameters, so "inherit" compares equal to the jailsys value the
+kernel returns and None equals a set boolean. Only differing parameters
+are sent with JAIL_UPDATE and no syscall is made when nothing changed.
+"""
+import typing
+import errno
+import threading
+import time
+
+import jail
+import jail.codecs
+
+Changes = typing.Dict[str, typing.Any]
+
+
+def normalize(name: str, value: typing.Any) -> typing.Tuple[str, typing.Any]:
+    """
+    Return a parameter the way jail_get (2) would report it.
+
+    The noname form of booleans is turned into name=False. Parameters
+    without a codec are returned unchanged.
+    """
+    codec = jail.codecs.find_codec(name)
+    if codec is None:
+        return (name, value)
+    elif isinstance(codec, jail.codecs.BoolCodec) is True:
+        enabled = (value is None) or (bool(value) is True)
+        if isinstance(codec, jail.codecs.NoBoolCodec) is True:
+            return (codec.param.name, enabled is False)
+        return (name, enabled)
+    native = codec.encode(value)
+    if native is None:
+        # an empty address list is reported as []
+        if isinstance(codec, jail.codecs.AddressCodec) is True:
+            return (name, [])
+        return (name, value)
+    return (name, codec.decode(native))
+
+
+def diff(current: jail.JailRecord, desired: Changes) -> Changes:
+    """Return the desired parameters that differ from the current ones."""
+    changes: Changes = {}
+    for name, value in desired.items():
+        key, normalized = normalize(name, value)
+        if key not in current:
+            changes[key] = normalized
+        elif current[key] != normalized:
+            changes[key] = normalized
+    return changes
+
+
+class Snapshots:
+    """
+    Last known parameter values of jails by jid.
+
+    Entries older than max_age seconds are read from the kernel again. The
+    cache is safe to share between threads.
+    """
+
+    max_age: typing.Optional[float]
+    _records: typing.Dict[int, typing.Tuple[float, jail.JailRecord]]
+    _lock: threading.Lock
+
+    def __init__(self, max_age: typing.Optional[float]=None) -> None:
+        self.max_age = max_age
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(
+        self,
+        jid: int,
+        params: typing.Iterable[str]
+    ) -> typing.Optional[jail.JailRecord]:
+        """Return the cached values or None if any of them is unknown."""
+        with self._lock:
+            try:
+                created, record = self._records[jid]
+            except KeyError:
+                return None
+        if (self.max_age is not None) and (
+            time.monotonic() - created > self.max_age
+        ):
+            self.invalidate(jid)
+            return None
+        for name in params:
+            if name not in record:
+                return None
+        return record
+
+    def update(
+        self,
+        jid: int,
+        values: typing.Mapping[str, jail.params.JailParamValue]
+    ) -> None:
+        with self._lock:
+            try:
+                created, record = self._records[jid]
+                record.update(values)
+            except KeyError:
+                self._records[jid] = (
+                    time.monotonic(),
+                    jail.JailRecord(jid, values)
+                )
+
+    def invalidate(self, jid: int) -> None:
+        with self._lock:
+            self._records.pop(jid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def fetch(
+        self,
+        jid: int,
+        params: typing.Iterable[str]
+    ) -> jail.JailRecord:
+        """Read the parameters with one jail_get (2) and cache them."""
+        record = jail.get_jail(jid, params)
+        if record is None:
+            self.invalidate(jid)
+            raise OSError(errno.ENOENT, f"jail {jid} not found")
+        self.update(jid, record)
+        return record
+
+
+def update(
+    jid: int,
+    params: Changes,
+    snapshots: typing.Optional[Snapshots]=None
+) -> Changes:
+    """
+    Update a jail with the parameters that differ and return them.
+
+    Without snapshots the current values are read with one jail_get (2)
+    on every call, with snapshots only when they are not cached.
+    """
+    params = {x: y for x, y in params.items() if x != "jid"}
+    names = [normalize(name, value)[0] for name, value in params.items()]
+    readable = [x for x in names if jail.codecs.find_codec(x) is not None]
+    current: typing.Optional[jail.JailRecord] = None
+    if snapshots is not None:
+        current = snapshots.get(jid, readable)
+    if current is None:
+        if snapshots is None:
+            current = jail.get_jail(jid, readable)
+            if current is None:
+                raise OSError(errno.ENOENT, f"jail {jid} not found")
+        else:
+            current = snapshots.fetch(jid, readable)
+    changes = diff(current, params)
+    if len(changes) == 0:
+        return changes
+    try:
+        jail.update_jail(typing.cast(jail.JailParams, dict(changes, jid=jid)))
+    except OSError:
+        if snapshots is not None:
+            snapshots.invalidate(jid)
+        raise
+    if snapshots is not None:
+        snapshots.update(jid, changes)
+    return changes
@@ -0,0 +1,298 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Lifecycle events of jails.
+
+A Watcher enumerates all jails with a few chosen parameters and compares
+the snapshot with the previous one. Jails that appeared, changed, started
+dying or went away are reported as events to every subscriber, so a single
+poll loop serves any number of consumers. Subscriptions are iterators,
+or asynchronous iterators for asyncio.
+
+The pause between polls is reset to interval whenever something changed
+and doubles up to max_interval while nothing does.
+"""
+import typing
+import asyncio
+import queue
+import threading
+
+import jail
+
+CREATED = "created"
+UPDATED = "updated"
+DYING = "dying"
+REMOVED = "removed"
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_MAX_INTERVAL = 2.0
+
+_STOP = object()
+
+
+class Event:
+    """A change of one jail between two snapshots."""
+
+    kind: str
+    jid: int
+    record: typing.Optional[jail.JailRecord]
+    previous: typing.Optional[jail.JailRecord]
+
+    def __init__(
+        self,
+        kind: str,
+        jid: int,
+        record: typing.Optional[jail.JailRecord]=None,
+        previous: typing.Optional[jail.JailRecord]=None
+    ) -> None:
+        self.kind = kind
+        self.jid = jid
+        self.record = record
+        self.previous = previous
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.kind} {self.jid}>"
+
+    def __eq__(self, other: typing.Any) -> bool:
+        if isinstance(other, Event) is False:
+            return False
+        return (self.kind, self.jid, self.record) == (
+            other.kind,
+            other.jid,
+            other.record
+        )
+
+
+class Subscription:
+    """Events of a Watcher as a blocking iterator."""
+
+    watcher: 'Watcher'
+    _queue: queue.Queue
+
+    def __init__(self, watcher: 'Watcher') -> None:
+        self.watcher = watcher
+        self._queue = queue.Queue()
+
+    def __iter__(self) -> 'Subscription':
+        return self
+
+    def __next__(self) -> Event:
+        return self.get()
+
+    def __enter__(self) -> 'Subscription':
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.close()
+
+    def get(self, timeout: typing.Optional[float]=None) -> Event:
+        """
+        Return the next event.
+
+        queue.Empty is raised after timeout and StopIteration once the
+        subscription was closed.
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is _STOP:
+            self._queue.put(_STOP)
+            raise StopIteration
+        elif isinstance(item, BaseException) is True:
+            raise item
+        return item
+
+    def put(self, item: typing.Any) -> None:
+        self._queue.put(item)
+
+    def close(self) -> None:
+        """Stop receiving events and end the iteration."""
+        self.watcher.unsubscribe(self)
+        self.put(_STOP)
+
+
+class AsyncSubscription(Subscription):
+    """Events of a Watcher as an asynchronous iterator."""
+
+    _loop: asyncio.AbstractEventLoop
+    _async_queue: asyncio.Queue
+
+    def __init__(self, watcher: 'Watcher') -> None:
+        super().__init__(watcher)
+        self._loop = asyncio.get_running_loop()
+        self._async_queue = asyncio.Queue()
+
+    def __aiter__(self) -> 'AsyncSubscription':
+        return self
+
+    async def __anext__(self) -> Event:
+        item = await self._async_queue.get()
+        if item is _STOP:
+            self._async_queue.put_nowait(_STOP)
+            raise StopAsyncIteration
+        elif isinstance(item, BaseException) is True:
+            raise item
+        return item
+
+    def put(self, item: typing.Any) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._async_queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop was closed
+            self.watcher.unsubscribe(self)
+
+
+class Watcher:
+    """
+    Poll the jails and fan out their lifecycle events to subscribers.
+
+    >>> watcher = jail.events.Watcher(params=("name", "path"))
+    >>> for event in watcher.subscribe():
+    ...     print(event.kind, event.jid, event.record)
+    created 23 {'jid': 23, 'name': 'www', 'path': '/jails/www', ...}
+
+    The poll thread runs while there are subscribers. Subscribing takes the
+    first snapshot right away, so no change after it is missed.
+    """
+
+    params: typing.Tuple[str, ...]
+    interval: float
+    max_interval: float
+    records: typing.Optional[typing.Dict[int, jail.JailRecord]]
+    _subscribers: typing.List[Subscription]
+    _thread: typing.Optional[threading.Thread]
+    _wakeup: threading.Event
+    _lock: threading.RLock
+
+    def __init__(
+        self,
+        params: typing.Iterable[str]=("name",),
+        interval: float=DEFAULT_INTERVAL,
+        max_interval: float=DEFAULT_MAX_INTERVAL
+    ) -> None:
+        self.params = tuple(x for x in params if x != "dying") + ("dying",)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.records = None
+        self._subscribers = []
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        """Return a blocking iterator over all following events."""
+        return self.__add(Subscription(self))
+
+    def subscribe_async(self) -> AsyncSubscription:
+        """Return an asynchronous iterator over all following events."""
+        return self.__add(AsyncSubscription(self))
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+            if len(self._subscribers) == 0:
+                self._wakeup.set()
+
+    def close(self) -> None:
+        """End all subscriptions and the poll thread."""
+        for subscription in list(self._subscribers):
+            subscription.close()
+        thread = self._thread
+        if (thread is not None) and (thread is not threading.current_thread()):
+            thread.join()
+
+    def poll(self) -> typing.List[Event]:
+        """Take a snapshot, send the changes to all subscribers and return."""
+        with self._lock:
+            records = {
+                x.jid: x for x in jail.iterate_jails(self.params, True)
+            }
+            previous = self.records
+            self.records = records
+            if previous is None:
+                return []
+            events = _compare(previous, records)
+            for event in events:
+                for subscription in list(self._subscribers):
+                    subscription.put(event)
+            return events
+
+    def __add(self, subscription: Subscription) -> typing.Any:
+        with self._lock:
+            if self.records is None:
+                self.poll()
+            self._subscribers.append(subscription)
+            # a running thread woken by the last unsubscribe keeps polling
+            self._wakeup.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.__run,
+                    name="jail-events",
+                    daemon=True
+                )
+                self._thread.start()
+        return subscription
+
+    def __run(self) -> None:
+        delay = self.interval
+        while True:
+            self._wakeup.wait(delay)
+            with self._lock:
+                if len(self._subscribers) == 0:
+                    # the next subscriber starts with a fresh snapshot
+                    self.records = None
+                    self._thread = None
+                    return
+                try:
+                    events = self.poll()
+                except Exception as e:
+                    for subscription in list(self._subscribers):
+                        subscription.put(e)
+                        subscription.close()
+                    continue
+            delay = self.interval if (len(events) > 0) else min(
+                delay * 2,
+                self.max_interval
+            )
+
+
+def _compare(
+    previous: typing.Dict[int, jail.JailRecord],
+    records: typing.Dict[int, jail.JailRecord]
+) -> typing.List[Event]:
+    events = []
+    for jid, record in records.items():
+        before = previous.get(jid)
+        if record["dying"] is True:
+            if (before is None) or (before["dying"] is False):
+                events.append(Event(DYING, jid, record, before))
+        elif before is None:
+            events.append(Event(CREATED, jid, record))
+        elif record != before:
+            events.append(Event(UPDATED, jid, record, before))
+    for jid in previous.keys() - records.keys():
+        events.append(Event(REMOVED, jid, None, previous[jid]))
+    return events
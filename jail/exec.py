@@ -0,0 +1,130 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Run commands inside of jails without jexec (8).
+
+The child process attaches itself to the jail with jail_attach (2) after
+fork and executes the command directly, saving the exec of jexec and its
+process image. The returned handles are plain subprocess.Popen objects.
+
+Popen applies cwd before the child is attached, so the working directory
+is changed again inside of the jail. The user and group arguments of Popen
+are applied before attaching as well and therefore are not supported.
+"""
+import typing
+import errno
+import os
+import subprocess
+
+import jail
+import jail.metrics
+
+JailIdentifier = typing.Union[int, str, bytes]
+
+
+def get_jid(jail_id: JailIdentifier) -> int:
+    """Return the jid of a jail identified by jid or name."""
+    if isinstance(jail_id, int):
+        return jail_id
+    jid = jail.get_jid_by_name(jail_id)
+    if jid < 0:
+        name = jail_id.decode() if isinstance(jail_id, bytes) else jail_id
+        raise OSError(errno.ENOENT, f"jail \"{name}\" not found")
+    return jid
+
+
+def get_raw_syscall(name: str) -> typing.Callable[..., int]:
+    """Return a syscall of the backend without metrics instrumentation."""
+    backend = jail.libc.get_backend()
+    while isinstance(backend, jail.metrics.InstrumentedBackend) is True:
+        backend = backend.backend
+    return typing.cast(typing.Callable[..., int], getattr(backend, name))
+
+
+def attach_preexec(
+    jid: int,
+    cwd: typing.Optional[str]=None,
+    preexec_fn: typing.Optional[typing.Callable[[], typing.Any]]=None
+) -> typing.Callable[[], None]:
+    """
+    Return a preexec_fn that attaches the child to a jail.
+
+    The syscall is resolved in the parent, the child only calls it. Metrics
+    instrumentation is bypassed because its lock may be held by another
+    thread at the time of the fork.
+    """
+    attach = get_raw_syscall("jail_attach")
+    directory = "/" if (cwd is None) else cwd
+
+    def preexec() -> None:
+        if int(attach(jid)) < 0:
+            jail.raise_errno()
+        os.chdir(directory)
+        if preexec_fn is not None:
+            preexec_fn()
+
+    return preexec
+
+
+def _prepare(
+    jail_id: JailIdentifier,
+    kwargs: typing.Dict[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    for name in ("user", "group", "extra_groups"):
+        if kwargs.get(name) is not None:
+            raise ValueError(f"{name} is not supported inside of jails")
+    kwargs["preexec_fn"] = attach_preexec(
+        get_jid(jail_id),
+        cwd=kwargs.pop("cwd", None),
+        preexec_fn=kwargs.pop("preexec_fn", None)
+    )
+    return kwargs
+
+
+def spawn(
+    jail_id: JailIdentifier,
+    args: typing.Union[str, typing.Sequence[str]],
+    **kwargs: typing.Any
+) -> subprocess.Popen:
+    """
+    Start a command inside of a jail.
+
+    Accepts the keyword arguments of subprocess.Popen, so stdin, stdout
+    and stderr may be pipes that are streamed by the caller. Failing to
+    attach raises subprocess.SubprocessError.
+
+    >>> process = jail.exec.spawn("www", ["/bin/hostname"], stdout=PIPE)
+    >>> process.communicate()[0]
+    b'www.example.com\\n'
+    """
+    return subprocess.Popen(args, **_prepare(jail_id, kwargs))
+
+
+def run(
+    jail_id: JailIdentifier,
+    args: typing.Union[str, typing.Sequence[str]],
+    **kwargs: typing.Any
+) -> subprocess.CompletedProcess:
+    """Run a command inside of a jail like subprocess.run."""
+    return subprocess.run(args, **_prepare(jail_id, kwargs))
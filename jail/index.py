@@ -0,0 +1,279 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+In-process index of jails by jid, name, path and IP address.
+
+The index is filled from one enumeration of all jails and refreshed with
+another one, applying only the jails that were added, changed or removed.
+Lookups are dict lookups under a lock that refreshes only take to apply
+the changes of their enumeration. An index with an interval refreshes on
+the first lookup after the interval passed, and invalidate() forces a
+refresh on the next lookup.
+
+Jails may be created or removed between refreshes. Lookups with
+verify=True confirm a hit with one jail_get (2), drop removed jails from
+the index and update changed ones, so they never return a jail that is
+gone. A miss by name is checked with one jail_get by name, and a miss by
+address with a refresh, so new jails are found as well.
+"""
+import typing
+import ipaddress
+import threading
+import time
+
+import jail
+
+DEFAULT_PARAMS = ("name", "path", "ip4.addr", "ip6.addr")
+
+Address = jail.IPAddress
+Changes = typing.Tuple[typing.Set[int], typing.Set[int], typing.Set[int]]
+
+
+class JailIndex:
+    """
+    Jail records indexed by jid, name, path and address.
+
+    >>> index = jail.index.JailIndex(interval=5)
+    >>> index.get_by_name("www")
+    {'jid': 23, 'name': 'www', 'path': '/jails/www', 'ip4.addr': [...]}
+    >>> index.get_by_address("192.0.2.23", verify=True)["jid"]
+    23
+    """
+
+    params: typing.Tuple[str, ...]
+    interval: typing.Optional[float]
+    refreshed: typing.Optional[float]
+    _records: typing.Dict[int, jail.JailRecord]
+    _names: typing.Dict[str, int]
+    _paths: typing.Dict[str, typing.Set[int]]
+    _addresses: typing.Dict[Address, int]
+    _dirty: bool
+    _lock: threading.RLock
+    _refresh_lock: threading.RLock
+
+    def __init__(
+        self,
+        interval: typing.Optional[float]=None,
+        params: typing.Iterable[str]=DEFAULT_PARAMS
+    ) -> None:
+        self.params = tuple(params)
+        self.interval = interval
+        self.refreshed = None
+        self._records = {}
+        self._names = {}
+        self._paths = {}
+        self._addresses = {}
+        self._dirty = True
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.RLock()
+
+    def __len__(self) -> int:
+        self.__refresh_if_stale()
+        with self._lock:
+            return len(self._records)
+
+    def __contains__(self, jid: int) -> bool:
+        self.__refresh_if_stale()
+        with self._lock:
+            return jid in self._records
+
+    def __iter__(self) -> typing.Iterator[jail.JailRecord]:
+        self.__refresh_if_stale()
+        with self._lock:
+            return iter(list(self._records.values()))
+
+    @property
+    def age(self) -> typing.Optional[float]:
+        """Return the seconds since the last refresh."""
+        if self.refreshed is None:
+            return None
+        return time.monotonic() - self.refreshed
+
+    @property
+    def stale(self) -> bool:
+        """Return True when the next lookup refreshes the index."""
+        if self._dirty is True:
+            return True
+        elif self.interval is None:
+            return False
+        age = self.age
+        return (age is None) or ((age > self.interval) is True)
+
+    def invalidate(self) -> None:
+        """Refresh on the next lookup, for example after known changes."""
+        self._dirty = True
+
+    def refresh(self) -> Changes:
+        """
+        Enumerate all jails once and apply the differences.
+
+        Returns the sets of added, changed and removed jids.
+        """
+        with self._refresh_lock:
+            # lookups are served from the old records while enumerating
+            records = {
+                x.jid: x for x in jail.iterate_jails(self.params)
+            }
+            with self._lock:
+                return self.__apply(records)
+
+    def get(
+        self,
+        jid: int,
+        verify: bool=False
+    ) -> typing.Optional[jail.JailRecord]:
+        """Return the record of a jail by jid."""
+        self.__refresh_if_stale()
+        with self._lock:
+            if jid not in self._records:
+                return None
+            elif verify is False:
+                return self._records[jid]
+        return self.__verify(jid)
+
+    def get_by_name(
+        self,
+        name: str,
+        verify: bool=False
+    ) -> typing.Optional[jail.JailRecord]:
+        """Return the record of a jail by name."""
+        self.__refresh_if_stale()
+        with self._lock:
+            jid = self._names.get(name)
+        record = None if (jid is None) else self.get(jid, verify=verify)
+        if (record is not None) and (record.get("name") == name):
+            return record
+        elif verify is False:
+            return None
+        # the jail may have been created or renamed since the refresh
+        record = jail.get_jail(name, self.params, key="name")
+        if record is not None:
+            if "name" in self.params:
+                # the lookup key is not part of the returned record
+                record["name"] = name
+            self.__update(record.jid, record)
+        return record
+
+    def get_by_address(
+        self,
+        address: typing.Union[str, Address],
+        verify: bool=False
+    ) -> typing.Optional[jail.JailRecord]:
+        """Return the record of the jail that owns an IP address."""
+        self.__refresh_if_stale()
+        _address = ipaddress.ip_address(address)
+        with self._lock:
+            jid = self._addresses.get(_address)
+        record = None if (jid is None) else self.get(jid, verify=verify)
+        if (record is not None) and (_address in record.get_addresses()):
+            return record
+        elif verify is False:
+            return None
+        # jail_get cannot look up addresses, the index is refreshed instead
+        self.refresh()
+        with self._lock:
+            jid = self._addresses.get(_address)
+            return None if (jid is None) else self._records[jid]
+
+    def get_by_path(
+        self,
+        path: str,
+        verify: bool=False
+    ) -> typing.List[jail.JailRecord]:
+        """Return the records of all jails with a root path."""
+        self.__refresh_if_stale()
+        with self._lock:
+            jids = sorted(self._paths.get(path, ()))
+        records = []
+        for jid in jids:
+            record = self.get(jid, verify=verify)
+            if (record is not None) and (record.get("path") == path):
+                records.append(record)
+        return records
+
+    def __refresh_if_stale(self) -> None:
+        if self.stale is False:
+            return
+        with self._refresh_lock:
+            # another thread may have refreshed while this one waited
+            if self.stale is True:
+                self.refresh()
+
+    def __apply(self, records: typing.Dict[int, jail.JailRecord]) -> Changes:
+        added = set(records) - set(self._records)
+        removed = set(self._records) - set(records)
+        changed = set(
+            jid for jid in set(records) - added
+            if records[jid] != self._records[jid]
+        )
+        for jid in removed | changed:
+            self.__remove(jid)
+        for jid in added | changed:
+            self.__add(records[jid])
+        self.refreshed = time.monotonic()
+        self._dirty = False
+        return (added, changed, removed)
+
+    def __verify(self, jid: int) -> typing.Optional[jail.JailRecord]:
+        record = jail.get_jail(jid, self.params)
+        self.__update(jid, record)
+        return record
+
+    def __update(
+        self,
+        jid: int,
+        record: typing.Optional[jail.JailRecord]
+    ) -> None:
+        with self._lock:
+            current = self._records.get(jid)
+            if record != current:
+                if current is not None:
+                    self.__remove(jid)
+                if record is not None:
+                    self.__add(record)
+
+    def __add(self, record: jail.JailRecord) -> None:
+        jid = record.jid
+        self._records[jid] = record
+        if "name" in record:
+            self._names[record.get_str("name")] = jid
+        if "path" in record:
+            self._paths.setdefault(record.get_str("path"), set()).add(jid)
+        for address in record.get_addresses():
+            self._addresses[address] = jid
+
+    def __remove(self, jid: int) -> None:
+        record = self._records.pop(jid)
+        name = record.get_str("name")
+        if self._names.get(name) == jid:
+            del self._names[name]
+        if "path" in record:
+            path = record.get_str("path")
+            jids = self._paths.get(path, set())
+            jids.discard(jid)
+            if len(jids) == 0:
+                self._paths.pop(path, None)
+        for address in record.get_addresses():
+            if self._addresses.get(address) == jid:
+                del self._addresses[address]
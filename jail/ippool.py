@@ -0,0 +1,333 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Allocate jail addresses from IPv4 and IPv6 pools.
+
+An AddressPool keeps one bit per address of a prefix. Addresses that were
+never handed out are taken from a cursor that only moves forward, released
+addresses below it are kept on a compact stack, so allocate and release
+take constant time regardless of the pool size or the number of leases.
+
+An AddressAllocator leases addresses of several pools to jails by name,
+respects security.jail.jail_max_af_ips per jail and address family and is
+rebuilt from one enumeration of the live jails. The leases are ipaddress
+objects ready for the ip4.addr and ip6.addr parameters.
+"""
+import typing
+import array
+import errno
+import ipaddress
+import threading
+
+import jail
+
+MAX_POOL_SIZE = 2 ** 24
+
+Address = jail.IPAddress
+Network = typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class AddressPool:
+    """
+    Used and free addresses of a prefix in a bitmap.
+
+    Pools larger than MAX_POOL_SIZE, like an IPv6 /64, need a size that
+    limits them to the first addresses of the prefix. The network address,
+    and the broadcast address of IPv4 networks, are reserved by default.
+    """
+
+    network: Network
+    first: int
+    size: int
+    used: int
+    reserved: typing.List[Address]
+    _address_type: typing.Type[Address]
+    _bitmap: bytearray
+    _free: array.array
+    _next: int
+
+    def __init__(
+        self,
+        network: typing.Union[str, Network],
+        size: typing.Optional[int]=None,
+        reserved: typing.Optional[typing.Iterable[Address]]=None
+    ) -> None:
+        self.network = ipaddress.ip_network(network)
+        if size is None:
+            size = self.network.num_addresses
+        if size > self.network.num_addresses:
+            raise ValueError(f"{self.network} has less than {size} addresses")
+        elif size > MAX_POOL_SIZE:
+            raise ValueError(f"Pools are limited to {MAX_POOL_SIZE} addresses")
+        self.first = int(self.network.network_address)
+        self.size = size
+        self.used = 0
+        if self.network.version == 4:
+            self._address_type = ipaddress.IPv4Address
+        else:
+            self._address_type = ipaddress.IPv6Address
+        self._bitmap = bytearray((size + 7) // 8)
+        self._free = array.array("L")
+        self._next = 0
+        if reserved is None:
+            reserved = self.__get_default_reserved()
+        self.reserved = list(reserved)
+        for address in self.reserved:
+            self.claim(address)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__}: {self.network} "
+            f"{self.used}/{self.size}>"
+        )
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, address: Address) -> bool:
+        if address.version != self.network.version:
+            return False
+        return (0 <= int(address) - self.first < self.size) is True
+
+    @property
+    def version(self) -> int:
+        return int(self.network.version)
+
+    @property
+    def available(self) -> int:
+        return self.size - self.used
+
+    def is_used(self, address: Address) -> bool:
+        return self.__test(self.__index(address)) is True
+
+    def allocate(self) -> Address:
+        """Return a free address and mark it as used."""
+        index = self.__next_free()
+        self.__set(index)
+        return self._address_type(self.first + index)
+
+    def claim(self, address: Address) -> None:
+        """Mark a specific address as used."""
+        index = self.__index(address)
+        if self.__test(index) is True:
+            raise OSError(errno.EADDRINUSE, f"{address} is already used")
+        self.__set(index)
+
+    def release(self, address: Address) -> None:
+        """Return a used address to the pool."""
+        index = self.__index(address)
+        if self.__test(index) is False:
+            raise ValueError(f"{address} is not used")
+        self._bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+        self.used -= 1
+        if index < self._next:
+            self._free.append(index)
+
+    def clear(self) -> None:
+        """Release all addresses except the reserved ones."""
+        self._bitmap = bytearray(len(self._bitmap))
+        self._free = array.array("L")
+        self._next = 0
+        self.used = 0
+        for address in self.reserved:
+            self.claim(address)
+
+    def __next_free(self) -> int:
+        # addresses at or above the cursor are free unless they were claimed
+        while self._next < self.size:
+            index = self._next
+            self._next += 1
+            if self.__test(index) is False:
+                return index
+        # the stack may hold addresses that were claimed after the release
+        while len(self._free) > 0:
+            index = self._free.pop()
+            if self.__test(index) is False:
+                return index
+        raise OSError(
+            errno.EADDRNOTAVAIL,
+            f"No free address in {self.network}"
+        )
+
+    def __index(self, address: Address) -> int:
+        if address not in self:
+            raise ValueError(f"{address} is not in {self.network}")
+        return int(address) - self.first
+
+    def __test(self, index: int) -> bool:
+        return ((self._bitmap[index >> 3] >> (index & 7)) & 1) == 1
+
+    def __set(self, index: int) -> None:
+        self._bitmap[index >> 3] |= 1 << (index & 7)
+        self.used += 1
+
+    def __get_default_reserved(self) -> typing.List[Address]:
+        network = self.network
+        if network.num_addresses <= 2:
+            return []
+        reserved = [network.network_address]
+        if (network.version == 4) and (self.size == network.num_addresses):
+            reserved.append(network.broadcast_address)
+        return reserved
+
+
+class AddressAllocator:
+    """
+    Addresses of several pools leased to jails by name.
+
+    >>> allocator = jail.ippool.AddressAllocator([
+    ...     jail.ippool.AddressPool("10.23.0.0/16"),
+    ...     jail.ippool.AddressPool("fd00:23::/64", size=2 ** 16)
+    ... ])
+    >>> allocator.rebuild()
+    >>> allocator.allocate("www", version=4)
+    [IPv4Address('10.23.0.1')]
+    >>> allocator.allocate("www", version=6)
+    [IPv6Address('fd00:23::1')]
+    >>> jail.create_jail(
+    ...     dict(persist=None, name="www", **allocator.params("www"))
+    ... )
+    """
+
+    pools: typing.List[AddressPool]
+    leases: typing.Dict[str, typing.List[Address]]
+    max_af_ips: typing.Optional[int]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        pools: typing.Iterable[AddressPool],
+        max_af_ips: typing.Optional[int]=None
+    ) -> None:
+        self.pools = list(pools)
+        self.leases = {}
+        self.max_af_ips = max_af_ips
+        self._lock = threading.Lock()
+
+    def allocate(
+        self,
+        owner: str,
+        version: int=4,
+        count: int=1
+    ) -> typing.List[Address]:
+        """Lease count more addresses of one family to a jail."""
+        limit = self.max_af_ips
+        if limit is None:
+            limit = jail.get_jail_max_af_ips()
+        with self._lock:
+            leased = self.leases.get(owner, [])
+            if len([x for x in leased if x.version == version]) + count > (
+                limit
+            ):
+                raise ValueError(f"Too many IPs (max {limit})")
+            addresses: typing.List[Address] = []
+            try:
+                for _ in range(count):
+                    addresses.append(self.__allocate(version))
+            except OSError:
+                for address in addresses:
+                    self.__get_pool(address).release(address)
+                raise
+            self.leases.setdefault(owner, []).extend(addresses)
+            return addresses
+
+    def claim(self, owner: str, address: Address) -> None:
+        """Lease a specific address to a jail."""
+        with self._lock:
+            self.__get_pool(address).claim(address)
+            self.leases.setdefault(owner, []).append(address)
+
+    def release(
+        self,
+        owner: str,
+        addresses: typing.Optional[typing.Iterable[Address]]=None
+    ) -> typing.List[Address]:
+        """Return the given or all addresses of a jail to their pools."""
+        with self._lock:
+            leased = self.leases.get(owner, [])
+            if addresses is None:
+                released = list(leased)
+            else:
+                released = [x for x in addresses if x in leased]
+            for address in released:
+                self.__get_pool(address).release(address)
+                leased.remove(address)
+            if len(leased) == 0:
+                self.leases.pop(owner, None)
+            return released
+
+    def params(self, owner: str) -> typing.Dict[str, typing.List[Address]]:
+        """Return the ip4.addr and ip6.addr parameters of a jail."""
+        params: typing.Dict[str, typing.List[Address]] = {}
+        for address in self.leases.get(owner, []):
+            key = "ip4.addr" if (address.version == 4) else "ip6.addr"
+            params.setdefault(key, []).append(address)
+        return params
+
+    def rebuild(
+        self,
+        records: typing.Optional[typing.Iterable[jail.JailRecord]]=None
+    ) -> None:
+        """
+        Lease the addresses of the live jails and release all others.
+
+        The jails are read with one enumeration unless records are passed.
+        """
+        if records is None:
+            records = jail.iterate_jails(("name", "ip4.addr", "ip6.addr"))
+        with self._lock:
+            for pool in self.pools:
+                pool.clear()
+            self.leases = {}
+            for record in records:
+                for address in record.get_addresses():
+                    found = self.__find_pool(address)
+                    if (found is None) or found.is_used(address):
+                        continue
+                    found.claim(address)
+                    self.leases.setdefault(
+                        record.get_str("name"),
+                        []
+                    ).append(address)
+
+    def __allocate(self, version: int) -> Address:
+        for pool in self.pools:
+            if (pool.version == version) and (pool.available > 0):
+                return pool.allocate()
+        raise OSError(
+            errno.EADDRNOTAVAIL,
+            f"No free IPv{version} address in any pool"
+        )
+
+    def __get_pool(self, address: Address) -> AddressPool:
+        pool = self.__find_pool(address)
+        if pool is None:
+            raise ValueError(f"{address} is in no pool")
+        return pool
+
+    def __find_pool(self, address: Address) -> typing.Optional[AddressPool]:
+        for pool in self.pools:
+            if address in pool:
+                return pool
+        return None
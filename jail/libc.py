@@ -21,10 +21,91 @@
 # STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
-"""libc abstraction."""
+"""
+libc abstraction.
+
+The C library is loaded on first access of `jail.libc.dll` and cached for
+the lifetime of the process. set_backend replaces it with any object that
+provides jail_set, jail_get, jail_remove and jail_attach with the libc
+signatures and errno semantics, like jail.simulator.JailSimulator.
+
+The rctl (2) calls share one signature and are made with rctl().
+"""
+import typing
 import ctypes
-try:
-    dll = ctypes.CDLL("libc.so.7")
-except OSError:
-    import ctypes.util
-    dll = ctypes.CDLL(str(ctypes.util.find_library("c")), use_errno=True)
+import errno
+import os
+
+RCTL_CALLS = (
+    "rctl_get_racct",
+    "rctl_get_rules",
+    "rctl_get_limits",
+    "rctl_add_rule",
+    "rctl_remove_rule"
+)
+RCTL_DEFAULT_OUTPUT_SIZE = 4096
+RCTL_MAX_OUTPUT_SIZE = 1024 * 1024
+
+
+def load_dll() -> ctypes.CDLL:
+    try:
+        return ctypes.CDLL("libc.so.7", use_errno=True)
+    except OSError:
+        from ctypes.util import find_library
+        return ctypes.CDLL(str(find_library("c")), use_errno=True)
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name == "dll":
+        dll = load_dll()
+        globals()["dll"] = dll
+        return dll
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_backend() -> typing.Any:
+    """Return the current syscall backend, loading libc on first use."""
+    try:
+        return globals()["dll"]
+    except KeyError:
+        return __getattr__("dll")
+
+
+def set_backend(backend: typing.Optional[typing.Any]) -> None:
+    """Route the jail syscalls to backend, or back to libc with None."""
+    if backend is None:
+        globals().pop("dll", None)
+    else:
+        globals()["dll"] = backend
+
+
+def rctl(
+    call: str,
+    rule: bytes,
+    output: typing.Optional[ctypes.Array]=None
+) -> ctypes.Array:
+    """
+    Call one of the RCTL_CALLS with a rule or filter like b"jail:www".
+
+    The kernel writes its answer to the output buffer, which is replaced
+    by a larger one and returned while the kernel reports ERANGE. Pass the
+    returned buffer to the next call to reuse it.
+    """
+    if call not in RCTL_CALLS:
+        raise ValueError(f"unknown rctl call: {call}")
+    if output is None:
+        output = ctypes.create_string_buffer(RCTL_DEFAULT_OUTPUT_SIZE)
+    func = getattr(get_backend(), call)
+    while True:
+        result = func(
+            rule,
+            ctypes.c_size_t(len(rule) + 1),
+            output,
+            ctypes.c_size_t(len(output))
+        )
+        if result == 0:
+            return output
+        error = ctypes.get_errno()
+        if (error != errno.ERANGE) or (len(output) >= RCTL_MAX_OUTPUT_SIZE):
+            raise OSError(error, os.strerror(error))
+        output = ctypes.create_string_buffer(len(output) * 2)
@@ -0,0 +1,248 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Opt-in instrumentation of the jail syscalls and of Jiov marshalling.
+
+Instrumentation is disabled by default. enable() wraps the current syscall
+backend and collects per-operation counts, errors by errno and latency
+histograms, and the bytes that Jiov compiled for the kernel. Pre- and
+post-call hooks receive every call, for example to feed other metrics.
+
+While disabled the syscall backend is not wrapped at all and marshalling
+only checks whether `jail.metrics.current` is set.
+"""
+import typing
+import bisect
+import collections
+import ctypes
+import threading
+import time
+
+import jail.libc
+
+LATENCY_BUCKETS = (
+    0.00001,
+    0.0001,
+    0.001,
+    0.01,
+    0.1,
+    1.0,
+    10.0
+)
+
+PreHook = typing.Callable[[str, typing.Tuple[typing.Any, ...]], None]
+PostHook = typing.Callable[
+    [str, typing.Tuple[typing.Any, ...], int, int, float],
+    None
+]
+
+
+class Histogram:
+    """Latency histogram with fixed upper bounds in seconds."""
+
+    bounds: typing.Tuple[float, ...]
+    counts: typing.List[int]
+    total: float
+
+    def __init__(
+        self,
+        bounds: typing.Tuple[float, ...]=LATENCY_BUCKETS
+    ) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        buckets = [str(x) for x in self.bounds] + ["+Inf"]
+        return dict(
+            buckets=dict(zip(buckets, self.counts)),
+            count=len(self),
+            sum=self.total
+        )
+
+
+class OperationStats:
+    """Counters of one instrumented operation."""
+
+    count: int
+    errors: typing.Counter[int]
+    latency: Histogram
+    bytes: int
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = collections.Counter()
+        self.latency = Histogram()
+        self.bytes = 0
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        return dict(
+            count=self.count,
+            errors=dict(self.errors),
+            latency=self.latency.snapshot(),
+            bytes=self.bytes
+        )
+
+
+class Metrics:
+    """Collected statistics and registered hooks."""
+
+    operations: typing.Dict[str, OperationStats]
+    pre_hooks: typing.List[PreHook]
+    post_hooks: typing.List[PostHook]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.operations = collections.defaultdict(OperationStats)
+        self.pre_hooks = []
+        self.post_hooks = []
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        operation: str,
+        duration: float,
+        error: int=0,
+        size: int=0
+    ) -> None:
+        with self._lock:
+            stats = self.operations[operation]
+            stats.count += 1
+            stats.latency.record(duration)
+            stats.bytes += size
+            if error != 0:
+                stats.errors[error] += 1
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Return a copy of all statistics as plain dicts."""
+        with self._lock:
+            return {
+                name: stats.snapshot()
+                for name, stats in self.operations.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.operations.clear()
+
+
+class InstrumentedBackend:
+    """Syscall backend that times and counts the calls of another one."""
+
+    backend: typing.Any
+    metrics: Metrics
+
+    def __init__(self, backend: typing.Any, metrics: Metrics) -> None:
+        self.backend = backend
+        self.metrics = metrics
+
+    def __getattr__(self, name: str) -> typing.Any:
+        attribute = getattr(self.backend, name)
+        if name.startswith(("jail_", "rctl_")) is False:
+            return attribute
+        instrumented = self.__instrument(name, attribute)
+        # cache on the instance, later lookups skip __getattr__
+        setattr(self, name, instrumented)
+        return instrumented
+
+    def __instrument(
+        self,
+        name: str,
+        func: typing.Callable[..., int]
+    ) -> typing.Callable[..., int]:
+        metrics = self.metrics
+
+        def call(*args: typing.Any) -> int:
+            for pre_hook in metrics.pre_hooks:
+                pre_hook(name, args)
+            start = time.perf_counter()
+            result = int(func(*args))
+            duration = time.perf_counter() - start
+            error = ctypes.get_errno() if (result < 0) else 0
+            metrics.record(name, duration, error)
+            for post_hook in metrics.post_hooks:
+                post_hook(name, args, result, error, duration)
+            if error != 0:
+                # hooks must not clobber the errno read by the caller
+                ctypes.set_errno(error)
+            return result
+
+        return call
+
+
+current: typing.Optional[Metrics] = None
+
+
+def enable(metrics: typing.Optional[Metrics]=None) -> Metrics:
+    """
+    Start collecting statistics of the current syscall backend.
+
+    Select the backend with jail.libc.set_backend before enabling.
+    """
+    global current
+    if current is not None:
+        disable()
+    if metrics is None:
+        metrics = Metrics()
+    jail.libc.set_backend(InstrumentedBackend(jail.libc.dll, metrics))
+    current = metrics
+    return metrics
+
+
+def disable() -> None:
+    """Stop collecting statistics and unwrap the syscall backend."""
+    global current
+    if current is None:
+        return
+    backend = jail.libc.dll
+    if isinstance(backend, InstrumentedBackend) is True:
+        jail.libc.set_backend(backend.backend)
+    current = None
+
+
+def snapshot() -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Return the statistics collected so far or nothing if disabled."""
+    if current is None:
+        return {}
+    return current.snapshot()
+
+
+def add_hooks(
+    pre: typing.Optional[PreHook]=None,
+    post: typing.Optional[PostHook]=None
+) -> None:
+    """Register hooks that are called before and after every syscall."""
+    if current is None:
+        raise RuntimeError("jail.metrics is not enabled")
+    if pre is not None:
+        current.pre_hooks.append(pre)
+    if post is not None:
+        current.post_hooks.append(post)
@@ -0,0 +1,329 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Jail parameter metadata from the security.jail.param sysctl tree.
+
+The metadata of all parameters is read in one walk of the sysctl tree and
+cached on disk per kernel, so later processes do not query any sysctls.
+"""
+import typing
+import ctypes
+import os
+import os.path
+import struct
+import sys
+import threading
+import ipaddress
+
+import jail
+
+if typing.TYPE_CHECKING:
+    import freebsd_sysctl
+
+PARAM_SYSCTL_PREFIX = "security.jail.param."
+
+CTLTYPE_INT = 2
+CTLTYPE_STRING = 3
+CTLTYPE_S64 = 4
+CTLTYPE_STRUCT = 5
+CTLTYPE_UINT = 6
+CTLTYPE_LONG = 7
+CTLTYPE_ULONG = 8
+CTLTYPE_U64 = 9
+
+INTEGER_FORMATS = {
+    CTLTYPE_INT: "i",
+    CTLTYPE_UINT: "I",
+    CTLTYPE_LONG: "l",
+    CTLTYPE_ULONG: "L",
+    CTLTYPE_S64: "q",
+    CTLTYPE_U64: "Q"
+}
+
+TYPE_NAMES = {
+    CTLTYPE_INT: "int",
+    CTLTYPE_STRING: "string",
+    CTLTYPE_S64: "s64",
+    CTLTYPE_UINT: "uint",
+    CTLTYPE_LONG: "long",
+    CTLTYPE_ULONG: "ulong",
+    CTLTYPE_U64: "u64"
+}
+
+JailParamValue = typing.Union[
+    int,
+    bool,
+    str,
+    typing.List[ipaddress.IPv4Address],
+    typing.List[ipaddress.IPv6Address]
+]
+
+
+class JailParam:
+    """Type and value size of a jail parameter."""
+
+    name: str
+    ctl_type: int
+    fmt: str
+    size: int
+
+    def __init__(
+        self,
+        name: str,
+        ctl_type: int,
+        fmt: str,
+        size: int
+    ) -> None:
+        self.name = name
+        self.ctl_type = ctl_type
+        self.fmt = fmt
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.name} ({self.fmt})>"
+
+    @property
+    def is_string(self) -> bool:
+        return (self.ctl_type == CTLTYPE_STRING) is True
+
+    @property
+    def is_bool(self) -> bool:
+        return (self.fmt == "B") is True
+
+    @property
+    def address_type(self) -> typing.Optional[type]:
+        if self.fmt.startswith("S,in_addr") is True:
+            return ipaddress.IPv4Address
+        elif self.fmt.startswith("S,in6_addr") is True:
+            return ipaddress.IPv6Address
+        return None
+
+    @property
+    def type_name(self) -> str:
+        """Return the type used to look up the codec of the parameter."""
+        if self.is_bool is True:
+            return "bool"
+        elif self.fmt.startswith("E,jailsys") is True:
+            return "jailsys"
+        elif self.fmt.startswith("S,in_addr") is True:
+            return "in_addr"
+        elif self.fmt.startswith("S,in6_addr") is True:
+            return "in6_addr"
+        try:
+            return TYPE_NAMES[self.ctl_type]
+        except KeyError:
+            raise TypeError(f"Unsupported jail parameter type: {self.name}")
+
+
+class ParamTable(dict):
+    """Metadata of all jail parameters of one kernel."""
+
+    kernel: str
+    jail_max_af_ips: int
+    query_missing: bool
+
+    def __init__(
+        self,
+        kernel: str,
+        jail_max_af_ips: int,
+        params: typing.Iterable[JailParam]=(),
+        query_missing: bool=True
+    ) -> None:
+        """
+        Create a parameter table.
+
+        Parameters missing in the table are queried from sysctl, unless
+        query_missing is disabled as for stand-ins on non-FreeBSD hosts.
+        """
+        super().__init__((x.name, x) for x in params)
+        self.kernel = kernel
+        self.jail_max_af_ips = jail_max_af_ips
+        self.query_missing = query_missing
+
+    def dump(self) -> typing.Dict[str, typing.Any]:
+        return dict(
+            kernel=self.kernel,
+            jail_max_af_ips=self.jail_max_af_ips,
+            params={
+                x.name: [x.ctl_type, x.fmt, x.size] for x in self.values()
+            }
+        )
+
+    @classmethod
+    def load(cls, data: typing.Dict[str, typing.Any]) -> 'ParamTable':
+        return cls(
+            kernel=str(data["kernel"]),
+            jail_max_af_ips=int(data["jail_max_af_ips"]),
+            params=(
+                JailParam(
+                    name=name,
+                    ctl_type=int(ctl_type),
+                    fmt=str(fmt),
+                    size=int(size)
+                ) for name, (ctl_type, fmt, size) in data["params"].items()
+            )
+        )
+
+
+_table: typing.Optional[ParamTable] = None
+_lock = threading.RLock()
+
+
+def get_kernel_id() -> str:
+    """Identify the running kernel without querying sysctls."""
+    uname = os.uname()
+    return f"{uname.sysname} {uname.release} {uname.version}"
+
+
+def get_cache_path(kernel: str) -> str:
+    import hashlib
+    cache_dir = os.environ.get("XDG_CACHE_HOME", "")
+    if cache_dir == "":
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache")
+    digest = hashlib.sha256(kernel.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "py-jail", f"params-{digest}.json")
+
+
+def get_table() -> ParamTable:
+    """Return the parameter metadata, loaded once per process."""
+    global _table
+    table = _table
+    if table is None:
+        with _lock:
+            if _table is None:
+                _table = load_table()
+            table = _table
+    return table
+
+
+def set_table(table: typing.Optional[ParamTable]) -> None:
+    """Replace the parameter metadata, for example with a stand-in."""
+    global _table
+    _table = table
+
+
+def load_table(path: typing.Optional[str]=None) -> ParamTable:
+    """
+    Load the parameter metadata from disk or from the sysctl tree.
+
+    The file cache is keyed by the running kernel, so it is ignored after a
+    kernel upgrade and rewritten from a fresh sysctl walk.
+    """
+    import json
+    kernel = get_kernel_id()
+    if path is None:
+        path = get_cache_path(kernel)
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            table = ParamTable.load(json.load(f))
+        if table.kernel == kernel:
+            return table
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    table = walk_table(kernel)
+    try:
+        write_table(table, path)
+    except OSError:
+        pass  # the cache is optional
+    return table
+
+
+def write_table(table: ParamTable, path: str) -> None:
+    import json
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}"
+    with open(temp_path, "w", encoding="UTF-8") as f:
+        json.dump(table.dump(), f)
+    os.replace(temp_path, path)
+
+
+def walk_table(kernel: str) -> ParamTable:
+    """Read all jail parameters in one walk of security.jail.param."""
+    import freebsd_sysctl
+    jail_max_af_ips = int(
+        freebsd_sysctl.Sysctl("security.jail.jail_max_af_ips").value
+    )
+    table = ParamTable(kernel=kernel, jail_max_af_ips=jail_max_af_ips)
+    root = freebsd_sysctl.Sysctl(PARAM_SYSCTL_PREFIX.rstrip("."))
+    for sysctl in root.children:
+        # jailsys params of nodes like ip4 are named with a trailing dot
+        name = sysctl.name[len(PARAM_SYSCTL_PREFIX):].rstrip(".")
+        try:
+            table[name] = _describe_param(name, sysctl, jail_max_af_ips)
+        except TypeError:
+            continue
+    return table
+
+
+def get_param(name: str) -> JailParam:
+    """
+    Return the cached metadata of a jail parameter.
+
+    Raises KeyError for parameters unknown to the kernel.
+    """
+    table = get_table()
+    try:
+        return table[name]
+    except KeyError:
+        if table.query_missing is False:
+            raise
+    with _lock:
+        try:
+            return table[name]
+        except KeyError:
+            pass
+        import freebsd_sysctl
+        sysctl = freebsd_sysctl.Sysctl(PARAM_SYSCTL_PREFIX + name)
+        if sysctl.oid[0] == 0:
+            # name2oid leaves the OID buffer untouched for unknown names
+            raise KeyError(f"Unknown jail parameter: {name}")
+        param = _describe_param(name, sysctl, table.jail_max_af_ips)
+        table[name] = param
+        return param
+
+
+def _describe_param(
+    name: str,
+    sysctl: 'freebsd_sysctl.Sysctl',
+    jail_max_af_ips: int
+) -> JailParam:
+    ctl_type = sysctl.kind & 0xF
+    fmt = sysctl.fmt.split(jail.NULL_BYTES, 1)[0].decode()
+
+    if ctl_type == CTLTYPE_STRING:
+        # the sysctl value is the maximum string length in decimal notation
+        size = int(sysctl.value)
+    elif ctl_type == CTLTYPE_STRUCT:
+        # the sysctl value is the size_t size of a single element
+        element_size = int.from_bytes(
+            bytes(sysctl.raw_value.data)[:ctypes.sizeof(ctypes.c_size_t)],
+            sys.byteorder
+        )
+        size = element_size * jail_max_af_ips
+    elif ctl_type in INTEGER_FORMATS.keys():
+        size = struct.calcsize(INTEGER_FORMATS[ctl_type])
+    else:
+        raise TypeError(f"Unsupported jail parameter type: {name}")
+
+    return JailParam(name=name, ctl_type=ctl_type, fmt=fmt, size=size)
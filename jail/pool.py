@@ -0,0 +1,224 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Worker processes that stay attached to a jail.
+
+A JailPool forks its workers once, attaches each of them to the jail and
+keeps them alive, so submitting a task only costs a round trip over the
+pool pipes instead of fork, jail_attach (2) and exec. Callables and their
+arguments are pickled like with concurrent.futures.ProcessPoolExecutor.
+
+When the jail is removed its workers are killed by the kernel. A monitor
+thread notices the removal, terminates the pool and fails all pending
+futures, so the pool does not keep respawning workers that cannot attach.
+For the same reason the pool is only created after a probe process was
+able to attach, otherwise the constructor raises the OSError of the probe.
+"""
+import typing
+import concurrent.futures
+import errno
+import multiprocessing
+import multiprocessing.pool
+import os
+import subprocess
+import threading
+
+import jail
+import jail.exec
+
+DEFAULT_MONITOR_INTERVAL = 1.0
+
+T = typing.TypeVar("T")
+
+
+def _attach_worker(attach: typing.Callable[..., int], jid: int) -> None:
+    if int(attach(jid)) < 0:
+        jail.raise_errno()
+    os.chdir("/")
+
+
+def _probe_attach(attach: typing.Callable[..., int], jid: int) -> None:
+    """Raise the error of a forked process that fails to attach."""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _attach_worker(attach, jid)
+        except OSError as e:
+            code = errno.EPERM if (e.errno is None) else e.errno
+        except BaseException:
+            code = errno.EINVAL
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    if os.WIFEXITED(status) is False:
+        raise ChildProcessError(f"attach probe died with status {status}")
+    code = os.WEXITSTATUS(status)
+    if code != 0:
+        raise OSError(code, f"cannot attach to jail {jid}")
+
+
+class JailPool:
+    """
+    Pre-forked worker processes attached to one jail.
+
+    >>> with jail.pool.JailPool("www", processes=4) as pool:
+    ...     pool.submit(os.getuid).result()
+    ...     pool.run(["/bin/hostname"], stdout=PIPE).result().stdout
+    0
+    b'www.example.com\\n'
+    """
+
+    jid: int
+    monitor_interval: float
+    _pool: multiprocessing.pool.Pool
+    _pending: typing.Set[concurrent.futures.Future]
+    _error: typing.Optional[BaseException]
+    _lock: threading.Lock
+    _closed: threading.Event
+    _monitor: threading.Thread
+
+    def __init__(
+        self,
+        jail_id: 'jail.exec.JailIdentifier',
+        processes: typing.Optional[int]=None,
+        maxtasksperchild: typing.Optional[int]=None,
+        monitor_interval: float=DEFAULT_MONITOR_INTERVAL
+    ) -> None:
+        self.jid = jail.exec.get_jid(jail_id)
+        if jail.get_jail(self.jid, ()) is None:
+            raise OSError(errno.ENOENT, f"jail {self.jid} not found")
+        # forked children must not call into the metrics instrumentation
+        attach = jail.exec.get_raw_syscall("jail_attach")
+        # workers failing in the initializer would be respawned forever
+        _probe_attach(attach, self.jid)
+        self.monitor_interval = monitor_interval
+        self._pending = set()
+        self._error = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        # workers must inherit the loaded syscall backend, not re-import it
+        self._pool = multiprocessing.get_context("fork").Pool(
+            processes,
+            initializer=_attach_worker,
+            initargs=(attach, self.jid),
+            maxtasksperchild=maxtasksperchild
+        )
+        self._monitor = threading.Thread(
+            target=self.__watch,
+            name=f"jail-pool-{self.jid}",
+            daemon=True
+        )
+        self._monitor.start()
+
+    def __enter__(self) -> 'JailPool':
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.shutdown()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def submit(
+        self,
+        fn: typing.Callable[..., T],
+        *args: typing.Any,
+        **kwargs: typing.Any
+    ) -> 'concurrent.futures.Future[T]':
+        """Call fn(*args, **kwargs) in a worker inside of the jail."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            elif self.closed is True:
+                raise RuntimeError("cannot submit to a closed JailPool")
+            self._pending.add(future)
+        self._pool.apply_async(
+            fn,
+            args,
+            kwargs,
+            callback=lambda result: self.__resolve(future, result),
+            error_callback=lambda error: self.__resolve(future, error=error)
+        )
+        return future
+
+    def run(
+        self,
+        args: typing.Union[str, typing.Sequence[str]],
+        **kwargs: typing.Any
+    ) -> 'concurrent.futures.Future[subprocess.CompletedProcess]':
+        """Run a command from a worker like subprocess.run."""
+        return self.submit(subprocess.run, args, **kwargs)
+
+    def shutdown(self, wait: bool=True) -> None:
+        """Stop accepting tasks and finish the submitted ones."""
+        with self._lock:
+            if self.closed is True:
+                return
+            self._closed.set()
+        self._pool.close()
+        if wait is True:
+            self._pool.join()
+
+    def terminate(self) -> None:
+        """Kill the workers and fail all pending futures."""
+        self.__teardown(RuntimeError("JailPool was terminated"))
+
+    def __resolve(
+        self,
+        future: concurrent.futures.Future,
+        result: typing.Any=None,
+        error: typing.Optional[BaseException]=None
+    ) -> None:
+        with self._lock:
+            self._pending.discard(future)
+        if future.done() is True:
+            return
+        elif error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def __teardown(self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            self._closed.set()
+            pending = list(self._pending)
+            self._pending.clear()
+        self._pool.terminate()
+        for future in pending:
+            if future.done() is False:
+                future.set_exception(error)
+
+    def __watch(self) -> None:
+        while self._closed.wait(self.monitor_interval) is False:
+            if jail.get_jail(self.jid, ()) is None:
+                self.__teardown(OSError(
+                    errno.ESRCH,
+                    f"jail {self.jid} was removed"
+                ))
+                return
@@ -0,0 +1,317 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Resource usage of jails from racct.
+
+rctl_get_racct (2) reports the usage of a jail as "name=value" pairs in
+a fixed order. The names are parsed once; later samples only extract the
+numbers and keep those of the selected resources.
+
+A RacctSampler reads all jails found by one enumeration per pass and stores
+the samples of each jail in a RingBuffer of fixed capacity, whose samples
+are kept in flat arrays that are allocated once.
+"""
+import typing
+import array
+import ctypes
+import errno
+import re
+import threading
+import time
+
+import jail
+import jail.libc
+
+RACCT_RESOURCES = (
+    "cputime",
+    "datasize",
+    "stacksize",
+    "coredumpsize",
+    "memoryuse",
+    "memorylocked",
+    "maxproc",
+    "openfiles",
+    "vmemoryuse",
+    "pseudoterminals",
+    "swapuse",
+    "nthr",
+    "msgqqueued",
+    "msgqsize",
+    "nmsgq",
+    "nsem",
+    "nsemop",
+    "nshm",
+    "shmsize",
+    "wallclock",
+    "pcpu",
+    "readbps",
+    "writebps",
+    "readiops",
+    "writeiops"
+)
+
+DEFAULT_RESOURCES = (
+    "cputime",
+    "pcpu",
+    "memoryuse",
+    "vmemoryuse",
+    "openfiles",
+    "maxproc"
+)
+DEFAULT_CAPACITY = 60
+
+_NUMBERS = re.compile(rb"\d+")
+
+
+def parse(output: bytes) -> typing.Dict[str, int]:
+    """Return the usage reported by rctl_get_racct (2) by resource."""
+    usage = {}
+    for pair in output.split(b","):
+        name, _, value = pair.partition(b"=")
+        if len(value) > 0:
+            usage[name.decode()] = int(value)
+    return usage
+
+
+def get_racct(name: str) -> typing.Dict[str, int]:
+    """Return the resource usage of a jail by name."""
+    output = jail.libc.rctl("rctl_get_racct", b"jail:" + name.encode())
+    return parse(output.value)
+
+
+class RingBuffer:
+    """The last capacity samples of several resources in flat arrays."""
+
+    resources: typing.Tuple[str, ...]
+    capacity: int
+    timestamps: array.array
+    values: array.array
+    _next: int
+    _count: int
+
+    def __init__(
+        self,
+        resources: typing.Iterable[str],
+        capacity: int=DEFAULT_CAPACITY
+    ) -> None:
+        self.resources = tuple(resources)
+        self.capacity = capacity
+        self.timestamps = array.array("d", bytes(8 * capacity))
+        self.values = array.array(
+            "q",
+            bytes(8 * capacity * len(self.resources))
+        )
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> typing.Iterator[
+        typing.Tuple[float, typing.Dict[str, int]]
+    ]:
+        """Iterate over the samples from the oldest to the newest."""
+        for index in self.__indices():
+            yield (self.timestamps[index], self.__read(index))
+
+    def append(self, timestamp: float, values: typing.Sequence[int]) -> None:
+        """Store a sample and drop the oldest one when full."""
+        width = len(self.resources)
+        index = self._next
+        self.timestamps[index] = timestamp
+        self.values[index * width:(index + 1) * width] = array.array(
+            "q",
+            values
+        )
+        self._next = (index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def latest(self) -> typing.Optional[typing.Dict[str, int]]:
+        """Return the newest sample."""
+        if self._count == 0:
+            return None
+        return self.__read((self._next - 1) % self.capacity)
+
+    def series(
+        self,
+        resource: str
+    ) -> typing.List[typing.Tuple[float, int]]:
+        """Return the timestamps and values of one resource."""
+        width = len(self.resources)
+        offset = self.resources.index(resource)
+        return [
+            (self.timestamps[x], self.values[x * width + offset])
+            for x in self.__indices()
+        ]
+
+    def __indices(self) -> typing.Iterator[int]:
+        start = (self._next - self._count) % self.capacity
+        for i in range(self._count):
+            yield (start + i) % self.capacity
+
+    def __read(self, index: int) -> typing.Dict[str, int]:
+        width = len(self.resources)
+        return dict(zip(
+            self.resources,
+            self.values[index * width:(index + 1) * width]
+        ))
+
+
+class RacctSampler:
+    """
+    Sample the resource usage of all jails.
+
+    >>> sampler = jail.racct.RacctSampler(capacity=300)
+    >>> sampler.start(interval=1)
+    >>> sampler.series["www"].latest()
+    {'cputime': 12, 'pcpu': 3, 'memoryuse': 41943040, ...}
+
+    Jails are sampled by name, as racct accounts them. The samples of jails
+    that are gone are dropped on the next pass.
+    """
+
+    resources: typing.Tuple[str, ...]
+    capacity: int
+    series: typing.Dict[str, RingBuffer]
+    error: typing.Optional[Exception]
+    _filters: typing.Dict[str, bytes]
+    _layout: typing.Optional[typing.Tuple[int, typing.Tuple[int, ...]]]
+    _output: ctypes.Array
+    _thread: typing.Optional[threading.Thread]
+    _stop: threading.Event
+
+    def __init__(
+        self,
+        resources: typing.Iterable[str]=DEFAULT_RESOURCES,
+        capacity: int=DEFAULT_CAPACITY
+    ) -> None:
+        self.resources = tuple(resources)
+        for resource in self.resources:
+            if resource not in RACCT_RESOURCES:
+                raise ValueError(f"unknown racct resource: {resource}")
+        self.capacity = capacity
+        self.series = {}
+        self.error = None
+        self._filters = {}
+        self._layout = None
+        self._output = ctypes.create_string_buffer(
+            jail.libc.RCTL_DEFAULT_OUTPUT_SIZE
+        )
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __enter__(self) -> 'RacctSampler':
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.stop()
+
+    def sample(self) -> int:
+        """Sample all jails once and return how many were sampled."""
+        timestamp = time.time()
+        seen = set()
+        for record in jail.iterate_jails(("name",)):
+            name = record.get_str("name")
+            try:
+                output = self.__get_racct(name)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ESRCH):
+                    # the jail was removed after the enumeration
+                    continue
+                raise
+            numbers = _NUMBERS.findall(output)
+            layout = self._layout
+            if (layout is None) or (layout[0] != len(numbers)):
+                layout = self.__learn_layout(output)
+            try:
+                series = self.series[name]
+            except KeyError:
+                series = RingBuffer(self.resources, self.capacity)
+                self.series[name] = series
+            series.append(timestamp, [int(numbers[x]) for x in layout[1]])
+            seen.add(name)
+        for name in list(self.series):
+            if name not in seen:
+                del self.series[name]
+                self._filters.pop(name, None)
+        return len(seen)
+
+    def start(self, interval: float=1.0) -> None:
+        """
+        Sample every interval seconds on a background thread.
+
+        The thread ends on the first error, which is kept as error.
+        """
+        if self._thread is not None:
+            return
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.__run,
+            args=(interval,),
+            name="jail-racct",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self._thread = None
+
+    def __run(self, interval: float) -> None:
+        deadline = time.monotonic()
+        while self._stop.is_set() is False:
+            try:
+                self.sample()
+            except Exception as e:
+                self.error = e
+                return
+            # keep the pace of interval regardless of the sampling time
+            deadline = max(deadline + interval, time.monotonic())
+            self._stop.wait(deadline - time.monotonic())
+
+    def __get_racct(self, name: str) -> bytes:
+        try:
+            rule = self._filters[name]
+        except KeyError:
+            rule = b"jail:" + name.encode()
+            self._filters[name] = rule
+        self._output = jail.libc.rctl("rctl_get_racct", rule, self._output)
+        return self._output.value
+
+    def __learn_layout(
+        self,
+        output: bytes
+    ) -> typing.Tuple[int, typing.Tuple[int, ...]]:
+        names = list(parse(output).keys())
+        missing = [x for x in self.resources if x not in names]
+        if len(missing) > 0:
+            raise ValueError(f"racct does not report {', '.join(missing)}")
+        layout = (len(names), tuple(names.index(x) for x in self.resources))
+        self._layout = layout
+        return layout
@@ -0,0 +1,439 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Reconcile the jails of a host with a desired set of jail specs.
+
+Jails are identified by name. A plan compares the desired specs with one
+enumeration of the live jails and contains the jails to create, the
+parameters that changed per jail and, with prune, the jails to remove.
+Unchanged jails need no action at all.
+
+Actions that need a name or an address another action frees depend on it,
+so jails are removed and addresses are dropped before they are used again,
+and parent jails are created before their children. Jails that swap their
+addresses depend on each other, so one of them first drops the contested
+addresses with an additional update. Every level of independent actions
+runs in parallel with jail.batch.
+"""
+import typing
+import concurrent.futures
+import ipaddress
+
+import jail
+import jail.batch
+import jail.codecs
+import jail.diff
+
+CREATE = "create"
+UPDATE = "update"
+REMOVE = "remove"
+
+Resource = typing.Tuple[
+    str,
+    typing.Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address]
+]
+
+
+class Action:
+    """A single jail_set (2) or jail_remove (2) of a plan."""
+
+    kind: str
+    name: str
+    jid: typing.Optional[int]
+    params: jail.diff.Changes
+    claims: typing.Set[Resource]
+    releases: typing.Set[Resource]
+
+    def __init__(
+        self,
+        kind: str,
+        name: str,
+        jid: typing.Optional[int]=None,
+        params: typing.Optional[jail.diff.Changes]=None
+    ) -> None:
+        self.kind = kind
+        self.name = name
+        self.jid = jid
+        self.params = {} if (params is None) else params
+        self.claims = set()
+        self.releases = set()
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.kind} {self.name}>"
+
+    def apply(self) -> int:
+        """Run the action and return the jid of the jail."""
+        if self.kind == CREATE:
+            return jail.create_jail(self.__get_params(name=self.name))
+        elif self.jid is None:
+            raise ValueError(f"cannot {self.kind} {self.name} without jid")
+        elif self.kind == REMOVE:
+            jail.remove_jail(self.jid)
+            return self.jid
+        return jail.update_jail(self.__get_params(jid=self.jid))
+
+    def __get_params(self, **params: typing.Any) -> jail.JailParams:
+        return typing.cast(jail.JailParams, dict(self.params, **params))
+
+
+class Plan:
+    """Actions grouped into levels that may run in parallel."""
+
+    levels: typing.List[typing.List[Action]]
+    unchanged: typing.List[str]
+
+    def __init__(
+        self,
+        levels: typing.List[typing.List[Action]],
+        unchanged: typing.List[str]
+    ) -> None:
+        self.levels = levels
+        self.unchanged = unchanged
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.levels)
+
+    def __iter__(self) -> typing.Iterator[Action]:
+        for level in self.levels:
+            yield from level
+
+    def __repr__(self) -> str:
+        counts = ", ".join(
+            f"{kind}={len(self.filter(kind))}"
+            for kind in (CREATE, UPDATE, REMOVE)
+        )
+        return f"<{self.__class__.__name__}: {counts}>"
+
+    def filter(self, kind: str) -> typing.List[Action]:
+        return [x for x in self if x.kind == kind]
+
+
+class Report:
+    """Outcome of a reconciliation with one BatchResult per action."""
+
+    plan: Plan
+    results: typing.List[jail.batch.BatchResult]
+    dry_run: bool
+
+    def __init__(
+        self,
+        plan: Plan,
+        results: typing.List[jail.batch.BatchResult],
+        dry_run: bool=False
+    ) -> None:
+        self.plan = plan
+        self.results = results
+        self.dry_run = dry_run
+
+    def __repr__(self) -> str:
+        failed = len(self.failed)
+        return f"<{self.__class__.__name__}: {self.plan!r} failed={failed}>"
+
+    @property
+    def ok(self) -> bool:
+        return (len(self.failed) == 0) is True
+
+    @property
+    def failed(self) -> typing.List[jail.batch.BatchResult]:
+        return [x for x in self.results if x.ok is False]
+
+    def summary(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Count the succeeded and failed actions of every kind."""
+        summary = {
+            kind: dict(ok=0, failed=0)
+            for kind in (CREATE, UPDATE, REMOVE)
+        }
+        for result in self.results:
+            summary[result.item.kind][
+                "ok" if (result.ok is True) else "failed"
+            ] += 1
+        summary["unchanged"] = dict(ok=len(self.plan.unchanged), failed=0)
+        return summary
+
+
+def plan(
+    desired: typing.Iterable[jail.diff.Changes],
+    prune: bool=False,
+    current: typing.Optional[
+        typing.Iterable[typing.Mapping[str, typing.Any]]
+    ]=None
+) -> Plan:
+    """
+    Plan the actions that turn the live jails into the desired ones.
+
+    The live jails are read with one enumeration unless their records are
+    passed as current. Every spec needs a unique name. With prune all live
+    jails without a spec are removed.
+    """
+    specs: typing.Dict[str, jail.diff.Changes] = {}
+    for spec in desired:
+        params = dict(spec)
+        params.pop("jid", None)
+        try:
+            name = str(params.pop("name"))
+        except KeyError:
+            raise ValueError("jail specs need a name")
+        if name in specs:
+            raise ValueError(f"duplicate jail spec: {name}")
+        specs[name] = params
+
+    records: typing.Iterable[typing.Mapping[str, typing.Any]]
+    if current is None:
+        records = jail.iterate_jails(_get_readable(specs.values()))
+    else:
+        records = current
+    live = {str(x["name"]): _get_record(x) for x in records}
+
+    actions: typing.List[Action] = []
+    unchanged: typing.List[str] = []
+    for name, params in specs.items():
+        record = live.get(name)
+        if record is None:
+            action = Action(CREATE, name, params=params)
+            action.claims.add(("name", name))
+            action.claims.update(_get_addresses(params))
+            if "." in name:
+                action.claims.add(("parent", name.rsplit(".", 1)[0]))
+            actions.append(action)
+            continue
+        changes = jail.diff.diff(record, params)
+        if len(changes) == 0:
+            unchanged.append(name)
+            continue
+        action = Action(UPDATE, name, jid=record.jid, params=changes)
+        held = _get_addresses(record)
+        wanted = _get_addresses(changes)
+        for key in ("ip4.addr", "ip6.addr"):
+            if key in changes:
+                action.releases.update(
+                    x for x in _get_addresses(record, (key,))
+                    if x not in wanted
+                )
+        action.claims.update(wanted - held)
+        actions.append(action)
+
+    if prune is True:
+        for name, record in live.items():
+            if name in specs:
+                continue
+            action = Action(REMOVE, name, jid=record.jid)
+            action.releases.add(("name", name))
+            action.releases.update(_get_addresses(record))
+            actions.append(action)
+
+    return Plan(_get_levels(actions), unchanged)
+
+
+def apply(
+    plan: Plan,
+    max_workers: int=jail.batch.DEFAULT_MAX_WORKERS,
+    fail_fast: bool=False,
+    executor: typing.Optional[concurrent.futures.Executor]=None
+) -> Report:
+    """
+    Run the actions of a plan level by level.
+
+    Actions that depend on a failed action are skipped with ECANCELED, and
+    with fail_fast all remaining actions are.
+    """
+    results: typing.Dict[int, jail.batch.BatchResult] = {}
+    failed: typing.Set[Resource] = set()
+    stop = False
+
+    pool = executor
+    if pool is None:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="jail-reconcile"
+        )
+    try:
+        for level in plan.levels:
+            pending = []
+            for action in level:
+                if (stop is True) or (len(action.claims & failed) > 0):
+                    results[id(action)] = jail.batch.BatchResult(
+                        action,
+                        error=concurrent.futures.CancelledError()
+                    )
+                    failed.update(action.releases | _provides(action))
+                else:
+                    pending.append(action)
+            for result in jail.batch.run_batch(
+                _apply,
+                pending,
+                fail_fast=fail_fast,
+                executor=pool
+            ):
+                results[id(result.item)] = result
+                if result.ok is False:
+                    failed.update(result.item.releases)
+                    failed.update(_provides(result.item))
+                    stop = fail_fast
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return Report(plan, [results[id(x)] for x in plan])
+
+
+def reconcile(
+    desired: typing.Iterable[jail.diff.Changes],
+    prune: bool=False,
+    dry_run: bool=False,
+    current: typing.Optional[
+        typing.Iterable[typing.Mapping[str, typing.Any]]
+    ]=None,
+    **kwargs: typing.Any
+) -> Report:
+    """
+    Plan and apply the actions that turn the live jails into the desired.
+
+    A dry run only plans and reports every action as successful without
+    calling jail_set (2) or jail_remove (2). Together with current records
+    it makes no syscall at all.
+    """
+    _plan = plan(desired, prune=prune, current=current)
+    if dry_run is True:
+        return Report(
+            _plan,
+            [jail.batch.BatchResult(x, jid=x.jid) for x in _plan],
+            dry_run=True
+        )
+    return apply(_plan, **kwargs)
+
+
+def _apply(action: Action) -> int:
+    return action.apply()
+
+
+def _get_record(params: typing.Mapping[str, typing.Any]) -> jail.JailRecord:
+    if isinstance(params, jail.JailRecord) is True:
+        return typing.cast(jail.JailRecord, params)
+    return jail.JailRecord(int(params["jid"]), params)
+
+
+def _provides(action: Action) -> typing.Set[Resource]:
+    if action.kind == CREATE:
+        return {("parent", action.name)}
+    return set()
+
+
+def _get_readable(
+    specs: typing.Iterable[jail.diff.Changes]
+) -> typing.List[str]:
+    names = {"name"}
+    for params in specs:
+        for name, value in params.items():
+            key = jail.diff.normalize(name, value)[0]
+            if jail.codecs.find_codec(key) is not None:
+                names.add(key)
+    return sorted(names)
+
+
+def _get_addresses(
+    params: typing.Mapping[str, typing.Any],
+    keys: typing.Iterable[str]=("ip4.addr", "ip6.addr")
+) -> typing.Set[Resource]:
+    addresses: typing.Set[Resource] = set()
+    for key in keys:
+        if key not in params:
+            continue
+        value = jail.diff.normalize(key, params[key])[1]
+        addresses.update(("address", x) for x in value)
+    return addresses
+
+
+def _get_levels(
+    actions: typing.List[Action]
+) -> typing.List[typing.List[Action]]:
+    actions = list(actions)
+    while True:
+        levels, cyclic = _get_order(actions)
+        if cyclic is None:
+            break
+        # release the contested addresses first to break the cycle
+        actions.insert(actions.index(cyclic), _split_release(cyclic))
+
+    grouped: typing.List[typing.List[Action]] = [
+        [] for _ in range(max(levels.values(), default=-1) + 1)
+    ]
+    order = (REMOVE, UPDATE, CREATE)
+    for action in sorted(actions, key=lambda x: order.index(x.kind)):
+        grouped[levels[id(action)]].append(action)
+    return grouped
+
+
+def _get_order(
+    actions: typing.List[Action]
+) -> typing.Tuple[typing.Dict[int, int], typing.Optional[Action]]:
+    """Return the level of every action or the provider closing a cycle."""
+    providers: typing.Dict[Resource, Action] = {}
+    for action in actions:
+        for resource in action.releases | _provides(action):
+            providers[resource] = action
+
+    levels: typing.Dict[int, int] = {}
+    for action in actions:
+        stack = [action]
+        visiting = set()
+        while len(stack) > 0:
+            current = stack[-1]
+            if id(current) in levels:
+                stack.pop()
+                continue
+            visiting.add(id(current))
+            dependencies = [
+                providers[x] for x in current.claims
+                if (x in providers) and (providers[x] is not current)
+            ]
+            for dependency in dependencies:
+                if id(dependency) in visiting:
+                    return (levels, dependency)
+            waiting = [x for x in dependencies if id(x) not in levels]
+            if len(waiting) > 0:
+                stack.extend(waiting)
+                continue
+            stack.pop()
+            visiting.discard(id(current))
+            levels[id(current)] = 1 + max(
+                (levels[id(x)] for x in dependencies),
+                default=-1
+            )
+    return (levels, None)
+
+
+def _split_release(action: Action) -> Action:
+    """Move the releases of an update to a new action that runs first."""
+    if (action.kind != UPDATE) or (len(action.releases) == 0):
+        raise ValueError(f"circular dependency of {action!r}")
+    release = Action(UPDATE, action.name, jid=action.jid)
+    for key in ("ip4.addr", "ip6.addr"):
+        if key in action.params:
+            value = jail.diff.normalize(key, action.params[key])[1]
+            release.params[key] = [
+                x for x in value if ("address", x) not in action.claims
+            ]
+    release.releases = action.releases | {("release", action.name)}
+    action.releases = set()
+    action.claims.add(("release", action.name))
+    return release
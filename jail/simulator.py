@@ -0,0 +1,615 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+In-memory jail kernel simulator.
+
+JailSimulator implements jail_set (2), jail_get (2), jail_remove (2) and
+jail_attach (2) on the iovec arrays the library passes to libc. It can be
+installed as the syscall backend with jail.libc.set_backend to exercise
+the library on any host and at any scale.
+
+Values are stored in their native encoding like the kernel stores them.
+Jail ids are allocated in ascending order, names are unique among jails
+that are not dying, and removed jails stay dying for `linger` seconds.
+Names like "parent.child" create child jails within the children.max
+limit of the parent, which stays dying until its children are gone.
+Latency and errors can be injected per operation, and rctl_get_racct (2)
+reports the resource usage set with set_usage.
+"""
+import typing
+import bisect
+import collections
+import ctypes
+import errno
+import struct
+import threading
+import time
+
+import jail
+import jail.codecs
+import jail.libc
+import jail.params
+import jail.racct
+
+JAIL_MAX = 999999
+
+PARAMS = [
+    ("jid", jail.params.CTLTYPE_INT, "I", 4),
+    ("parent", jail.params.CTLTYPE_INT, "I", 4),
+    ("name", jail.params.CTLTYPE_STRING, "A", 256),
+    ("path", jail.params.CTLTYPE_STRING, "A", 1024),
+    ("securelevel", jail.params.CTLTYPE_INT, "I", 4),
+    ("children.max", jail.params.CTLTYPE_INT, "I", 4),
+    ("children.cur", jail.params.CTLTYPE_INT, "I", 4),
+    ("host.hostname", jail.params.CTLTYPE_STRING, "A", 256),
+    ("host.hostid", jail.params.CTLTYPE_ULONG, "LU", 8),
+    ("host", jail.params.CTLTYPE_INT, "E,jailsys", 4),
+    ("ip4", jail.params.CTLTYPE_INT, "E,jailsys", 4),
+    ("ip6", jail.params.CTLTYPE_INT, "E,jailsys", 4),
+    ("vnet", jail.params.CTLTYPE_INT, "E,jailsys", 4),
+    ("ip4.addr", jail.params.CTLTYPE_STRUCT, "S,in_addr", 4 * 255),
+    ("ip6.addr", jail.params.CTLTYPE_STRUCT, "S,in6_addr", 16 * 255),
+    ("persist", jail.params.CTLTYPE_INT, "B", 4),
+    ("dying", jail.params.CTLTYPE_INT, "B", 4),
+    ("allow.raw_sockets", jail.params.CTLTYPE_INT, "B", 4),
+]
+
+READ_ONLY_PARAMS = ("dying", "parent", "children.cur")
+
+Latency = typing.Union[float, typing.Callable[[str], float]]
+
+
+def get_param_table() -> jail.params.ParamTable:
+    """Return parameter metadata that does not depend on the host."""
+    return jail.params.ParamTable(
+        kernel="simulator",
+        jail_max_af_ips=255,
+        params=[jail.params.JailParam(*x) for x in PARAMS],
+        query_missing=False
+    )
+
+
+class SimulatorError(Exception):
+
+    errno: int
+    errmsg: str
+
+    def __init__(self, error: int, errmsg: str="") -> None:
+        self.errno = error
+        self.errmsg = errmsg
+        super().__init__(errmsg)
+
+
+class SimulatedJail:
+    """A jail of the simulator with its native parameter values."""
+
+    jid: int
+    parent: int
+    children: typing.Dict[int, 'SimulatedJail']
+    params: typing.Dict[str, bytes]
+    processes: int
+    dying_until: typing.Optional[float]
+
+    def __init__(self, jid: int, parent: int=0) -> None:
+        self.jid = jid
+        self.parent = parent
+        self.children = {}
+        self.params = {
+            "name": str(jid).encode() + jail.NULL_BYTES,
+            "path": b"/" + jail.NULL_BYTES
+        }
+        self.processes = 0
+        self.dying_until = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.jid} ({self.name})>"
+
+    @property
+    def name(self) -> str:
+        return _decode_string(self.params["name"])
+
+    @property
+    def dying(self) -> bool:
+        return (self.dying_until is not None) is True
+
+    @property
+    def persist(self) -> bool:
+        return self.params.get("persist", bytes(4)) != bytes(4)
+
+    @property
+    def children_count(self) -> int:
+        return sum(x.dying is False for x in self.children.values())
+
+    def read(self, name: str) -> bytes:
+        if name == "jid":
+            return struct.pack("i", self.jid)
+        elif name == "dying":
+            return struct.pack("i", int(self.dying))
+        elif name == "parent":
+            return struct.pack("i", self.parent)
+        elif name == "children.cur":
+            return struct.pack("i", self.children_count)
+        try:
+            return self.params[name]
+        except KeyError:
+            return b""
+
+
+class JailSimulator:
+    """
+    Jail syscalls on simulated kernel state.
+
+    >>> simulator = jail.simulator.install(linger=0.1)
+    >>> jail.create_jail(dict(persist=None, name="www"))
+    1
+    >>> jail.remove_jail(1)
+    >>> jail.is_jid_dying(1)
+    True
+    """
+
+    linger: float
+    latency: Latency
+    calls: typing.Counter[str]
+    jails: typing.Dict[int, SimulatedJail]
+    attached: typing.Optional[int]
+    racct: bool
+    usage: typing.Dict[str, typing.Dict[str, int]]
+    _names: typing.Dict[str, int]
+    _jids: typing.List[int]
+    _dying: typing.Set[int]
+    _last_jid: int
+    _errors: typing.Dict[str, typing.List[SimulatorError]]
+    _lock: threading.Lock
+
+    def __init__(self, linger: float=0, latency: Latency=0) -> None:
+        self.linger = linger
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.jails = {}
+        self.attached = None
+        self.racct = True
+        self.usage = {}
+        self._names = {}
+        self._jids = []
+        self._dying = set()
+        self._last_jid = 0
+        self._errors = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of jails that are not dying."""
+        return len(self._names)
+
+    def inject_error(
+        self,
+        operation: str,
+        error: int,
+        errmsg: str=""
+    ) -> None:
+        """Fail the next call of an operation like jail_set with error."""
+        with self._lock:
+            self._errors[operation].append(SimulatorError(error, errmsg))
+
+    def set_usage(self, name: str, **usage: int) -> None:
+        """Set the racct resource usage of a jail by name."""
+        with self._lock:
+            self.usage.setdefault(name, {}).update(usage)
+
+    def jail_set(self, pointer: typing.Any, niov: int, flags: int) -> int:
+        iovecs = _get_iovecs(pointer, niov)
+        return self.__call("jail_set", iovecs, self.__set, iovecs, flags)
+
+    def jail_get(self, pointer: typing.Any, niov: int, flags: int) -> int:
+        iovecs = _get_iovecs(pointer, niov)
+        return self.__call("jail_get", iovecs, self.__get, iovecs, flags)
+
+    def jail_remove(self, jid: int) -> int:
+        return self.__call("jail_remove", None, self.__remove_jid, jid)
+
+    def jail_attach(self, jid: int) -> int:
+        return self.__call("jail_attach", None, self.__attach, jid)
+
+    def rctl_get_racct(
+        self,
+        rule: bytes,
+        rule_size: typing.Any,
+        output: ctypes.Array,
+        output_size: typing.Any
+    ) -> int:
+        return self.__call(
+            "rctl_get_racct",
+            None,
+            self.__get_racct,
+            bytes(rule),
+            output,
+            int(getattr(output_size, "value", output_size))
+        )
+
+    def __call(
+        self,
+        operation: str,
+        iovecs: typing.Optional[typing.Sequence[jail.Iovec]],
+        func: typing.Callable[..., int],
+        *args: typing.Any
+    ) -> int:
+        latency = self.latency
+        delay = latency(operation) if callable(latency) else latency
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            with self._lock:
+                self.calls[operation] += 1
+                if len(self._errors[operation]) > 0:
+                    raise self._errors[operation].pop(0)
+                self.__reap()
+                return func(*args)
+        except SimulatorError as e:
+            if iovecs is not None:
+                _write_errmsg(iovecs, e.errmsg)
+            ctypes.set_errno(e.errno)
+            return -1
+
+    def __reap(self) -> None:
+        if len(self._dying) == 0:
+            return
+        now = time.monotonic()
+        # parents finish dying after their last child is gone
+        gone = self.__reapable(self._dying, now)
+        while len(gone) > 0:
+            parents = set()
+            for jid in gone:
+                found = self.jails.pop(jid)
+                self._dying.discard(jid)
+                del self._jids[bisect.bisect_left(self._jids, jid)]
+                if found.parent in self.jails:
+                    del self.jails[found.parent].children[jid]
+                    parents.add(found.parent)
+            gone = self.__reapable(parents & self._dying, now)
+
+    def __reapable(
+        self,
+        jids: typing.Iterable[int],
+        now: float
+    ) -> typing.List[int]:
+        reapable = []
+        for jid in jids:
+            found = self.jails[jid]
+            if (found.dying_until is None) or (found.dying_until > now):
+                continue
+            elif len(found.children) == 0:
+                reapable.append(jid)
+        return reapable
+
+    def __set(self, iovecs: typing.Sequence[jail.Iovec], flags: int) -> int:
+        params = self.__decode(iovecs)
+        jid = _decode_int(params.pop("jid", b""))
+        name = _decode_string(params.get("name", b""))
+        existing = self.__find(jid, name)
+        owner = self._names.get(name)
+        if (owner is not None) and (
+            (existing is None) or (owner != existing.jid)
+        ):
+            raise SimulatorError(
+                errno.EEXIST,
+                f"jail \"{name}\" already exists"
+            )
+        self.__check_addresses(params, existing)
+
+        if existing is None:
+            if (flags & jail.JAIL_CREATE) == 0:
+                raise SimulatorError(errno.ENOENT, (
+                    f"jail {jid} not found" if (jid > 0)
+                    else f"jail \"{name}\" not found"
+                ))
+            existing = self.__create(jid, name)
+        elif (flags & jail.JAIL_UPDATE) == 0:
+            raise SimulatorError(errno.EEXIST, (
+                f"jail {jid} already exists" if (jid > 0)
+                else f"jail \"{name}\" already exists"
+            ))
+
+        if name != "":
+            if self._names.get(existing.name) == existing.jid:
+                del self._names[existing.name]
+            self._names[name] = existing.jid
+        existing.params.update(params)
+        if (flags & jail.JAIL_ATTACH) > 0:
+            self.__attach(existing.jid)
+        elif (existing.persist is False) and (existing.processes == 0):
+            # jails without persist or processes are removed right away
+            self.__remove(existing)
+        return existing.jid
+
+    def __get(self, iovecs: typing.Sequence[jail.Iovec], flags: int) -> int:
+        keys = _read_keys(iovecs)
+        found: typing.Optional[SimulatedJail]
+        if "lastjid" in keys:
+            lastjid = _decode_int(_read_value(iovecs, keys["lastjid"]))
+            found = self.__next(lastjid, flags)
+        else:
+            jid = _decode_int(_read_value(iovecs, keys.get("jid")))
+            name = _decode_string(_read_value(iovecs, keys.get("name")))
+            found = self.__find(jid, name, dying=True)
+            if found is None:
+                raise SimulatorError(errno.ENOENT, (
+                    f"jail {jid} not found" if (jid > 0)
+                    else f"jail \"{name}\" not found"
+                ))
+            elif (found.dying is True) and ((flags & jail.JAIL_DYING) == 0):
+                raise SimulatorError(errno.ENOENT, f"jail {jid} is dying")
+
+        for key, index in keys.items():
+            if key in ("lastjid", "errmsg"):
+                continue
+            iovec = iovecs[index]
+            if iovec.iov_base is None:
+                continue
+            self.__check_param(key)
+            negate = key.startswith("no") and (key not in self.__names())
+            value = found.read(key[2:] if negate else key)
+            if negate is True:
+                value = struct.pack("i", int(value == bytes(4)))
+            value = value[:iovec.iov_size]
+            ctypes.memset(iovec.iov_base, 0, iovec.iov_size)
+            ctypes.memmove(iovec.iov_base, value, len(value))
+            if key.endswith(".addr") is True:
+                # the kernel shortens address arrays to the used length
+                iovec.iov_size = len(value)
+        return found.jid
+
+    def __get_racct(
+        self,
+        rule: bytes,
+        output: ctypes.Array,
+        output_size: int
+    ) -> int:
+        if self.racct is False:
+            raise SimulatorError(errno.ENOSYS)
+        subject, _, name = rule.decode().partition(":")
+        if subject != "jail":
+            raise SimulatorError(errno.EINVAL)
+        name = name.rstrip(":")
+        # like the kernel, unknown jail names report no usage
+        usage = dict(self.usage.get(name, {}))
+        found = self.jails.get(self._names.get(name, 0))
+        if found is not None:
+            usage.setdefault("maxproc", found.processes)
+        value = ",".join(
+            f"{x}={usage.get(x, 0)}" for x in jail.racct.RACCT_RESOURCES
+        ).encode() + jail.NULL_BYTES
+        if len(value) > output_size:
+            raise SimulatorError(errno.ERANGE)
+        ctypes.memmove(output, value, len(value))
+        return 0
+
+    def __remove_jid(self, jid: int) -> int:
+        found = self.jails.get(jid)
+        if (found is None) or (found.dying is True):
+            raise SimulatorError(errno.EINVAL)
+        self.__remove(found)
+        return 0
+
+    def __attach(self, jid: int) -> int:
+        found = self.jails.get(jid)
+        if (found is None) or (found.dying is True):
+            raise SimulatorError(errno.EINVAL)
+        found.processes += 1
+        self.attached = jid
+        return 0
+
+    def __create(self, jid: int, name: str) -> SimulatedJail:
+        parent = self.__find_parent(name)
+        if jid == 0:
+            jid = self.__allocate_jid()
+        elif jid in self.jails:
+            raise SimulatorError(errno.EEXIST, f"jail {jid} already exists")
+        created = SimulatedJail(jid, 0 if (parent is None) else parent.jid)
+        if parent is not None:
+            parent.children[jid] = created
+        self.jails[jid] = created
+        self._names[created.name] = jid
+        bisect.insort(self._jids, jid)
+        return created
+
+    def __find_parent(self, name: str) -> typing.Optional[SimulatedJail]:
+        if "." not in name:
+            return None
+        parent_name = name.rsplit(".", 1)[0]
+        parent = self.jails.get(self._names.get(parent_name, 0))
+        if parent is None:
+            raise SimulatorError(
+                errno.ENOENT,
+                f"jail \"{parent_name}\" not found"
+            )
+        children_max = _decode_int(parent.params.get("children.max", b""))
+        if parent.children_count >= children_max:
+            raise SimulatorError(errno.EPERM, "prison limit exceeded")
+        return parent
+
+    def __remove(self, found: SimulatedJail) -> None:
+        # removing a jail removes all its descendants
+        for child in list(found.children.values()):
+            if child.dying is False:
+                self.__remove(child)
+        if self._names.get(found.name) == found.jid:
+            del self._names[found.name]
+        found.processes = 0
+        found.dying_until = time.monotonic() + self.linger
+        self._dying.add(found.jid)
+        self.__reap()
+
+    def __check_addresses(
+        self,
+        params: typing.Dict[str, bytes],
+        existing: typing.Optional[SimulatedJail]
+    ) -> None:
+        for key, size in (("ip4.addr", 4), ("ip6.addr", 16)):
+            if key not in params:
+                continue
+            addresses = _split_addresses(params[key], size)
+            for other in self.jails.values():
+                if (other is existing) or (other.dying is True):
+                    continue
+                used = _split_addresses(other.params.get(key, b""), size)
+                if len(addresses & used) > 0:
+                    raise SimulatorError(
+                        errno.EADDRINUSE,
+                        f"{key} already in use by jail {other.jid}"
+                    )
+
+    def __allocate_jid(self) -> int:
+        jid = self._last_jid
+        for _ in range(JAIL_MAX):
+            jid = (jid % JAIL_MAX) + 1
+            if jid not in self.jails:
+                self._last_jid = jid
+                return jid
+        raise SimulatorError(errno.EAGAIN, "no available jail IDs")
+
+    def __find(
+        self,
+        jid: int,
+        name: str,
+        dying: bool=False
+    ) -> typing.Optional[SimulatedJail]:
+        if jid > 0:
+            found = self.jails.get(jid)
+            if (found is None) or (dying is True) or (found.dying is False):
+                return found
+            return None
+        elif name != "":
+            return self.jails.get(self._names.get(name, 0))
+        return None
+
+    def __next(self, lastjid: int, flags: int) -> SimulatedJail:
+        index = bisect.bisect_right(self._jids, lastjid)
+        for jid in self._jids[index:]:
+            found = self.jails[jid]
+            if (found.dying is False) or ((flags & jail.JAIL_DYING) > 0):
+                return found
+        raise SimulatorError(errno.ENOENT, f"no jail after {lastjid}")
+
+    def __decode(
+        self,
+        iovecs: typing.Sequence[jail.Iovec]
+    ) -> typing.Dict[str, bytes]:
+        params: typing.Dict[str, bytes] = {}
+        for key, index in _read_keys(iovecs).items():
+            if key == "errmsg":
+                continue
+            codec = self.__check_param(key)
+            if key in READ_ONLY_PARAMS:
+                raise SimulatorError(
+                    errno.EINVAL,
+                    f"parameter \"{key}\" is read-only"
+                )
+            value = _read_value(iovecs, index)
+            if isinstance(codec, jail.codecs.BoolCodec) is True:
+                negate = key.startswith("no") and (key not in self.__names())
+                params[key[2:] if negate else key] = struct.pack(
+                    "i",
+                    int(negate is False)
+                )
+            elif len(value) > codec.size:
+                raise SimulatorError(
+                    errno.ENAMETOOLONG,
+                    f"{key} value too long"
+                )
+            else:
+                params[key] = value
+        return params
+
+    def __check_param(self, key: str) -> jail.codecs.Codec:
+        codec = jail.codecs.find_codec(key)
+        if codec is None:
+            raise SimulatorError(errno.ENOENT, f"unknown parameter: {key}")
+        return codec
+
+    def __names(self) -> jail.params.ParamTable:
+        return jail.params.get_table()
+
+
+def _get_iovecs(pointer: typing.Any, niov: int) -> typing.List[jail.Iovec]:
+    array = ctypes.cast(pointer, ctypes.POINTER(jail.Iovec))
+    return [array[i] for i in range(niov)]
+
+
+def _read_keys(iovecs: typing.Sequence[jail.Iovec]) -> typing.Dict[str, int]:
+    return {
+        ctypes.string_at(iovecs[i].iov_base).decode(): i + 1
+        for i in range(0, len(iovecs) - 1, 2)
+    }
+
+
+def _read_value(
+    iovecs: typing.Sequence[jail.Iovec],
+    index: typing.Optional[int]
+) -> bytes:
+    if index is None:
+        return b""
+    iovec = iovecs[index]
+    if iovec.iov_base is None:
+        return b""
+    return ctypes.string_at(iovec.iov_base, iovec.iov_size)
+
+
+def _decode_int(value: bytes) -> int:
+    if len(value) < 4:
+        return 0
+    return int(struct.unpack_from("i", value)[0])
+
+
+def _decode_string(value: bytes) -> str:
+    return value.split(jail.NULL_BYTES, 1)[0].decode()
+
+
+def _split_addresses(value: bytes, size: int) -> typing.Set[bytes]:
+    return set(value[i:i + size] for i in range(0, len(value), size))
+
+
+def _write_errmsg(iovecs: typing.Sequence[jail.Iovec], errmsg: str) -> None:
+    index = _read_keys(iovecs).get("errmsg")
+    if index is None:
+        return
+    iovec = iovecs[index]
+    if (iovec.iov_base is None) or (iovec.iov_size == 0):
+        return
+    message = errmsg.encode()[:iovec.iov_size - 1] + jail.NULL_BYTES
+    ctypes.memmove(iovec.iov_base, message, len(message))
+
+
+def install(**kwargs: typing.Any) -> JailSimulator:
+    """
+    Route the jail syscalls to a new JailSimulator.
+
+    Hosts without the security.jail.param sysctls use the metadata of
+    PARAMS, so the simulator runs anywhere.
+    """
+    import sys
+    if sys.platform.startswith("freebsd") is False:
+        jail.params.set_table(get_param_table())
+        jail.codecs._codecs.clear()
+    simulator = JailSimulator(**kwargs)
+    jail.libc.set_backend(simulator)
+    return simulator
@@ -0,0 +1,143 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tear down trees of nested jails.
+
+A jail with children.max above zero may contain child jails, and a parent
+does not finish dying before its children are gone. The parent of every
+jail is discovered with one enumeration. The jails are then removed by
+height: all leaves in parallel first, and each following level as soon
+as the previous one has fully gone away, so the time of a teardown grows
+with the depth of the tree and not with its size.
+"""
+import typing
+import concurrent.futures
+import time
+
+import jail
+import jail.batch
+
+JailTree = typing.Dict[int, typing.List[int]]
+
+
+def get_tree(dying: bool=True) -> typing.Tuple[JailTree, typing.Set[int]]:
+    """
+    Return the children of all jails and the jids of dying jails.
+
+    Top level jails are the children of jid 0, the host.
+    """
+    tree: JailTree = {}
+    dying_jids = set()
+    for record in jail.iterate_jails(("parent", "dying"), dying=dying):
+        tree.setdefault(record.get_int("parent"), []).append(record.jid)
+        if record["dying"] is True:
+            dying_jids.add(record.jid)
+    return tree, dying_jids
+
+
+def get_levels(
+    jids: typing.Iterable[int],
+    tree: JailTree
+) -> typing.List[typing.List[int]]:
+    """Group the jails and all their descendants by height, leaves first."""
+    heights: typing.Dict[int, int] = {}
+    for root in jids:
+        stack = [(root, False)]
+        while len(stack) > 0:
+            jid, visited = stack.pop()
+            if jid in heights:
+                continue
+            children = tree.get(jid, [])
+            if visited is True:
+                heights[jid] = 1 + max(
+                    (heights[x] for x in children),
+                    default=-1
+                )
+            else:
+                stack.append((jid, True))
+                stack.extend((x, False) for x in children)
+    levels: typing.List[typing.List[int]] = [
+        [] for _ in range(max(heights.values(), default=-1) + 1)
+    ]
+    for jid, height in sorted(heights.items()):
+        levels[height].append(jid)
+    return levels
+
+
+def remove_tree(
+    jids: typing.Iterable[int],
+    max_workers: int=jail.batch.DEFAULT_MAX_WORKERS,
+    timeout: typing.Optional[float]=None,
+    executor: typing.Optional[concurrent.futures.Executor]=None
+) -> typing.List[jail.batch.BatchResult]:
+    """
+    Remove jails with all their descendants, leaves first.
+
+    Up to max_workers jails of a level are removed at once. Jails that are
+    already dying are waited for but not removed again. When a jail cannot
+    be removed its ancestors are skipped with ECANCELED. The results are
+    returned in the order of removal. TimeoutError is raised when a level
+    has not gone away before timeout seconds passed in total.
+    """
+    tree, dying_jids = get_tree()
+    levels = get_levels(jids, tree)
+    deadline = None if (timeout is None) else (time.monotonic() + timeout)
+    results: typing.Dict[int, jail.batch.BatchResult] = {}
+    failed: typing.Set[int] = set()
+
+    pool = executor
+    if pool is None:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="jail-tree"
+        )
+    try:
+        for level in levels:
+            pending = []
+            for jid in level:
+                if any((x in failed) for x in tree.get(jid, [])):
+                    results[jid] = jail.batch.BatchResult(
+                        jid,
+                        error=concurrent.futures.CancelledError()
+                    )
+                    failed.add(jid)
+                elif jid in dying_jids:
+                    results[jid] = jail.batch.BatchResult(jid, jid=jid)
+                else:
+                    pending.append(jid)
+            for result in jail.batch.remove_jails(pending, executor=pool):
+                results[result.item] = result
+                if result.ok is False:
+                    failed.add(result.item)
+
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            waiting = [x for x in level if x not in failed]
+            for _ in jail.wait_removed(waiting, timeout=remaining):
+                pass
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return [results[jid] for level in levels for jid in level]
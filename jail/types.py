@@ -25,7 +25,6 @@
 import typing
 import ctypes
 import ipaddress
-import struct
 
 MAX_INT = 2 ** (8 * ctypes.sizeof(ctypes.c_int)) // 2 - 1
 MIN_INT = - 2 ** (8 * ctypes.sizeof(ctypes.c_int)) // 2
@@ -52,7 +51,23 @@ class in6_addr(ctypes.Structure):
 
 
 def in6_addr_U_from_ip(ip6_address: ipaddress.IPv6Address) -> in6_addr_U:
-	return in6_addr_U(struct.unpack(
-		"B"*16,
-		bytes.fromhex(ip6_address.exploded.replace(":",""))
-	))
+    return in6_addr_U.from_buffer_copy(ip6_address.packed)
+
+
+def pack_addresses(
+    addresses: typing.Iterable[
+        typing.Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+    ]
+) -> bytes:
+    """Concatenate addresses in network byte order."""
+    return b"".join([x.packed for x in addresses])
+
+
+def address_array(
+    buffer: typing.Union[bytearray, ctypes.Array],
+    version: int
+) -> ctypes.Array:
+    """Return an in_addr or in6_addr array sharing the memory of buffer."""
+    list_type = in_addr if (version == 4) else in6_addr
+    count = len(buffer) // ctypes.sizeof(list_type)
+    return (list_type * count).from_buffer(buffer)
@@ -28,7 +28,7 @@ setup(
 	url="https://github.com/gronke/py-jail",
 	author="Stefan Grönke",
 	author_email="stefan@gronke.net",
-	python_requires=">=3.6",
+	python_requires=">=3.7",
 	install_requires=[
 		"freebsd-sysctl==0.0.7"
 	],
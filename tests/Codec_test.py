@@ -0,0 +1,128 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ctypes
+import ipaddress
+
+import jail
+import jail.codecs
+
+
+def _iovec_bytes(iovec: jail.Iovec) -> bytes:
+    if iovec.iov_base is None:
+        return b""
+    return ctypes.string_at(iovec.iov_base, iovec.iov_size)
+
+
+def test_codecs_are_resolved_once():
+    codec = jail.codecs.get_codec("path")
+    assert isinstance(codec, jail.codecs.StringCodec)
+    assert jail.codecs.get_codec("path") is codec
+    assert jail.codecs.find_codec("lastjid") is None
+    with pytest.raises(KeyError):
+        jail.codecs.get_codec("lastjid")
+
+
+def test_integer_codec():
+    codec = jail.codecs.get_codec("jid")
+    assert codec.encode(23) == bytes(ctypes.c_int(23))
+    assert codec.decode(bytes(ctypes.c_int(-23))) == -23
+    with pytest.raises(OverflowError):
+        codec.encode(2 ** 31)
+
+    codec = jail.codecs.get_codec("host.hostid")
+    assert codec.encode(2 ** 63) == bytes(ctypes.c_ulong(2 ** 63))
+
+
+def test_string_codec():
+    codec = jail.codecs.get_codec("host.hostname")
+    assert codec.encode("jail.example.com") == b"jail.example.com\x00"
+    assert codec.encode(b"terminated\x00") == b"terminated\x00"
+    assert codec.decode(b"/rescue\x00\x00garbage") == "/rescue"
+    with pytest.raises(ValueError):
+        codec.encode("x" * 256)
+
+
+def test_jailsys_codec():
+    codec = jail.codecs.get_codec("host")
+    assert codec.encode("new") == bytes(ctypes.c_int(jail.codecs.JAIL_SYS_NEW))
+    assert codec.encode(b"inherit") == bytes(ctypes.c_int(2))
+    assert codec.decode(bytes(ctypes.c_int(0))) == "disable"
+    with pytest.raises(ValueError):
+        codec.encode("shared")
+
+
+def test_bool_codecs():
+    codec = jail.codecs.get_codec("persist")
+    assert codec.encode(True) is None
+    assert codec.encode_key(b"persist\x00", None) == b"persist\x00"
+    assert codec.encode_key(b"persist\x00", False) == b"nopersist\x00"
+    assert codec.decode(bytes(ctypes.c_int(1))) is True
+
+    codec = jail.codecs.get_codec("nopersist")
+    assert isinstance(codec, jail.codecs.NoBoolCodec)
+    assert codec.name == "nopersist"
+    assert codec.encode_key(b"nopersist\x00", True) == b"nopersist\x00"
+    assert codec.encode_key(b"nopersist\x00", False) == b"persist\x00"
+
+
+def test_address_codecs():
+    codec = jail.codecs.get_codec("ip4.addr")
+    addresses = [
+        ipaddress.IPv4Address("192.0.2.1"),
+        ipaddress.IPv4Address("192.0.2.2")
+    ]
+    data = b"".join(x.packed for x in addresses)
+    assert codec.encode(addresses) == data
+    assert codec.encode(["192.0.2.1", "192.0.2.2"]) == data
+    assert codec.decode(data) == addresses
+    assert codec.encode([]) is None
+    with pytest.raises(TypeError):
+        codec.encode([ipaddress.IPv6Address("2001:db8::1")])
+
+    codec = jail.codecs.get_codec("ip6.addr")
+    address = ipaddress.IPv6Address("2001:db8::1")
+    assert codec.encode(address) == address.packed
+    assert codec.decode(address.packed) == [address]
+
+
+def test_jiov_encodes_with_codecs():
+    jiov = jail.Jiov({
+        "persist": False,
+        "host": "inherit",
+        "ip4.addr": ipaddress.IPv4Address("192.0.2.1")
+    })
+    iovecs = jiov.struct
+    assert _iovec_bytes(iovecs[0]) == b"nopersist\x00"
+    assert _iovec_bytes(iovecs[1]) == b""
+    assert _iovec_bytes(iovecs[3]) == bytes(ctypes.c_int(2))
+    assert _iovec_bytes(iovecs[5]) == bytes([192, 0, 2, 1])
+
+
+def test_template_renames_bool_slots():
+    template = jail.JiovTemplate(dict(path="/rescue"), slots=("persist",))
+    template["persist"] = None
+    assert _iovec_bytes(template.struct[2]) == b"persist\x00"
+    template["persist"] = False
+    assert _iovec_bytes(template.struct[2]) == b"nopersist\x00"
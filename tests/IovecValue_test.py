@@ -23,6 +23,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 import pytest
 import ipaddress
+import ctypes
 
 import jail
 
@@ -55,4 +56,80 @@ def test_IovecValue_can_be_list_of_ips():
     test_value = [ipaddress.IPv4Address("192.168.23.10")]
     iovec_value = jail.IovecValue(test_value)
     assert len(iovec_value.raw_value) == 1
-    assert isinstance(iovec_value.raw_value[0], ipaddress.IPv4Address)
\ No newline at end of file
+    assert isinstance(iovec_value.raw_value[0], ipaddress.IPv4Address)
+
+def test_IovecValue_can_be_output_buffer():
+
+    iovec_value = jail.IovecValue.output(64)
+    assert iovec_value.is_output is True
+    assert len(iovec_value) == 64
+    assert iovec_value.native == bytes(64)
+
+    iovec_value.value = "input"
+    assert iovec_value.is_output is False
+    assert iovec_value.native == b"input\x00"
+
+
+def test_IovecValue_packs_ip_lists_once():
+
+    test_value = [
+        ipaddress.IPv6Address("2001:db8::1"),
+        ipaddress.IPv6Address("2001:db8::2")
+    ]
+    iovec_value = jail.IovecValue(test_value)
+    array = iovec_value.value
+    assert iovec_value.value is array
+    assert bytes(array) == test_value[0].packed + test_value[1].packed
+    assert iovec_value.native is iovec_value.native
+    assert iovec_value.iovec.iov_base == ctypes.addressof(array)
+
+    iovec_value.value = [ipaddress.IPv4Address("192.0.2.1")]
+    assert bytes(iovec_value.value) == bytes([192, 0, 2, 1])
+
+
+def test_IovecValue_encodes_once():
+
+    iovec_value = jail.IovecValue("/rescue")
+    native = iovec_value.native
+    iovec = iovec_value.iovec
+    assert native == b"/rescue\x00"
+    assert iovec_value.native is native
+    assert iovec_value.iovec is iovec
+    assert ctypes.string_at(iovec.iov_base, iovec.iov_size) == native
+
+    iovec_value.value = 23
+    assert iovec_value.native == bytes(ctypes.c_int(23))
+    assert iovec_value.iovec is not iovec
+    assert iovec_value.iovec.iov_size == ctypes.sizeof(ctypes.c_int)
+
+
+def test_IovecKey_encodes_once():
+
+    iovec_key = jail.IovecKey("path")
+    native = iovec_key.native
+    assert native == b"path\x00"
+    assert iovec_key.native is native
+    assert iovec_key.iovec is iovec_key.iovec
+
+    with pytest.raises(AttributeError):
+        iovec_key.value = b"name"
+
+
+def test_IovecKey_intern():
+
+    iovec_key = jail.IovecKey.intern("path")
+    assert jail.IovecKey.intern("path") is iovec_key
+    assert jail.IovecKey.intern(b"path") is iovec_key
+    assert jail.IovecKey.intern(iovec_key) is iovec_key
+    assert iovec_key == jail.IovecKey("path")
+    with pytest.raises(KeyError):
+        jail.IovecKey.intern(23)
+
+
+def test_IovecValue_slots():
+
+    iovec_value = jail.IovecValue(b"/rescue")
+    with pytest.raises(AttributeError):
+        iovec_value.unknown = True
+    assert hasattr(iovec_value, "__dict__") is False
+    assert hasattr(jail.IovecKey("path"), "__dict__") is False
@@ -0,0 +1,82 @@
+# Copyright (c) 2019, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ipaddress
+
+import jail
+import jail.params
+
+
+def _table(kernel: str) -> jail.params.ParamTable:
+    return jail.params.ParamTable(
+        kernel=kernel,
+        jail_max_af_ips=255,
+        params=[
+            jail.params.JailParam("jid", jail.params.CTLTYPE_INT, "I", 4),
+            jail.params.JailParam(
+                "path", jail.params.CTLTYPE_STRING, "A", 1024
+            ),
+            jail.params.JailParam(
+                "ip4.addr", jail.params.CTLTYPE_STRUCT, "S,in_addr", 4 * 255
+            )
+        ]
+    )
+
+
+def _fail_walk(kernel: str) -> jail.params.ParamTable:
+    raise AssertionError("sysctl tree walked")
+
+
+def test_param_table_is_loaded_from_disk(tmp_path, monkeypatch):
+    kernel = jail.params.get_kernel_id()
+    path = str(tmp_path / "params.json")
+    jail.params.write_table(_table(kernel), path)
+
+    monkeypatch.setattr(jail.params, "walk_table", _fail_walk)
+    table = jail.params.load_table(path)
+    assert table.kernel == kernel
+    assert table.jail_max_af_ips == 255
+    assert sorted(table.keys()) == ["ip4.addr", "jid", "path"]
+    assert table["path"].is_string is True
+    assert table["path"].size == 1024
+    assert table["ip4.addr"].address_type is ipaddress.IPv4Address
+
+
+def test_param_table_is_invalidated_by_kernel_upgrade(tmp_path, monkeypatch):
+    kernel = jail.params.get_kernel_id()
+    path = str(tmp_path / "params.json")
+    jail.params.write_table(_table("FreeBSD 12.1-RELEASE"), path)
+
+    monkeypatch.setattr(jail.params, "walk_table", _table)
+    assert jail.params.load_table(path).kernel == kernel
+
+    monkeypatch.setattr(jail.params, "walk_table", _fail_walk)
+    assert jail.params.load_table(path).kernel == kernel
+
+
+def test_param_cache_path_depends_on_kernel(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    path = jail.params.get_cache_path("FreeBSD 12.1-RELEASE")
+    assert path.startswith(str(tmp_path / "py-jail"))
+    assert path != jail.params.get_cache_path("FreeBSD 12.2-RELEASE")
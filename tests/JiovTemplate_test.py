@@ -0,0 +1,89 @@
+# Copyright (c) 2019, Stefan Grönke
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ctypes
+
+import jail
+
+
+def _iovec_bytes(iovec: jail.Iovec) -> bytes:
+    return ctypes.string_at(iovec.iov_base, iovec.iov_size)
+
+
+def test_template_requires_all_slots():
+    template = jail.JiovTemplate(
+        dict(persist=None, path="/rescue"),
+        slots=("name", "jid")
+    )
+    template["name"] = "www"
+    with pytest.raises(ValueError):
+        template.pointer
+    template["jid"] = 23
+    assert len(template) == len(template.struct) == 10
+
+
+def test_template_patches_slots_in_place():
+    template = jail.JiovTemplate(
+        dict(persist=None, path="/rescue"),
+        slots=("name",)
+    )
+    template.fill(dict(name="first"))
+    pointer = template.pointer
+    buffer = template._buffer
+
+    template["name"] = "second"
+    assert template.pointer is pointer
+    assert template._buffer is buffer
+
+    iovecs = template.struct
+    assert _iovec_bytes(iovecs[4]) == b"name\x00"
+    assert _iovec_bytes(iovecs[5]) == b"second\x00"
+    assert str(template["name"]) == "second"
+
+
+def test_template_recompiles_on_shared_change():
+    template = jail.JiovTemplate(
+        dict(persist=None, path="/rescue"),
+        slots=("name",)
+    )
+    template["name"] = "www"
+    pointer = template.pointer
+    template["path"] = "/tmp"
+    assert template.pointer is not pointer
+    assert _iovec_bytes(template.struct[3]) == b"/tmp\x00"
+    assert _iovec_bytes(template.struct[5]) == b"www\x00"
+
+    template["name"] = "mail"
+    assert _iovec_bytes(template.struct[5]) == b"mail\x00"
+
+
+def test_template_reuses_slot_memory():
+    template = jail.JiovTemplate(dict(persist=None), slots=("jid", "name"))
+    template.fill(dict(jid=1, name="long-jail-name"))
+    address = template.struct[3].iov_base
+
+    template.fill(dict(jid=2, name="short"))
+    assert template.struct[3].iov_base == address
+    assert ctypes.c_int.from_address(address).value == 2
+    assert _iovec_bytes(template.struct[5]) == b"short\x00"
@@ -25,8 +25,10 @@ import os.path
 import pytest
 import subprocess
 import sys
+import ctypes
 
 import jail
+import jail.codecs
 
 
 def test_jiov_length():
@@ -43,3 +45,96 @@ def test_jiov_length():
     struct_length = (len(data) + 1) * 2  # (data + errmsg) key/value pairs
     assert len(jiov.struct) == struct_length
     assert len(jiov) == struct_length
+
+
+def test_jiov_compiles_into_one_buffer():
+    jiov = jail.Jiov(dict(persist=None, path="/rescue", jid=23))
+    iovecs = jiov.struct
+
+    assert ctypes.string_at(iovecs[0].iov_base, iovecs[0].iov_size) == (
+        b"persist\x00"
+    )
+    assert iovecs[1].iov_base is None
+    assert iovecs[1].iov_size == 0
+    assert ctypes.string_at(iovecs[3].iov_base, iovecs[3].iov_size) == (
+        b"/rescue\x00"
+    )
+    assert ctypes.c_int.from_address(iovecs[5].iov_base).value == 23
+    assert ctypes.string_at(iovecs[6].iov_base, iovecs[6].iov_size) == (
+        b"errmsg\x00"
+    )
+    assert iovecs[7].iov_base == ctypes.addressof(jiov.errmsg)
+
+
+def test_jiov_reuses_compiled_buffer():
+    jiov = jail.Jiov(dict(persist=None, path="/rescue"))
+    pointer = jiov.pointer
+    assert jiov.pointer is pointer
+    assert jiov.struct is jiov.struct
+    assert ctypes.addressof(pointer.contents) == (
+        ctypes.addressof(jiov.struct)
+    )
+
+
+def test_jiov_restores_iovec_lengths():
+    jiov = jail.Jiov(dict(path="/rescue"))
+    jiov.struct[1].iov_size = 2
+    jiov.errmsg.value = b"jail 23 already exists"
+    assert jiov.struct[1].iov_size == len(b"/rescue\x00")
+    assert jiov.errmsg.value == b""
+
+
+def test_jiov_recompiles_after_change():
+    jiov = jail.Jiov(dict(persist=None, path="/rescue"))
+    pointer = jiov.pointer
+    jiov["path"] = "/tmp"
+    assert jiov.pointer is not pointer
+    iovecs = jiov.struct
+    assert ctypes.string_at(iovecs[3].iov_base, iovecs[3].iov_size) == (
+        b"/tmp\x00"
+    )
+
+    del jiov["persist"]
+    assert len(jiov) == len(jiov.struct) == 4
+
+
+def test_jiov_reads_output_buffers():
+    jiov = jail.Jiov({"jid": 23, "path": jail.IovecValue.output(1024)})
+    iovecs = jiov.struct
+
+    # mimic the kernel filling the output buffer during jail_get
+    ctypes.memmove(iovecs[3].iov_base, b"/rescue\x00", 8)
+    iovecs[3].iov_size = 8
+    assert jiov.read("path") == b"/rescue\x00"
+
+    jiov.compile()
+    assert len(jiov.read("path")) == 1024
+
+
+def test_jiov_reuses_encoded_values(monkeypatch):
+    calls = []
+    codec = jail.codecs.get_codec("path")
+    encode = codec.encode
+
+    def counting_encode(value):
+        calls.append(value)
+        return encode(value)
+
+    monkeypatch.setattr(codec, "encode", counting_encode)
+    path = jail.IovecValue("/rescue", codec=codec)
+    for _ in range(3):
+        jiov = jail.Jiov(dict(persist=None, path=path))
+        jiov.compile()
+        assert jiov.read("path") == b"/rescue\x00"
+    assert len(calls) == 1
+
+
+def test_jiov_shares_interned_keys():
+    first = jail.Jiov(dict(persist=None, path="/rescue"))
+    second = jail.JiovData({b"path": "/", "persist": None})
+
+    assert [str(x) for x in first.keys()] == ["persist", "path"]
+    for key, value in first.items():
+        assert isinstance(value, jail.IovecValue) is True
+        assert second.keys() & {key} == {key}
+    assert list(first.keys())[1] is list(second.keys())[0]
@@ -0,0 +1,116 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import asyncio
+import concurrent.futures
+import errno
+import time
+
+import jail
+import jail.aio
+import jail.simulator
+
+
+@pytest.fixture
+def simulator(
+    simulator: jail.simulator.JailSimulator
+) -> jail.simulator.JailSimulator:
+    simulator.latency = 0.01
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    jail.aio.set_executor(executor)
+    yield simulator
+    jail.aio.set_executor(None)
+    executor.shutdown()
+
+
+def test_aio_create_and_remove(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+
+    async def run() -> None:
+        jid = await jail.aio.create(dict(name="www", persist=None))
+        assert simulator.jails[jid].name == "www"
+        assert await jail.aio.get(jid, ("persist",)) == dict(
+            jid=jid,
+            persist=True
+        )
+        await jail.aio.remove(jid)
+        assert len(simulator) == 0
+
+    asyncio.run(run())
+
+
+def test_aio_captures_errors_per_call(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+
+    async def run() -> list:
+        return await asyncio.gather(
+            jail.aio.create(dict(name="www", persist=None)),
+            jail.aio.create(dict(name="www", persist=None)),
+            jail.aio.remove(23),
+            return_exceptions=True
+        )
+
+    *created, missing = asyncio.run(run())
+    created.sort(key=lambda x: isinstance(x, Exception))
+    assert created[0] == 1
+    duplicate = created[1]
+    assert isinstance(duplicate, FileExistsError) is True
+    assert duplicate.strerror == "jail \"www\" already exists"
+    assert missing.errno == errno.EINVAL
+
+
+def test_aio_does_not_block_the_event_loop(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    ticks = []
+
+    async def tick() -> None:
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.001)
+
+    async def run() -> list:
+        ticker = asyncio.ensure_future(tick())
+        jids = await asyncio.gather(*(
+            jail.aio.create(dict(name=f"jail{i}", persist=None))
+            for i in range(100)
+        ))
+        ticker.cancel()
+        return jids
+
+    jids = asyncio.run(run())
+    assert sorted(jids) == list(range(1, 101))
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+
+
+def test_aio_timeout(simulator: jail.simulator.JailSimulator) -> None:
+    simulator.latency = 0.2
+
+    async def run() -> None:
+        await jail.aio.create(dict(name="www"), timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
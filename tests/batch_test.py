@@ -0,0 +1,107 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import concurrent.futures
+import errno
+import threading
+
+import jail
+import jail.batch
+import jail.codecs
+import jail.simulator
+
+
+def test_create_jails_collects_results_in_order(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    params = [dict(name=f"jail{i}", persist=None) for i in range(100)]
+    params[50] = dict(name="jail10", persist=None)
+    results = jail.batch.create_jails(params, max_workers=8)
+
+    assert len(results) == 100
+    assert [x.item for x in results] == params
+    failed = [x for x in results if x.ok is False]
+    assert len(failed) == 1
+    assert failed[0].errno == errno.EEXIST
+    assert failed[0].errmsg == "jail \"jail10\" already exists"
+    assert len(set(x.jid for x in results if x.ok is True)) == 99
+    assert len(simulator) == 99
+
+
+def test_update_and_remove_jails(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    created = jail.batch.create_jails([
+        dict(name="a", persist=None),
+        dict(name="b", persist=None)
+    ])
+    jids = [x.jid for x in created]
+
+    results = jail.batch.update_jails([
+        {"name": "a", "host.hostname": "a.example.com"},
+        dict(name="c")
+    ])
+    assert results[0].jid == jids[0]
+    assert results[1].errno == errno.ENOENT
+    assert jail.get_jail(jids[0], ("host.hostname",)) == {
+        "jid": jids[0],
+        "host.hostname": "a.example.com"
+    }
+
+    results = jail.batch.remove_jails(jids + [jids[0]])
+    assert [x.jid for x in results[:2]] == jids
+    assert results[2].errno == errno.EINVAL
+    assert len(simulator) == 0
+
+
+def test_batch_reports_marshalling_errors(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    results = jail.batch.create_jails([dict(name="a", jid="x" * 8)])
+    assert results[0].ok is False
+    assert results[0].errno == errno.EINVAL
+    assert results[0].error is not None
+
+
+def test_batch_fail_fast(simulator: jail.simulator.JailSimulator) -> None:
+    simulator.latency = 0.01
+    params = [dict(name="dup", persist=None)] * 50
+    results = jail.batch.create_jails(params, max_workers=2, fail_fast=True)
+
+    assert sum(1 for x in results if x.errno == errno.EEXIST) > 0
+    assert sum(1 for x in results if x.errno == errno.ECANCELED) > 0
+    assert sum(1 for x in results if x.ok is True) == 1
+
+
+def test_concurrent_codec_lookup_is_shared() -> None:
+    jail.codecs._codecs.clear()
+    barrier = threading.Barrier(8)
+
+    def lookup(_: int) -> jail.codecs.Codec:
+        barrier.wait()
+        return jail.codecs.get_codec("host.hostname")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        codecs = list(executor.map(lookup, range(8)))
+    assert all(x is codecs[0] for x in codecs)
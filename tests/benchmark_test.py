@@ -0,0 +1,276 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ipaddress
+import tracemalloc
+
+import jail
+import jail.codecs
+import jail.ippool
+import jail.libc
+import jail.metrics
+import jail.racct
+import jail.simulator
+import jail.types
+
+ADDRESS_COUNTS = [1, 16, 255]  # up to JAIL_MAX_AF_IPS of the simulator
+
+
+def _ipv4_addresses(count: int) -> list:
+    network = ipaddress.IPv4Network("10.0.0.0/16")
+    return [network[i + 1] for i in range(count)]
+
+
+def _ipv6_addresses(count: int) -> list:
+    network = ipaddress.IPv6Network("2001:db8::/64")
+    return [network[i + 1] for i in range(count)]
+
+
+def _jail_spec(index: int) -> dict:
+    return {
+        "name": f"jail{index}",
+        "path": f"/jails/jail{index}",
+        "persist": None,
+        "host.hostname": f"jail{index}.example.com",
+        "ip4.addr": [ipaddress.IPv4Address("10.0.0.0") + index],
+        "securelevel": 2,
+        "children.max": 0
+    }
+
+
+@pytest.mark.benchmark(group="encoding")
+@pytest.mark.parametrize("count", ADDRESS_COUNTS)
+def test_benchmark_ipv4_list_encoding(benchmark, count: int) -> None:
+    addresses = _ipv4_addresses(count)
+    codec = jail.codecs.get_codec("ip4.addr")
+    packed = benchmark(codec.encode, addresses)
+    assert len(packed) == 4 * count
+
+
+@pytest.mark.benchmark(group="encoding")
+@pytest.mark.parametrize("count", ADDRESS_COUNTS)
+def test_benchmark_ipv6_list_encoding(benchmark, count: int) -> None:
+    addresses = _ipv6_addresses(count)
+    codec = jail.codecs.get_codec("ip6.addr")
+    packed = benchmark(codec.encode, addresses)
+    assert len(packed) == 16 * count
+
+
+@pytest.mark.benchmark(group="encoding")
+@pytest.mark.parametrize("count", ADDRESS_COUNTS)
+def test_benchmark_ipv6_legacy_array(benchmark, count: int) -> None:
+    addresses = _ipv6_addresses(count)
+
+    def encode() -> int:
+        value = jail.IovecValue(addresses)
+        return len(value.value) + len(value) + len(value.native)
+
+    benchmark(encode)
+
+
+@pytest.mark.benchmark(group="encoding")
+def test_benchmark_in6_addr_U_from_ip(benchmark) -> None:
+    address = ipaddress.IPv6Address("2001:db8::1")
+    benchmark(jail.types.in6_addr_U_from_ip, address)
+
+
+VALUES = {
+    "securelevel": 2,
+    "host.hostname": "jail.example.com",
+    "ip4.addr": _ipv4_addresses(4),
+    "ip6.addr": _ipv6_addresses(4)
+}
+
+
+@pytest.mark.benchmark(group="encoding")
+@pytest.mark.parametrize("name", VALUES.keys())
+def test_benchmark_iovec_value_encoding(benchmark, name: str) -> None:
+    value = VALUES[name]
+    codec = jail.codecs.get_codec(name)
+
+    def encode() -> bytes:
+        return jail.IovecValue(value, codec=codec).native
+
+    assert len(benchmark(encode)) > 0
+
+
+@pytest.mark.benchmark(group="jiov")
+def test_benchmark_jiov_construction(benchmark) -> None:
+    spec = _jail_spec(23)
+    jiov = benchmark(jail.Jiov, spec)
+    assert len(jiov) == (len(spec) + 1) * 2
+
+
+@pytest.mark.benchmark(group="jiov")
+def test_benchmark_jiov_first_compile(benchmark) -> None:
+    spec = _jail_spec(23)
+
+    def build() -> int:
+        return len(jail.Jiov(spec).struct)
+
+    assert benchmark(build) == (len(spec) + 1) * 2
+
+
+@pytest.mark.benchmark(group="jiov")
+def test_benchmark_jiov_struct(benchmark) -> None:
+    jiov = jail.Jiov(_jail_spec(23))
+    jiov.struct
+    benchmark(lambda: jiov.struct)
+
+
+@pytest.mark.benchmark(group="jiov")
+def test_benchmark_jiov_pointer(benchmark) -> None:
+    jiov = jail.Jiov(_jail_spec(23))
+    jiov.pointer
+    benchmark(lambda: jiov.pointer)
+
+
+@pytest.mark.benchmark(group="jiov")
+def test_benchmark_jiov_data_iteration(benchmark) -> None:
+    data = jail.JiovData(_jail_spec(23))
+
+    def iterate() -> int:
+        return sum(len(key) for key, value in data.items())
+
+    assert benchmark(iterate) > 0
+
+
+@pytest.mark.benchmark(group="syscall")
+def test_benchmark_set_jail(
+    benchmark,
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    spec = _jail_spec(23)
+    flags = jail.JAIL_CREATE | jail.JAIL_UPDATE
+    assert benchmark(jail.set_jail, spec, flags) == 1
+
+
+@pytest.mark.benchmark(group="syscall")
+def test_benchmark_template_set_jail(
+    benchmark,
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    spec = _jail_spec(23)
+    template = jail.JiovTemplate(spec, slots=("name",))
+    flags = jail.JAIL_CREATE | jail.JAIL_UPDATE
+
+    def set_jail() -> int:
+        template["name"] = "jail23"
+        return simulator.jail_set(template.pointer, len(template), flags)
+
+    assert benchmark(set_jail) == 1
+
+
+@pytest.mark.benchmark(group="instrumentation")
+@pytest.mark.parametrize("enabled", [False, True])
+def test_benchmark_instrumentation(
+    benchmark,
+    simulator: jail.simulator.JailSimulator,
+    enabled: bool
+) -> None:
+    spec = _jail_spec(23)
+    flags = jail.JAIL_CREATE | jail.JAIL_UPDATE
+    if enabled is True:
+        jail.metrics.enable()
+    try:
+        assert benchmark(jail.set_jail, spec, flags) == 1
+    finally:
+        jail.metrics.disable()
+
+
+FLEET_SIZE = 10000
+
+
+@pytest.fixture(scope="module")
+def fleet() -> jail.simulator.JailSimulator:
+    """A simulator with FLEET_SIZE persistent jails."""
+    simulator = jail.simulator.JailSimulator()
+    jail.libc.set_backend(simulator)
+    template = jail.JiovTemplate(
+        dict(persist=None, path="/rescue"),
+        slots=("name",)
+    )
+    for i in range(FLEET_SIZE):
+        template["name"] = f"jail{i}"
+        simulator.jail_set(template.pointer, len(template), jail.JAIL_CREATE)
+    yield simulator
+    jail.libc.set_backend(None)
+
+
+@pytest.mark.benchmark(group="fleet")
+def test_benchmark_iterate_fleet(
+    benchmark,
+    fleet: jail.simulator.JailSimulator
+) -> None:
+
+    def iterate() -> int:
+        return sum(1 for _ in jail.iterate_jails(("name", "path")))
+
+    assert benchmark.pedantic(iterate, rounds=3) == FLEET_SIZE
+
+
+@pytest.mark.benchmark(group="fleet")
+def test_benchmark_racct_fleet(
+    benchmark,
+    fleet: jail.simulator.JailSimulator
+) -> None:
+    sampler = jail.racct.RacctSampler()
+    assert benchmark.pedantic(sampler.sample, rounds=3) == FLEET_SIZE
+    assert len(sampler.series["jail0"]) > 0
+
+
+@pytest.mark.benchmark(group="ippool")
+def test_benchmark_address_pool(benchmark) -> None:
+    """Allocate and release on a /16 that holds 50000 leases."""
+    pool = jail.ippool.AddressPool("10.0.0.0/16")
+    for _ in range(50000):
+        pool.allocate()
+    pool.release(ipaddress.IPv4Address("10.0.23.42"))
+
+    def cycle() -> None:
+        pool.release(pool.allocate())
+
+    benchmark(cycle)
+    assert pool.used == 50001
+
+
+@pytest.mark.benchmark(group="memory")
+def test_benchmark_jiov_data_memory(benchmark) -> None:
+    count = 1000
+    specs = [_jail_spec(i) for i in range(count)]
+    jail.JiovData(specs[0])
+
+    def measure() -> int:
+        tracemalloc.start()
+        try:
+            data = [jail.JiovData(x) for x in specs]
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(data) == count
+        return size // count
+
+    per_spec = benchmark.pedantic(measure, rounds=3)
+    benchmark.extra_info["bytes_per_spec"] = per_spec
+    assert per_spec < 2048
@@ -1,22 +1,68 @@
 import pytest
 import pytest_benchmark
 
+import sys
 import subprocess
-import random
 import ipaddress
 
+import jail
+import jail.params
+import jail.codecs
+import jail.ippool
+import jail.libc
+import jail.simulator
+
 ifconfig_command = "/sbin/ifconfig"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def param_table() -> jail.params.ParamTable:
+	"""Use the simulator jail parameter metadata on non-FreeBSD hosts."""
+	if sys.platform.startswith("freebsd") is True:
+		yield jail.params.get_table()
+		return
+	table = jail.simulator.get_param_table()
+	jail.params.set_table(table)
+	jail.codecs._codecs.clear()
+	yield table
+	jail.params.set_table(None)
+	jail.codecs._codecs.clear()
+
+
+@pytest.fixture(scope="function")
+def simulator() -> jail.simulator.JailSimulator:
+	"""Route the jail syscalls of the test to a JailSimulator."""
+	simulator = jail.simulator.JailSimulator()
+	jail.libc.set_backend(simulator)
+	yield simulator
+	jail.libc.set_backend(None)
+
+
+@pytest.fixture(scope="session")
+def address_pools() -> jail.ippool.AddressAllocator:
+	"""Test addresses that never collide within a session."""
+	return jail.ippool.AddressAllocator([
+		jail.ippool.AddressPool("192.0.2.0/24"),
+		jail.ippool.AddressPool("2001:db8:10c::/64", size=0x10000)
+	])
+
+
 @pytest.fixture(scope="function")
-def ipv4_address() -> ipaddress.IPv4Address:
-	return ipaddress.IPv4Address("192.0.2." + str(random.randint(1,254)))
+def ipv4_address(
+	address_pools: jail.ippool.AddressAllocator
+) -> ipaddress.IPv4Address:
+	address, = address_pools.allocate("ipv4_address", version=4)
+	yield address
+	address_pools.release("ipv4_address", [address])
 
 
 @pytest.fixture(scope="function")
-def ipv6_address() -> ipaddress.IPv4Address:
-	ipv6_suffix = '{:x}'.format(random.randint(1,0xFFFF))
-	return ipaddress.IPv6Address("2001:db8:10c::" + ipv6_suffix)
+def ipv6_address(
+	address_pools: jail.ippool.AddressAllocator
+) -> ipaddress.IPv6Address:
+	address, = address_pools.allocate("ipv6_address", version=6)
+	yield address
+	address_pools.release("ipv6_address", [address])
 
 
 @pytest.fixture(scope="function")
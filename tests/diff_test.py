@@ -0,0 +1,149 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import errno
+import ipaddress
+
+import jail
+import jail.diff
+import jail.simulator
+
+
+@pytest.fixture
+def jid(simulator: jail.simulator.JailSimulator) -> int:
+    return jail.create_jail({
+        "persist": None,
+        "name": "www",
+        "host.hostname": "www.example.com",
+        "ip4.addr": [ipaddress.IPv4Address("192.0.2.1")],
+        "ip6": "inherit",
+        "securelevel": 2
+    })
+
+
+def test_normalize() -> None:
+    assert jail.diff.normalize("persist", None) == ("persist", True)
+    assert jail.diff.normalize("nopersist", None) == ("persist", False)
+    assert jail.diff.normalize("persist", False) == ("persist", False)
+    assert jail.diff.normalize("ip6", "inherit") == ("ip6", "inherit")
+    assert jail.diff.normalize("ip6", 2) == ("ip6", "inherit")
+    assert jail.diff.normalize("host.hostname", b"www") == (
+        "host.hostname",
+        "www"
+    )
+    assert jail.diff.normalize("ip4.addr", "192.0.2.1") == (
+        "ip4.addr",
+        [ipaddress.IPv4Address("192.0.2.1")]
+    )
+    assert jail.diff.normalize("ip4.addr", []) == ("ip4.addr", [])
+
+
+def test_diff() -> None:
+    current = {"jid": 1, "persist": True, "securelevel": 2, "ip6": "new"}
+    desired = {"persist": None, "securelevel": 3, "ip6": "new"}
+    assert jail.diff.diff(current, desired) == {"securelevel": 3}
+
+
+def test_update_skips_unchanged_jails(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    desired = {
+        "persist": None,
+        "host.hostname": "www.example.com",
+        "ip4.addr": ["192.0.2.1"],
+        "ip6": "inherit",
+        "securelevel": 2
+    }
+    calls = simulator.calls["jail_set"]
+    assert jail.diff.update(jid, desired) == {}
+    assert simulator.calls["jail_set"] == calls
+    assert simulator.calls["jail_get"] == 1
+
+
+def test_update_sends_only_changes(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    sent = []
+    jail_set = simulator.jail_set
+
+    def record(pointer, niov: int, flags: int) -> int:
+        sent.append((niov, flags))
+        return jail_set(pointer, niov, flags)
+
+    simulator.jail_set = record
+    changes = jail.diff.update(jid, {
+        "host.hostname": "web.example.com",
+        "securelevel": 2
+    })
+    assert changes == {"host.hostname": "web.example.com"}
+    # jid, host.hostname and errmsg
+    assert sent == [(6, jail.JAIL_UPDATE)]
+    assert jail.get_jail(jid, ("host.hostname",))["host.hostname"] == (
+        "web.example.com"
+    )
+
+
+def test_update_with_snapshots(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    snapshots = jail.diff.Snapshots()
+    desired = {"securelevel": 3, "nopersist": False}
+
+    assert jail.diff.update(jid, desired, snapshots) == {"securelevel": 3}
+    assert simulator.calls["jail_get"] == 1
+    for _ in range(10):
+        assert jail.diff.update(jid, desired, snapshots) == {}
+    assert simulator.calls["jail_get"] == 1
+    assert simulator.calls["jail_set"] == 2  # create and one update
+
+    assert jail.diff.update(jid, {"securelevel": 4}, snapshots) == {
+        "securelevel": 4
+    }
+    assert snapshots.get(jid, ("securelevel",))["securelevel"] == 4
+
+
+def test_snapshots_expire(jid: int) -> None:
+    snapshots = jail.diff.Snapshots(max_age=0)
+    snapshots.update(jid, {"securelevel": 2})
+    assert snapshots.get(jid, ("securelevel",)) is None
+    assert len(snapshots) == 0
+
+
+def test_update_invalidates_snapshots_on_errors(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    snapshots = jail.diff.Snapshots()
+    snapshots.update(jid, {"jid": jid, "securelevel": 2})
+    simulator.inject_error("jail_set", errno.EPERM)
+    with pytest.raises(PermissionError):
+        jail.diff.update(jid, {"securelevel": 3}, snapshots)
+    assert len(snapshots) == 0
+
+    with pytest.raises(OSError) as excinfo:
+        jail.diff.update(23, {"securelevel": 3})
+    assert excinfo.value.errno == errno.ENOENT
@@ -0,0 +1,141 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import asyncio
+import errno
+import queue
+import time
+
+import jail
+import jail.events
+import jail.simulator
+
+
+def test_watcher_poll(simulator: jail.simulator.JailSimulator) -> None:
+    simulator.linger = 0.05
+    www = jail.create_jail(dict(persist=None, name="www"))
+    watcher = jail.events.Watcher(params=("name", "path"))
+    assert watcher.poll() == []
+
+    mail = jail.create_jail(dict(persist=None, name="mail"))
+    jail.update_jail(dict(jid=www, path="/jails/www"))
+    events = watcher.poll()
+    assert [(x.kind, x.jid) for x in events] == [
+        ("updated", www),
+        ("created", mail)
+    ]
+    assert events[0].previous["path"] == "/"
+    assert events[0].record["path"] == "/jails/www"
+    assert watcher.poll() == []
+
+    jail.remove_jail(mail)
+    assert [(x.kind, x.jid) for x in watcher.poll()] == [("dying", mail)]
+    assert list(jail.wait_removed([mail], timeout=1)) == [mail]
+    events = watcher.poll()
+    assert [(x.kind, x.jid) for x in events] == [("removed", mail)]
+    assert events[0].record is None
+    assert events[0].previous["name"] == "mail"
+
+
+def test_watcher_subscriptions(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    watcher = jail.events.Watcher(interval=0.01, max_interval=0.05)
+    first = watcher.subscribe()
+    second = watcher.subscribe()
+    assert len(watcher) == 2
+
+    jid = jail.create_jail(dict(persist=None, name="www"))
+    for subscription in (first, second):
+        event = subscription.get(timeout=1)
+        assert (event.kind, event.jid) == ("created", jid)
+
+    second.close()
+    assert list(second) == []
+    jail.remove_jail(jid)
+    assert first.get(timeout=1).kind == "removed"
+    assert len(watcher) == 1
+    with pytest.raises(StopIteration):
+        second.get(timeout=0.05)
+    with pytest.raises(queue.Empty):
+        first.get(timeout=0.05)
+
+    watcher.close()
+    assert list(first) == []
+    assert watcher._thread is None
+
+
+def test_watcher_resubscribe_before_the_thread_exits(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    watcher = jail.events.Watcher(interval=0.05, max_interval=0.05)
+    first = watcher.subscribe()
+    # the poll thread sees the new subscriber after the wakeup of close
+    with watcher._lock:
+        first.close()
+        second = watcher.subscribe()
+    try:
+        calls = simulator.calls["jail_get"]
+        time.sleep(0.3)
+        assert simulator.calls["jail_get"] - calls < 20
+
+        jid = jail.create_jail(dict(persist=None, name="www"))
+        assert second.get(timeout=1).jid == jid
+    finally:
+        watcher.close()
+
+
+def test_watcher_reports_errors(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    watcher = jail.events.Watcher(interval=0.01)
+    with watcher.subscribe() as subscription:
+        simulator.inject_error("jail_get", errno.EPERM)
+        with pytest.raises(PermissionError):
+            subscription.get(timeout=1)
+        assert list(subscription) == []
+    watcher.close()
+
+
+def test_watcher_async(simulator: jail.simulator.JailSimulator) -> None:
+    watcher = jail.events.Watcher(interval=0.01, max_interval=0.05)
+
+    async def consume(count: int) -> list:
+        events = []
+        async for event in watcher.subscribe_async():
+            events.append(event.kind)
+            if len(events) == count:
+                break
+        return events
+
+    async def main() -> list:
+        consumers = [asyncio.ensure_future(consume(2)) for _ in range(3)]
+        await asyncio.sleep(0)
+        jid = jail.create_jail(dict(persist=None, name="www"))
+        await asyncio.sleep(0.05)
+        jail.remove_jail(jid)
+        return await asyncio.wait_for(asyncio.gather(*consumers), 2)
+
+    assert asyncio.run(main()) == [["created", "removed"]] * 3
+    watcher.close()
@@ -0,0 +1,87 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import subprocess
+import sys
+
+import jail
+import jail.exec
+import jail.metrics
+import jail.simulator
+
+
+@pytest.fixture
+def jid(simulator: jail.simulator.JailSimulator) -> int:
+    return jail.create_jail(dict(persist=None, name="www"))
+
+
+def test_spawn_streams_pipes(jid: int) -> None:
+    process = jail.exec.spawn(
+        jid,
+        [sys.executable, "-c", "import sys; print(sys.stdin.read().upper())"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE
+    )
+    stdout, _ = process.communicate(b"jailed\n")
+    assert process.returncode == 0
+    assert stdout == b"JAILED\n\n"
+
+
+def test_run_by_name_changes_directory_inside_of_the_jail(jid: int) -> None:
+    command = [sys.executable, "-c", "import os; print(os.getcwd())"]
+    result = jail.exec.run("www", command, stdout=subprocess.PIPE)
+    assert result.stdout == b"/\n"
+
+    result = jail.exec.run(jid, command, stdout=subprocess.PIPE, cwd="/tmp")
+    assert result.stdout == b"/tmp\n"
+
+
+def test_spawn_fails_to_attach(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    with pytest.raises(OSError):
+        jail.exec.spawn("missing", ["/bin/true"])
+    with pytest.raises(subprocess.SubprocessError):
+        jail.exec.spawn(23, ["/bin/true"])
+
+
+def test_spawn_rejects_user(jid: int) -> None:
+    with pytest.raises(ValueError):
+        jail.exec.spawn(jid, ["/bin/true"], user="nobody")
+
+
+def test_attach_bypasses_metrics_after_fork(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    jail.metrics.enable()
+    try:
+        # the metrics lock may be held by another thread during the fork
+        attach = jail.exec.get_raw_syscall("jail_attach")
+        assert attach == simulator.jail_attach
+        command = [sys.executable, "-c", "print(1)"]
+        result = jail.exec.run(jid, command, stdout=subprocess.PIPE)
+    finally:
+        jail.metrics.disable()
+    assert result.stdout == b"1\n"
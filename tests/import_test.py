@@ -0,0 +1,82 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import ctypes
+import os
+import re
+import subprocess
+import sys
+
+import jail.libc
+
+IMPORT_TIME_BUDGET_US = 200000
+
+import_check = """
+import sys
+import jail
+assert "freebsd_sysctl" not in sys.modules.keys(), "sysctl module loaded"
+assert "ctypes.util" not in sys.modules.keys(), "library lookup"
+assert "dll" not in jail.libc.__dict__.keys(), "libc loaded"
+assert "JAIL_MAX_AF_IPS" not in jail.__dict__.keys(), "sysctl queried"
+"""
+
+
+def _import_jail() -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", import_check],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE,
+        check=True
+    )
+
+
+def test_import_does_not_probe_the_system() -> None:
+    _import_jail()
+
+
+def test_import_time_budget() -> None:
+    stderr = _import_jail().stderr.decode("UTF-8")
+    cumulative = [
+        int(match.group(1)) for match in re.finditer(
+            r"^import time:\s+\d+ \|\s+(\d+) \| jail$",
+            stderr,
+            re.MULTILINE
+        )
+    ]
+    assert len(cumulative) == 1
+    assert cumulative[0] < IMPORT_TIME_BUDGET_US
+
+
+def test_load_dll(monkeypatch) -> None:
+    loaded = []
+
+    def cdll(name: str, use_errno: bool=False) -> str:
+        loaded.append((name, use_errno))
+        if name == "libc.so.7":
+            raise OSError("not FreeBSD")
+        return name
+
+    monkeypatch.setattr(ctypes, "CDLL", cdll)
+    monkeypatch.setattr("ctypes.util.find_library", lambda name: "libc.so.6")
+    assert jail.libc.load_dll() == "libc.so.6"
+    assert loaded == [("libc.so.7", True), ("libc.so.6", True)]
@@ -0,0 +1,171 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ipaddress
+import threading
+import time
+
+import jail
+import jail.index
+import jail.simulator
+
+
+@pytest.fixture
+def jids(simulator: jail.simulator.JailSimulator) -> list:
+    return [
+        jail.create_jail({
+            "persist": None,
+            "name": f"jail{i}",
+            "path": "/jails/shared" if (i < 2) else f"/jails/jail{i}",
+            "ip4.addr": [ipaddress.IPv4Address("192.0.2.0") + i + 1],
+            "ip6.addr": [ipaddress.IPv6Address("2001:db8::") + i + 1]
+        }) for i in range(5)
+    ]
+
+
+def test_index_lookups(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex()
+    assert len(index) == 5
+    assert simulator.calls["jail_get"] == 6  # five jails and the end
+
+    assert index.get(jids[3])["name"] == "jail3"
+    assert index.get_by_name("jail2")["jid"] == jids[2]
+    assert index.get_by_address("192.0.2.5")["jid"] == jids[4]
+    assert index.get_by_address("2001:db8::1")["jid"] == jids[0]
+    assert [x["jid"] for x in index.get_by_path("/jails/shared")] == jids[:2]
+    assert index.get_by_name("unknown") is None
+    assert index.get_by_address("198.51.100.1") is None
+    assert simulator.calls["jail_get"] == 6
+
+
+def test_index_refreshes_incrementally(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex()
+    index.refresh()
+
+    jail.remove_jail(jids[0])
+    jail.update_jail({"jid": jids[1], "name": "renamed"})
+    added = jail.create_jail(dict(persist=None, name="new"))
+    assert index.get_by_name("jail1")["jid"] == jids[1]  # not refreshed
+
+    assert index.refresh() == ({added}, {jids[1]}, {jids[0]})
+    assert index.get(jids[0]) is None
+    assert index.get_by_name("jail1") is None
+    assert index.get_by_name("renamed")["jid"] == jids[1]
+    assert index.get_by_address("192.0.2.1") is None
+    assert index.get_by_name("new")["jid"] == added
+
+
+def test_index_verifies_removed_jails(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex()
+    index.refresh()
+    jail.remove_jail(jids[2])
+
+    assert index.get_by_name("jail2")["jid"] == jids[2]
+    assert index.get_by_name("jail2", verify=True) is None
+    assert index.get(jids[2]) is None
+    assert index.get_by_address("192.0.2.3") is None
+    assert len(index) == 4
+
+
+def test_index_refresh_interval(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex(interval=0.05)
+    assert len(index) == 5
+    jail.create_jail(dict(persist=None, name="late"))
+    assert index.stale is False
+    assert index.get_by_name("late") is None
+
+    time.sleep(0.06)
+    assert index.stale is True
+    assert index.get_by_name("late") is not None
+
+    index.invalidate()
+    assert index.stale is True
+
+
+def test_index_lookups_during_refresh(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex()
+    index.refresh()
+    jail.update_jail({"jid": jids[1], "name": "renamed"})
+    gate = threading.Event()
+
+    def latency(operation: str) -> float:
+        gate.wait(10)
+        return 0
+
+    simulator.latency = latency
+    refresh = threading.Thread(target=index.refresh)
+    refresh.start()  # blocked in jail_get while enumerating
+    try:
+        # lookups do not wait for the enumeration of the refresh
+        assert index.get_by_name("jail1")["jid"] == jids[1]
+        assert index.get_by_name("renamed") is None
+    finally:
+        gate.set()
+        refresh.join()
+    assert index.get_by_name("renamed")["jid"] == jids[1]
+    assert index.get_by_name("jail1") is None
+
+
+def test_index_verifies_misses(
+    simulator: jail.simulator.JailSimulator,
+    jids: list
+) -> None:
+    index = jail.index.JailIndex()
+    index.refresh()
+    jid = jail.create_jail({
+        "persist": None,
+        "name": "new",
+        "ip4.addr": [ipaddress.IPv4Address("192.0.2.100")]
+    })
+    assert index.get_by_name("new") is None
+    assert index.get_by_address("192.0.2.100") is None
+
+    calls = simulator.calls["jail_get"]
+    assert index.get_by_name("new", verify=True)["jid"] == jid
+    assert simulator.calls["jail_get"] - calls == 1
+    assert index.get_by_name("new")["jid"] == jid
+    assert index.get_by_name("missing", verify=True) is None
+
+    jail.update_jail({
+        "jid": jid,
+        "ip4.addr": [ipaddress.IPv4Address("192.0.2.101")]
+    })
+    record = index.get_by_address("192.0.2.101", verify=True)
+    assert record["jid"] == jid
+    assert index.get_by_address("192.0.2.100", verify=True) is None
@@ -0,0 +1,165 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import errno
+import ipaddress
+
+import jail
+import jail.ippool
+import jail.simulator
+
+
+def ip(address: str) -> jail.ippool.Address:
+    return ipaddress.ip_address(address)
+
+
+def test_address_pool() -> None:
+    pool = jail.ippool.AddressPool("192.0.2.0/24")
+    assert repr(pool) == "<AddressPool: 192.0.2.0/24 2/256>"
+    addresses = [pool.allocate() for _ in range(254)]
+    assert addresses[0] == ip("192.0.2.1")
+    assert addresses[-1] == ip("192.0.2.254")
+    assert len(set(addresses)) == 254
+    assert pool.available == 0
+    with pytest.raises(OSError) as excinfo:
+        pool.allocate()
+    assert excinfo.value.errno == errno.EADDRNOTAVAIL
+
+    pool.release(ip("192.0.2.23"))
+    pool.release(ip("192.0.2.42"))
+    assert pool.allocate() == ip("192.0.2.42")
+    assert pool.allocate() == ip("192.0.2.23")
+    with pytest.raises(ValueError):
+        pool.release(ip("192.0.2.0") + 256)
+
+
+def test_address_pool_claims() -> None:
+    pool = jail.ippool.AddressPool(
+        "192.0.2.0/29",
+        reserved=[ip("192.0.2.0"), ip("192.0.2.1")]
+    )
+    pool.claim(ip("192.0.2.3"))
+    with pytest.raises(OSError) as excinfo:
+        pool.claim(ip("192.0.2.3"))
+    assert excinfo.value.errno == errno.EADDRINUSE
+    assert [pool.allocate() for _ in range(5)] == [
+        ip(f"192.0.2.{x}") for x in (2, 4, 5, 6, 7)
+    ]
+
+    pool.release(ip("192.0.2.5"))
+    pool.claim(ip("192.0.2.5"))
+    with pytest.raises(OSError):
+        pool.allocate()
+    pool.clear()
+    assert pool.used == 2
+    assert pool.allocate() == ip("192.0.2.2")
+
+
+def test_address_pool_ipv6() -> None:
+    with pytest.raises(ValueError):
+        jail.ippool.AddressPool("2001:db8::/64")
+    pool = jail.ippool.AddressPool("2001:db8::/64", size=2 ** 16)
+    assert pool.allocate() == ip("2001:db8::1")
+    assert ip("2001:db8::ffff") in pool
+    assert ip("2001:db8::1:0") not in pool
+    assert ip("192.0.2.1") not in pool
+
+
+def test_address_pool_scales() -> None:
+    pool = jail.ippool.AddressPool("10.0.0.0/16")
+    addresses = [pool.allocate() for _ in range(50000)]
+    for address in addresses[::2]:
+        pool.release(address)
+    assert pool.used == 25002
+    assert len(set(pool.allocate() for _ in range(40000))) == 40000
+    assert len(pool._free) < 25000
+
+
+def test_address_allocator() -> None:
+    allocator = jail.ippool.AddressAllocator([
+        jail.ippool.AddressPool("192.0.2.0/30"),
+        jail.ippool.AddressPool("198.51.100.0/30"),
+        jail.ippool.AddressPool("2001:db8::/120")
+    ], max_af_ips=3)
+    assert allocator.allocate("www", count=3) == [
+        ip("192.0.2.1"),
+        ip("192.0.2.2"),
+        ip("198.51.100.1")
+    ]
+    assert allocator.allocate("www", version=6) == [ip("2001:db8::1")]
+    with pytest.raises(ValueError):
+        allocator.allocate("www")
+    assert allocator.params("www") == {
+        "ip4.addr": [ip("192.0.2.1"), ip("192.0.2.2"), ip("198.51.100.1")],
+        "ip6.addr": [ip("2001:db8::1")]
+    }
+
+    # failed allocations return the addresses they took
+    with pytest.raises(OSError):
+        allocator.allocate("mail", count=2)
+    assert allocator.pools[1].available == 1
+
+    assert allocator.release("www", [ip("192.0.2.2")]) == [ip("192.0.2.2")]
+    assert allocator.allocate("mail") == [ip("192.0.2.2")]
+    assert len(allocator.release("www")) == 3
+    assert set(allocator.leases) == {"mail"}
+
+
+def test_address_allocator_limit(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    allocator = jail.ippool.AddressAllocator([
+        jail.ippool.AddressPool("10.0.0.0/16")
+    ])
+    allocator.allocate("www", count=jail.get_jail_max_af_ips())
+    with pytest.raises(ValueError):
+        allocator.allocate("www")
+
+
+def test_address_allocator_rebuild(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    allocator = jail.ippool.AddressAllocator([
+        jail.ippool.AddressPool("192.0.2.0/24"),
+        jail.ippool.AddressPool("2001:db8::/64", size=256)
+    ])
+    allocator.allocate("stale", count=2)
+    jail.create_jail({
+        "persist": None,
+        "name": "www",
+        "ip4.addr": [ip("192.0.2.1"), ip("198.51.100.1")],
+        "ip6.addr": [ip("2001:db8::1")]
+    })
+    jail.create_jail(dict(persist=None, name="mail", **{
+        "ip4.addr": [ip("192.0.2.3")]
+    }))
+
+    allocator.rebuild()
+    assert allocator.leases == {
+        "www": [ip("192.0.2.1"), ip("2001:db8::1")],
+        "mail": [ip("192.0.2.3")]
+    }
+    assert allocator.allocate("new") == [ip("192.0.2.2")]
+    assert allocator.allocate("new") == [ip("192.0.2.4")]
+    assert allocator.allocate("new", version=6) == [ip("2001:db8::2")]
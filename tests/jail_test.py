@@ -26,10 +26,11 @@ import pytest
 import subprocess
 import sys
 import ipaddress
-import random
 import ctypes
 
 import jail
+import jail.exec
+import jail.ippool
 
 jail_command = "/usr/sbin/jail"
 jls_command = "/usr/sbin/jls"
@@ -53,8 +54,7 @@ def test_jail_remove() -> None:
     )
     try:
         jail.dll.jail_remove(jid)
-        while jail.is_jid_dying(jid) is True:
-            continue
+        assert list(jail.wait_removed([jid], timeout=10)) == [jid]
     except:
         subprocess.check_output([jail_command, "-r", str(jid)])
         raise
@@ -62,6 +62,42 @@ def test_jail_remove() -> None:
     with pytest.raises(subprocess.CalledProcessError) as excinfo:
         subprocess.check_output([jls_command, "-j", str(jid)])
 
+def test_jail_info() -> None:
+    name = "test-jail-info"
+    subprocess.check_output([
+        jail_command, "-c", "persist", f"name={name}", "path=/rescue",
+        f"host.hostname={name}.example.com"
+    ])
+    try:
+        jid = jail.get_jid_by_name(name)
+        info = jail.JailInfo(("name", "path", "host.hostname", "dying"))
+        record = info.get(jid)
+        assert record["jid"] == jid
+        assert record["name"] == name
+        assert record["path"] == "/rescue"
+        assert record["host.hostname"] == f"{name}.example.com"
+        assert record["dying"] is False
+        assert jail.is_jid_dying(jid) is False
+
+        info = jail.JailInfo(("path",), key="name")
+        assert info.get(name) == dict(jid=jid, path="/rescue")
+        assert info.get("test-jail-info-missing") is None
+    finally:
+        subprocess.check_output([jail_command, "-r", name])
+
+def test_exec() -> None:
+    name = "test-exec"
+    subprocess.check_output([
+        jail_command, "-c", "persist", f"name={name}", "path=/rescue",
+        f"host.hostname={name}.example.com"
+    ])
+    try:
+        process = jail.exec.spawn(name, ["/hostname"], stdout=subprocess.PIPE)
+        assert process.communicate()[0] == f"{name}.example.com\n".encode()
+        assert process.returncode == 0
+    finally:
+        subprocess.check_output([jail_command, "-r", name])
+
 def test_jid_lookup() -> None:
     name = "test-jid-lookup"
     assert jail.get_jid_by_name(name) == -1
@@ -98,10 +134,10 @@ def test_configure_ipv4_addresses_for_non_vnet_jail(
 
 def test_configure_miltiple_ipv4_addresses_for_non_vnet_jail(
     ipv4_address: ipaddress.IPv4Address,
-    bridge_interface: str
+    bridge_interface: str,
+    address_pools: jail.ippool.AddressAllocator
 ) -> None:
-    ip1 = ipaddress.IPv4Address("192.0.2." + str(random.randint(1,254)))
-    ip2 = ipaddress.IPv4Address("192.0.2." + str(random.randint(1,254)))
+    ip1, ip2 = address_pools.allocate("miltiple_ipv4", version=4, count=2)
 
     print("IPS", str(ip1), str(ip2))
     subprocess.check_output(
@@ -158,3 +194,29 @@ def test_configure_ipv6_addresses_for_non_vnet_jail(
     finally:
         if jid > 0:
             subprocess.check_output([jail_command, "-r", str(jid)])
+
+
+def test_iterate_jails() -> None:
+    names = ["test-iterate-jails-1", "test-iterate-jails-2"]
+    for name in names:
+        subprocess.check_output(
+            [jail_command, "-c", "persist", f"name={name}", "path=/rescue"]
+        )
+    try:
+        jails = {
+            x["name"]: x for x in jail.iterate_jails(("name", "path"))
+        }
+        for name in names:
+            assert name in jails.keys()
+            assert jails[name]["jid"] == jail.get_jid_by_name(name)
+            assert jails[name]["path"] == "/rescue"
+
+        jls_jids = subprocess.check_output(
+            [jls_command, "jid"]
+        ).decode("UTF-8").split()
+        assert sorted(int(x) for x in jls_jids) == sorted(
+            x["jid"] for x in jail.iterate_jails(())
+        )
+    finally:
+        for name in names:
+            subprocess.check_output([jail_command, "-r", name])
@@ -0,0 +1,112 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import errno
+
+import jail
+import jail.libc
+import jail.metrics
+import jail.simulator
+
+
+@pytest.fixture
+def metrics(
+    simulator: jail.simulator.JailSimulator
+) -> jail.metrics.Metrics:
+    metrics = jail.metrics.enable()
+    yield metrics
+    jail.metrics.disable()
+
+
+def test_metrics_are_disabled_by_default(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    assert jail.metrics.current is None
+    assert jail.dll is simulator
+    jail.create_jail(dict(persist=None))
+    assert jail.metrics.snapshot() == {}
+
+
+def test_metrics_count_syscalls_and_errors(
+    simulator: jail.simulator.JailSimulator,
+    metrics: jail.metrics.Metrics
+) -> None:
+    jid = jail.create_jail(dict(persist=None, name="www"))
+    with pytest.raises(FileExistsError):
+        jail.create_jail(dict(persist=None, name="www"))
+    jail.remove_jail(jid)
+    with pytest.raises(OSError):
+        jail.remove_jail(jid)
+
+    stats = jail.metrics.snapshot()
+    assert stats["jail_set"]["count"] == 2
+    assert stats["jail_set"]["errors"] == {errno.EEXIST: 1}
+    assert stats["jail_remove"]["count"] == 2
+    assert stats["jail_remove"]["errors"] == {errno.EINVAL: 1}
+    assert stats["jail_set"]["latency"]["count"] == 2
+    assert sum(stats["jail_set"]["latency"]["buckets"].values()) == 2
+
+
+def test_metrics_count_marshalled_bytes(
+    simulator: jail.simulator.JailSimulator,
+    metrics: jail.metrics.Metrics
+) -> None:
+    jiov = jail.Jiov(dict(persist=None, path="/rescue"))
+    jiov.compile()
+    jiov.compile()  # reusing the buffer marshals nothing
+
+    stats = jail.metrics.snapshot()["marshal"]
+    assert stats["count"] == 1
+    # persist\0 and /rescue\0 padded to 8 bytes, path\0 and errmsg\0 to 8
+    assert stats["bytes"] == 8 + 8 + 8 + 8
+
+
+def test_metrics_hooks(
+    simulator: jail.simulator.JailSimulator,
+    metrics: jail.metrics.Metrics
+) -> None:
+    calls = []
+    jail.metrics.add_hooks(
+        pre=lambda name, args: calls.append(("pre", name)),
+        post=lambda name, args, result, error, duration: calls.append(
+            ("post", name, result, error)
+        )
+    )
+    with pytest.raises(OSError):
+        jail.remove_jail(23)
+    assert calls == [
+        ("pre", "jail_remove"),
+        ("post", "jail_remove", -1, errno.EINVAL)
+    ]
+
+
+def test_metrics_disable_restores_backend(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    jail.metrics.enable()
+    assert isinstance(jail.dll, jail.metrics.InstrumentedBackend) is True
+    jail.metrics.disable()
+    assert jail.dll is simulator
+    with pytest.raises(RuntimeError):
+        jail.metrics.add_hooks(pre=print)
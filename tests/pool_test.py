@@ -0,0 +1,129 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import typing
+import pytest
+import errno
+import os
+import subprocess
+import time
+
+import jail
+import jail.metrics
+import jail.pool
+import jail.simulator
+
+
+def _attached_jid() -> int:
+    return jail.dll.attached
+
+
+def _pid() -> int:
+    return os.getpid()
+
+
+@pytest.fixture
+def jid(simulator: jail.simulator.JailSimulator) -> int:
+    return jail.create_jail(dict(persist=None, name="www"))
+
+
+def test_pool_workers_are_attached(jid: int) -> None:
+    with jail.pool.JailPool(jid, processes=2) as pool:
+        futures = [pool.submit(_attached_jid) for _ in range(10)]
+        assert [x.result(timeout=10) for x in futures] == [jid] * 10
+        assert pool.submit(divmod, 7, 2).result(timeout=10) == (3, 1)
+
+
+def test_pool_runs_commands(jid: int) -> None:
+    with jail.pool.JailPool("www", processes=1) as pool:
+        result = pool.run(
+            ["/bin/sh", "-c", "pwd"],
+            stdout=subprocess.PIPE
+        ).result(timeout=10)
+    assert result.stdout == b"/\n"
+
+
+def test_pool_recycles_workers(jid: int) -> None:
+    with jail.pool.JailPool(jid, processes=1, maxtasksperchild=2) as pool:
+        pids = [pool.submit(_pid).result(timeout=10) for _ in range(6)]
+    assert len(set(pids)) == 3
+    assert os.getpid() not in pids
+
+
+def test_pool_reports_task_errors(jid: int) -> None:
+    with jail.pool.JailPool(jid, processes=1) as pool:
+        with pytest.raises(ZeroDivisionError):
+            pool.submit(divmod, 1, 0).result(timeout=10)
+
+
+def test_pool_is_torn_down_with_the_jail(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    pool = jail.pool.JailPool(jid, processes=1, monitor_interval=0.01)
+    pending = pool.submit(time.sleep, 60)
+    jail.remove_jail(jid)
+
+    with pytest.raises(OSError) as excinfo:
+        pending.result(timeout=10)
+    assert excinfo.value.errno == errno.ESRCH
+    with pytest.raises(OSError):
+        pool.submit(_pid)
+    assert pool.closed is True
+
+
+def test_pool_requires_the_jail(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    with pytest.raises(OSError):
+        jail.pool.JailPool(23)
+
+
+def test_pool_fails_if_workers_cannot_attach(
+    simulator: jail.simulator.JailSimulator,
+    jid: int
+) -> None:
+    # forked workers inherit the injected error and fail to attach
+    simulator.inject_error("jail_attach", errno.EPERM)
+    with pytest.raises(OSError) as excinfo:
+        jail.pool.JailPool(jid, processes=1)
+    assert excinfo.value.errno == errno.EPERM
+
+
+def test_pool_attaches_while_metrics_are_locked(jid: int) -> None:
+    metrics = jail.metrics.enable()
+
+    def lock(name: str, *args: typing.Any) -> None:
+        # hold the lock from the jail lookup until the pool was created
+        if metrics._lock.locked() is False:
+            metrics._lock.acquire()
+
+    metrics.post_hooks.append(lock)
+    try:
+        pool = jail.pool.JailPool(jid, processes=1)
+    finally:
+        metrics.post_hooks.remove(lock)
+        metrics._lock.release()
+        jail.metrics.disable()
+    with pool:
+        assert pool.submit(_attached_jid).result(timeout=10) == jid
@@ -0,0 +1,119 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import ctypes
+import errno
+import time
+
+import jail
+import jail.libc
+import jail.metrics
+import jail.racct
+import jail.simulator
+
+
+def test_parse() -> None:
+    assert jail.racct.parse(b"cputime=12,memoryuse=4096,pcpu=0") == dict(
+        cputime=12,
+        memoryuse=4096,
+        pcpu=0
+    )
+    assert jail.racct.parse(b"") == {}
+
+
+def test_rctl(simulator: jail.simulator.JailSimulator) -> None:
+    jail.create_jail(dict(persist=None, name="www"))
+    simulator.set_usage("www", cputime=23, openfiles=42)
+    usage = jail.racct.get_racct("www")
+    assert set(usage) == set(jail.racct.RACCT_RESOURCES)
+    assert (usage["cputime"], usage["openfiles"]) == (23, 42)
+
+    # small buffers are replaced while the kernel reports ERANGE
+    output = ctypes.create_string_buffer(16)
+    output = jail.libc.rctl("rctl_get_racct", b"jail:www", output)
+    assert len(output) == 512
+    assert jail.racct.parse(output.value) == usage
+
+    with pytest.raises(ValueError):
+        jail.libc.rctl("rctl_unknown", b"jail:www")
+    simulator.racct = False
+    with pytest.raises(OSError) as excinfo:
+        jail.racct.get_racct("www")
+    assert excinfo.value.errno == errno.ENOSYS
+
+
+def test_ring_buffer() -> None:
+    ring = jail.racct.RingBuffer(("cputime", "pcpu"), capacity=3)
+    assert len(ring) == 0
+    assert ring.latest() is None
+    for i in range(5):
+        ring.append(float(i), [i * 10, i])
+
+    assert len(ring) == 3
+    assert ring.latest() == dict(cputime=40, pcpu=4)
+    assert ring.series("cputime") == [(2.0, 20), (3.0, 30), (4.0, 40)]
+    assert [x for x, _ in ring] == [2.0, 3.0, 4.0]
+    assert len(ring.values) == 6
+
+
+def test_sampler(simulator: jail.simulator.JailSimulator) -> None:
+    for name in ("www", "mail"):
+        jail.create_jail(dict(persist=None, name=name))
+    sampler = jail.racct.RacctSampler(("cputime", "maxproc"), capacity=2)
+    simulator.set_usage("www", cputime=1)
+    assert sampler.sample() == 2
+    simulator.set_usage("www", cputime=2)
+    jail.attach_jail(jail.get_jail("mail", (), key="name")["jid"])
+    assert sampler.sample() == 2
+
+    assert [x for _, x in sampler.series["www"].series("cputime")] == [1, 2]
+    assert sampler.series["mail"].latest() == dict(cputime=0, maxproc=1)
+    assert simulator.calls["rctl_get_racct"] == 4
+
+    jail.remove_jail(jail.get_jail("www", (), key="name")["jid"])
+    assert sampler.sample() == 1
+    assert set(sampler.series) == {"mail"}
+
+    with pytest.raises(ValueError):
+        jail.racct.RacctSampler(("cpu",))
+
+
+def test_sampler_thread(simulator: jail.simulator.JailSimulator) -> None:
+    jail.create_jail(dict(persist=None, name="www"))
+    metrics = jail.metrics.enable()
+    try:
+        with jail.racct.RacctSampler() as sampler:
+            sampler.start(interval=0.01)
+            time.sleep(0.1)
+        assert 2 <= len(sampler.series["www"]) <= 11
+        assert metrics.snapshot()["rctl_get_racct"]["count"] >= 2
+    finally:
+        jail.metrics.disable()
+
+    simulator.racct = False
+    sampler = jail.racct.RacctSampler()
+    sampler.start(interval=0.01)
+    sampler._thread.join(timeout=1)
+    assert sampler.error.errno == errno.ENOSYS
+    sampler.stop()
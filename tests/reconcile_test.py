@@ -0,0 +1,173 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import typing
+import pytest
+import errno
+import ipaddress
+
+import jail
+import jail.reconcile
+import jail.simulator
+
+
+def ip4(address: str) -> ipaddress.IPv4Address:
+    return ipaddress.IPv4Address(address)
+
+
+def spec(name: str, *addresses: str, **params: typing.Any) -> dict:
+    return dict(
+        persist=None,
+        name=name,
+        path="/jails/" + name,
+        **{"ip4.addr": [ip4(x) for x in addresses]},
+        **params
+    )
+
+
+def test_reconcile_plan(simulator: jail.simulator.JailSimulator) -> None:
+    jail.create_jail(spec("www", "192.0.2.1"))
+    mail = jail.create_jail(spec("mail", "192.0.2.2"))
+    old = jail.create_jail(spec("old", "192.0.2.3"))
+    calls = simulator.calls.copy()
+
+    plan = jail.reconcile.plan([
+        spec("www", "192.0.2.1"),
+        spec("mail", "192.0.2.2", securelevel=2),
+        spec("new", "192.0.2.3")
+    ], prune=True)
+    assert simulator.calls["jail_get"] - calls["jail_get"] == 4
+    assert simulator.calls["jail_set"] == calls["jail_set"]
+
+    assert plan.unchanged == ["www"]
+    assert [x.jid for x in plan.filter("update")] == [mail]
+    assert plan.filter("update")[0].params == dict(securelevel=2)
+    # the address of the removed jail is reused by the created one
+    assert [[(x.kind, x.name) for x in level] for level in plan.levels] == [
+        [("remove", "old"), ("update", "mail")],
+        [("create", "new")]
+    ]
+    assert plan.filter("remove")[0].jid == old
+    assert repr(plan) == "<Plan: create=1, update=1, remove=1>"
+
+
+def test_reconcile(simulator: jail.simulator.JailSimulator) -> None:
+    jail.create_jail(spec("a", "192.0.2.1"))
+    jail.create_jail(spec("b", "192.0.2.2"))
+    desired = [
+        spec("a", "192.0.2.2"),
+        spec("b", "192.0.2.3"),
+        spec("c", "192.0.2.1", **{"children.max": 1}),
+        spec("c.child")
+    ]
+    plan = jail.reconcile.plan(desired)
+    assert [[x.name for x in level] for level in plan.levels] == [
+        ["b"], ["a"], ["c"], ["c.child"]
+    ]
+
+    report = jail.reconcile.reconcile(desired, max_workers=4)
+    assert report.ok is True
+    assert report.summary()["create"] == dict(ok=2, failed=0)
+    assert jail.get_jail("a", ("ip4.addr",), key="name")["ip4.addr"] == [
+        ip4("192.0.2.2")
+    ]
+    assert jail.get_jail("c.child", ("parent",), key="name")["parent"] == (
+        jail.get_jail("c", (), key="name")["jid"]
+    )
+
+    # reconciling again makes no changes
+    calls = simulator.calls.copy()
+    report = jail.reconcile.reconcile(desired)
+    assert len(report.plan) == 0
+    assert simulator.calls["jail_set"] == calls["jail_set"]
+
+
+def test_reconcile_skips_dependent_actions(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    jail.create_jail(spec("old", "192.0.2.1"))
+    simulator.inject_error("jail_remove", errno.EPERM)
+    report = jail.reconcile.reconcile(
+        [spec("new", "192.0.2.1"), spec("other", "192.0.2.2")],
+        prune=True
+    )
+
+    assert report.ok is False
+    assert {x.item.name: x.errno for x in report.results} == {
+        "old": errno.EPERM,
+        "other": 0,
+        "new": errno.ECANCELED
+    }
+    assert jail.get_jids() == {
+        jail.get_jail("old", (), key="name")["jid"],
+        jail.get_jail("other", (), key="name")["jid"]
+    }
+
+
+def test_reconcile_swaps_addresses(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    jail.create_jail(spec("www", "192.0.2.1"))
+    jail.create_jail(spec("mail", "192.0.2.2"))
+    with pytest.raises(OSError) as excinfo:
+        jail.update_jail({"name": "www", "ip4.addr": [ip4("192.0.2.2")]})
+    assert excinfo.value.errno == errno.EADDRINUSE
+
+    desired = [spec("www", "192.0.2.2"), spec("mail", "192.0.2.1")]
+    plan = jail.reconcile.plan(desired)
+    assert [[x.name for x in level] for level in plan.levels] == [
+        ["www"],
+        ["mail"],
+        ["www"]
+    ]
+    assert plan.levels[0][0].params == {"ip4.addr": []}
+
+    report = jail.reconcile.apply(plan)
+    assert report.ok is True
+    for name, address in (("www", "192.0.2.2"), ("mail", "192.0.2.1")):
+        record = jail.get_jail(name, ("ip4.addr",), key="name")
+        assert record["ip4.addr"] == [ip4(address)]
+
+
+def test_reconcile_dry_run(simulator: jail.simulator.JailSimulator) -> None:
+    current = [dict(jid=1, name="old", path="/")]
+    calls = simulator.calls.copy()
+    report = jail.reconcile.reconcile(
+        [spec("new")],
+        prune=True,
+        dry_run=True,
+        current=current
+    )
+    assert simulator.calls == calls
+    assert report.dry_run is True
+    assert [(x.item.kind, x.jid) for x in report.results] == [
+        ("remove", 1),
+        ("create", None)
+    ]
+
+
+def test_reconcile_rejects_invalid_specs() -> None:
+    with pytest.raises(ValueError):
+        jail.reconcile.plan([dict(path="/")], current=[])
+    with pytest.raises(ValueError):
+        jail.reconcile.plan([dict(name="a"), dict(name="a")], current=[])
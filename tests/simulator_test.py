@@ -0,0 +1,211 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import errno
+import ipaddress
+import time
+
+import jail
+import jail.simulator
+
+
+def test_simulator_allocates_jids(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    assert jail.create_jail(dict(persist=None)) == 1
+    assert jail.create_jail(dict(persist=None, jid=23)) == 23
+    assert jail.create_jail(dict(persist=None)) == 2
+    assert jail.get_jail(23) == dict(jid=23, name="23", path="/")
+
+    with pytest.raises(FileExistsError) as excinfo:
+        jail.create_jail(dict(persist=None, jid=23))
+    assert excinfo.value.strerror == "jail 23 already exists"
+
+
+def test_simulator_names_are_unique(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    jid = jail.create_jail(dict(persist=None, name="www"))
+    with pytest.raises(FileExistsError) as excinfo:
+        jail.create_jail(dict(persist=None, name="www"))
+    assert excinfo.value.strerror == "jail \"www\" already exists"
+
+    other = jail.create_jail(dict(persist=None, name="mail"))
+    with pytest.raises(FileExistsError):
+        jail.update_jail(dict(jid=other, name="www"))
+    jail.update_jail(dict(jid=jid, name="web"))
+    assert jail.get_jail("web", ("path",), key="name") == dict(
+        jid=jid,
+        path="/"
+    )
+    assert jail.get_jail("www", key="name") is None
+
+
+def test_simulator_stores_native_values(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    params = {
+        "persist": None,
+        "name": "www",
+        "path": "/rescue",
+        "host.hostname": "www.example.com",
+        "ip4.addr": [ipaddress.IPv4Address("192.0.2.1")],
+        "ip6": "inherit"
+    }
+    jid = jail.create_jail(params)
+    info = jail.JailInfo(("host.hostname", "ip4.addr", "ip6", "persist"))
+    assert info.get(jid) == {
+        "jid": jid,
+        "host.hostname": "www.example.com",
+        "ip4.addr": [ipaddress.IPv4Address("192.0.2.1")],
+        "ip6": "inherit",
+        "persist": True
+    }
+
+    record = jail.get_jail(jid, ("name", "ip4.addr", "securelevel"))
+    assert record.jid == jid
+    assert record.get_str("name") == "www"
+    assert record.get_int("securelevel") == 0
+    assert record.get_int("children.max", default=7) == 7
+    assert record.get_addresses() == [ipaddress.IPv4Address("192.0.2.1")]
+    with pytest.raises(TypeError):
+        record.get_int("name")
+
+
+def test_simulator_removes_jails_without_persist(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    jid = jail.create_jail(dict(name="www"))
+    assert jid == 1
+    assert len(simulator) == 0
+
+    jid = jail.create_jail(dict(name="www", persist=None))
+    jail.update_jail(dict(jid=jid, persist=False))
+    assert jail.get_jail(jid) is None
+
+
+def test_simulator_iterates_with_lastjid(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    for i in range(5):
+        jail.create_jail(dict(persist=None, name=f"jail{i}"))
+    jail.remove_jail(3)
+    names = [x["name"] for x in jail.iterate_jails(("name",))]
+    assert names == ["jail0", "jail1", "jail3", "jail4"]
+
+
+def test_simulator_dying_jails(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    simulator.linger = 0.05
+    jid = jail.create_jail(dict(persist=None, name="www"))
+    jail.remove_jail(jid)
+
+    assert jail.get_jail(jid) is None
+    assert jail.is_jid_dying(jid) is True
+    assert jail.get_jids(dying=False) == set()
+    assert jail.get_jids(dying=True) == {jid}
+    with pytest.raises(OSError) as excinfo:
+        jail.remove_jail(jid)
+    assert excinfo.value.errno == errno.EINVAL
+
+    # the name of a dying jail may be used again
+    assert jail.create_jail(dict(persist=None, name="www")) != jid
+    assert list(jail.wait_removed([jid], timeout=1)) == [jid]
+    assert jail.is_jid_dying(jid) is False
+
+
+def test_simulator_child_jails(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    parent = jail.create_jail({"persist": None, "name": "www"})
+    with pytest.raises(PermissionError) as excinfo:
+        jail.create_jail({"persist": None, "name": "www.php"})
+    assert excinfo.value.strerror == "prison limit exceeded"
+    with pytest.raises(FileNotFoundError):
+        jail.create_jail({"persist": None, "name": "mail.php"})
+
+    jail.update_jail({"jid": parent, "children.max": 1})
+    child = jail.create_jail({"persist": None, "name": "www.php"})
+    assert jail.get_jail(child, ("parent",)) == dict(jid=child, parent=parent)
+    assert jail.get_jail(parent, ("children.cur",))["children.cur"] == 1
+
+    # the parent finishes dying after its children
+    simulator.linger = 0.05
+    jail.remove_jail(parent)
+    assert jail.is_jid_dying(child) is True
+    removed = set(jail.wait_removed([parent, child], timeout=1))
+    assert removed == {parent, child}
+    assert len(simulator.jails) == 0
+
+
+def test_simulator_attach(simulator: jail.simulator.JailSimulator) -> None:
+    jid = jail.create_jail(dict(name="www"))
+    assert jail.get_jail(jid) is None
+
+    jid = jail.set_jail(dict(name="www"), jail.JAIL_CREATE | jail.JAIL_ATTACH)
+    assert simulator.attached == jid
+    assert jail.get_jail(jid)["name"] == "www"
+
+    with pytest.raises(OSError) as excinfo:
+        jail.attach_jail(999)
+    assert excinfo.value.errno == errno.EINVAL
+
+
+def test_simulator_rejects_unknown_parameters(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    with pytest.raises(FileNotFoundError) as excinfo:
+        jail.create_jail(dict(persist=None, unknown=1))
+    assert excinfo.value.strerror == "unknown parameter: unknown"
+    assert len(simulator) == 0
+
+
+def test_simulator_injects_errors_and_latency(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    simulator.inject_error("jail_set", errno.EAGAIN, "no available jail IDs")
+    with pytest.raises(OSError) as excinfo:
+        jail.create_jail(dict(persist=None))
+    assert excinfo.value.errno == errno.EAGAIN
+    assert excinfo.value.strerror == "no available jail IDs"
+
+    simulator.latency = lambda operation: (
+        0.05 if (operation == "jail_set") else 0
+    )
+    start = time.monotonic()
+    jid = jail.create_jail(dict(persist=None))
+    assert time.monotonic() - start >= 0.05
+    assert simulator.calls["jail_set"] == 2
+    jail.remove_jail(jid)
+    assert simulator.calls["jail_remove"] == 1
+
+
+def test_simulator_install() -> None:
+    simulator = jail.simulator.install()
+    try:
+        assert jail.dll is simulator
+        assert jail.create_jail(dict(persist=None)) == 1
+    finally:
+        jail.libc.set_backend(None)
@@ -0,0 +1,113 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import pytest
+import errno
+import time
+
+import jail
+import jail.simulator
+import jail.tree
+
+
+def create_tree(width: int, depth: int, name: str="root") -> int:
+    jid = jail.create_jail({
+        "persist": None,
+        "name": name,
+        "children.max": width if (depth > 0) else 0
+    })
+    if depth > 0:
+        for i in range(width):
+            create_tree(width, depth - 1, f"{name}.{i}")
+    return jid
+
+
+def test_get_levels(simulator: jail.simulator.JailSimulator) -> None:
+    root = create_tree(2, 2)
+    other = jail.create_jail({"persist": None, "name": "other"})
+    tree, dying = jail.tree.get_tree()
+    assert dying == set()
+    assert tree[0] == [root, other]
+
+    levels = jail.tree.get_levels([root], tree)
+    assert [len(x) for x in levels] == [4, 2, 1]
+    assert levels[-1] == [root]
+    assert jail.tree.get_levels([other], tree) == [[other]]
+    assert jail.tree.get_levels([], tree) == []
+
+
+def test_remove_tree(simulator: jail.simulator.JailSimulator) -> None:
+    root = create_tree(3, 2)
+    other = jail.create_jail({"persist": None, "name": "other"})
+    simulator.linger = 0.02
+    results = jail.tree.remove_tree([root], max_workers=4, timeout=5)
+
+    assert len(results) == 13
+    assert all(x.ok for x in results)
+    assert results[-1].jid == root
+    assert jail.get_jids(dying=True) == {other}
+
+
+def test_remove_tree_is_bounded_by_depth(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    root = create_tree(22, 2)
+    assert len(simulator) == 507
+    simulator.linger = 0.05
+
+    start = time.monotonic()
+    jail.tree.remove_tree([root], max_workers=32, timeout=10)
+    assert time.monotonic() - start < 2
+    assert len(simulator.jails) == 0
+
+
+def test_remove_tree_skips_ancestors_of_failures(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    root = create_tree(1, 2)
+    simulator.inject_error("jail_remove", errno.EPERM)
+    results = jail.tree.remove_tree([root])
+
+    assert [x.errno for x in results] == [
+        errno.EPERM,
+        errno.ECANCELED,
+        errno.ECANCELED
+    ]
+    assert len(simulator) == 3
+
+
+def test_remove_tree_waits_for_dying_jails(
+    simulator: jail.simulator.JailSimulator
+) -> None:
+    root = create_tree(1, 1)
+    leaf = jail.get_jail("root.0", (), key="name")["jid"]
+    simulator.linger = 0.05
+    jail.remove_jail(leaf)
+
+    results = jail.tree.remove_tree([root], timeout=1)
+    assert [x.item for x in results] == [leaf, root]
+    assert simulator.calls["jail_remove"] == 2
+
+    with pytest.raises(TimeoutError):
+        simulator.linger = 10
+        jail.tree.remove_tree([create_tree(1, 1, "slow")], timeout=0.05)
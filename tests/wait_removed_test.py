@@ -0,0 +1,145 @@
+# Copyright (c) 2020, Stefan Grönke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import typing
+import pytest
+import asyncio
+import threading
+
+import jail
+import jail.aio
+
+
+class Clock:
+    """Fake time module for jail.wait_removed that only sleeping advances."""
+
+    now: float
+    sleeps: typing.List[float]
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class DyingJails:
+    """Stand-in for the jail enumeration while jails are being removed."""
+
+    def __init__(
+        self,
+        removal_times: dict,
+        clock: typing.Optional[typing.Callable[[], float]]=None
+    ) -> None:
+        # without a clock the removal times count enumeration passes
+        self.clock = clock
+        self.removal_times = removal_times
+        self.passes = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, dying: bool=True) -> set:
+        with self.lock:
+            elapsed = self.passes if (self.clock is None) else self.clock()
+            self.passes += 1
+        return set(
+            jid for jid, removed in self.removal_times.items()
+            if removed > elapsed
+        )
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(jail, "time", clock)
+    return clock
+
+
+def test_wait_removed_yields_as_jails_disappear(
+    monkeypatch,
+    clock: Clock
+) -> None:
+    jails = DyingJails({1: 0.05, 2: 0.0, 3: 0.1}, clock.monotonic)
+    monkeypatch.setattr(jail, "get_jids", jails)
+
+    assert list(jail.wait_removed([3, 1, 2], timeout=5)) == [2, 1, 3]
+
+
+def test_wait_removed_backs_off(monkeypatch, clock: Clock) -> None:
+    jails = DyingJails({x: 0.3 for x in range(1000)}, clock.monotonic)
+    monkeypatch.setattr(jail, "get_jids", jails)
+
+    removed = list(jail.wait_removed(range(1000), max_interval=0.05))
+    assert sorted(removed) == list(range(1000))
+    # one pass per tick for all jails instead of spinning per jail
+    assert clock.sleeps == pytest.approx(
+        [0.002, 0.004, 0.008, 0.016, 0.032] + [0.05] * 5
+    )
+    assert jails.passes == 11
+
+
+def test_wait_removed_timeout(monkeypatch, clock: Clock) -> None:
+    jails = DyingJails({1: 0.0, 2: 60}, clock.monotonic)
+    monkeypatch.setattr(jail, "get_jids", jails)
+
+    removed = []
+    with pytest.raises(TimeoutError):
+        for jid in jail.wait_removed([1, 2], timeout=0.05):
+            removed.append(jid)
+    assert removed == [1]
+    assert clock.now == pytest.approx(0.05)
+
+
+def test_aio_wait_removed_shares_one_scheduler(monkeypatch) -> None:
+    jails = DyingJails({x: x % 10 for x in range(100)})
+    monkeypatch.setattr(jail, "get_jids", jails)
+
+    async def wait(jids: list) -> list:
+        return [x async for x in jail.aio.wait_removed(jids, timeout=5)]
+
+    async def run() -> list:
+        results = await asyncio.gather(*(
+            wait(list(range(i, 100, 10))) for i in range(10)
+        ))
+        assert len(jail.aio.get_removal_scheduler()) == 0
+        return results
+
+    results = asyncio.run(run())
+    assert sorted(sum(results, [])) == list(range(100))
+    # every pass removes the jails of one coroutine
+    assert jails.passes == 10
+
+
+def test_aio_wait_removed_timeout(monkeypatch) -> None:
+    monkeypatch.setattr(jail, "get_jids", DyingJails({1: float("inf")}))
+
+    async def run() -> None:
+        async for jid in jail.aio.wait_removed([1], timeout=0.05):
+            pass
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())